@@ -1,3 +1,23 @@
-import .calibrate
-import .monochromator
-import .spectrometer
+"""Monochromator control: a Thorlabs APT stage calibrated against an Ocean
+Optics spectrometer.
+
+The motion and calibration core is imported eagerly and only needs numpy.
+The GUI and spectrometer classes (Calibrate, MPL, Spectrometer, ...) import
+tkinter, matplotlib and seabreeze, so they are loaded on first access.
+"""
+from .monochromator import APTMotor, Monochromator
+from .calibration import Calibration
+from .planner import MotionPlanner
+from .timing import PhaseTimer
+from .tracking import PeakTracker
+from .session import save_session, load_session, ScanWriter, load_scan
+
+_lazy = {'Calibrate':'.calibrate','MPL':'.calibrate','Renderer':'.calibrate',
+         'Spectrometer':'.spectrometer','selectionBox':'.spectrometer',
+         'Acquisition':'.acquisition','RingBuffer':'.acquisition'}
+
+def __getattr__(name):
+    if name in _lazy:
+        from importlib import import_module
+        return getattr(import_module(_lazy[name],__name__),name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__,name))
@@ -0,0 +1,275 @@
+"""Background acquisition of spectra, decoupled from the tk event loop
+---Classes---
+RingBuffer:
+    A fixed size, preallocated numpy buffer which holds the most recent spectra
+    and the times at which each readout started and stopped
+
+Acquisition:
+    A worker thread which continuously reads a spectrometer into a RingBuffer.
+    The GUI only ever looks at the newest frame, so the readout rate is set by
+    the detector rather than by tk event processing or redraw time. Settings
+    are handed to the worker and applied between frames, so no caller ever
+    waits for an exposure to finish
+"""
+
+#%%
+import threading
+from time import time
+import numpy as np
+#%%
+class RingBuffer:
+    '''Preallocated circular buffer of spectra
+    ---Initialization Parameters---
+        length: Number of frames held before the oldest is overwritten
+        size: Number of pixels in each frame
+        dtype: numpy dtype used to store the frames
+    ---Variables---
+    data:
+        (length,size) array holding the frames
+    start, stop:
+        (length,) arrays holding the time.time() at which each readout
+        started and finished
+    count:
+        Total number of frames ever pushed (the newest frame is in slot
+        (count-1) % length)
+    ---Methods---
+    push:
+        Copy a new frame into the buffer
+    latest:
+        Copy the newest frame out, into a caller provided array if given
+    wait:
+        Block until a frame newer than a given count arrives
+    abort:
+        Wake every waiter with an error
+    '''
+    def __init__(self,length,size,dtype=np.float64):
+        self.data = np.zeros((length,size),dtype=dtype)
+        self.start = np.zeros(length)
+        self.stop = np.zeros(length)
+        self.count = 0
+        self.error = None
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def push(self,y,start=None,stop=None):
+        '''
+        Copy frame y into the next slot, overwriting the oldest frame
+        '''
+        with self.cond:
+            i = self.count % len(self)
+            self.data[i] = y
+            self.stop[i] = time() if stop is None else stop
+            self.start[i] = self.stop[i] if start is None else start
+            self.count += 1
+            self.cond.notify_all()
+
+    def latest(self,out=None):
+        '''
+        Returns (count, start, stop, y) for the newest frame, or None if no
+        frame has been pushed yet. y is out (any dtype, it is cast), filled
+        with the frame, or a new copy if out is None
+        '''
+        with self.cond:
+            if self.count == 0:
+                return None
+            i = (self.count-1) % len(self)
+            if out is None:
+                out = self.data[i].copy()
+            else:
+                np.copyto(out,self.data[i],casting='unsafe')
+            return self.count, self.start[i], self.stop[i], out
+
+    def wait(self,count,timeout=None):
+        '''
+        Block until more than count frames have been pushed. Returns True if
+        a new frame arrived, False on timeout, and raises the error given to abort
+        '''
+        with self.cond:
+            arrived = self.cond.wait_for(lambda: self.count > count or self.error is not None,timeout)
+            if self.count <= count and self.error is not None:
+                raise self.error
+            return arrived
+
+    def abort(self,error):
+        '''
+        Make waiters raise error (None to clear it)
+        '''
+        with self.cond:
+            self.error = error
+            self.cond.notify_all()
+
+
+class Acquisition:
+    '''Streams spectra from a spectrometer into a RingBuffer on a worker thread
+    ---Initialization Parameters---
+        spec: Spectrometer instance (anything with wavelengths(), intensities()
+                and integration_time_micros(it))
+        length: Number of frames held in the ring buffer
+        dtype: Storage type of the ring buffer, e.g. np.float32 or np.uint16
+                (raw counts) to halve or quarter its size
+    ---Variables---
+    spec:
+        The underlying spectrometer. Only touch it while holding lock, or use
+        the methods below
+    buffer:
+        RingBuffer holding the most recent frames
+    lock:
+        threading.Lock serializing access to the device, held for whole readouts
+    error:
+        Exception which stopped the worker, None while it is healthy
+    temperatureEvery:
+        Seconds between reads of the detector temperature
+    processor:
+        Optional SpectrumProcessor which the worker feeds every frame
+    timer:
+        Optional timing.PhaseTimer, every readout is recorded as 'readout'
+    ---Methods---
+    start, pause:
+        Resume or suspend continuous readout
+    close:
+        Stop and join the worker thread
+    integration_time_micros:
+        Change the integration time from the next frame on
+    temperature:
+        Last detector temperature read, if the spectrometer reports one
+    next_frame:
+        Block until a frame whose exposure started after a given time is available
+    latest, next_frame and frame_buffer let a caller reuse one array for every
+    frame, so that a live view or scan runs without allocating per frame
+    '''
+    def __init__(self,spec,length=64,dtype=np.float64):
+        self.spec = spec
+        self.buffer = RingBuffer(length,len(spec.wavelengths()),dtype)
+        self.lock = threading.Lock()
+        self.processor = None
+        self.timer = None
+        self.error = None
+        self.temperatureEvery = 10
+        self.__pendingIT = None
+        self.__temperature = None
+        self.__temperatureRead = -np.inf
+        self.__running = threading.Event()
+        self.__alive = True
+        self.__thread = threading.Thread(target=self.__run,daemon=True)
+        self.__thread.start()
+
+    def __read(self):
+        # with self.lock held: apply queued settings, then read one frame
+        it, self.__pendingIT = self.__pendingIT, None
+        if it is not None:
+            self.spec.integration_time_micros(it)
+        if time()-self.__temperatureRead > self.temperatureEvery:
+            self.__temperature = self.__read_temperature()
+            self.__temperatureRead = time()
+        t0 = time()
+        y = self.spec.intensities()
+        return y, t0, time()
+
+    def __read_temperature(self):
+        try:
+            # seabreeze >= 1.0, then the older cseabreeze/pyseabreeze name
+            tec = getattr(getattr(self.spec,'f',None),'thermo_electric',None)
+            if tec is not None:
+                return float(tec.read_temperature_degrees_celsius())
+            if hasattr(self.spec,'tec_get_temperature_C'):
+                return float(self.spec.tec_get_temperature_C())
+        except Exception:
+            pass
+        return None
+
+    def __run(self):
+        while self.__alive:
+            if not self.__running.wait(0.1):
+                continue
+            try:
+                with self.lock:
+                    y, t0, t1 = self.__read()
+            except Exception as e:
+                # stop, and hand the error to whoever waits for a frame
+                self.error = e
+                self.__running.clear()
+                self.buffer.abort(e)
+                continue
+            self.buffer.push(y,t0,t1)
+            if self.processor is not None:
+                self.processor.push(y)
+            if self.timer is not None:
+                self.timer.record('readout',t1-t0)
+
+    @property
+    def running(self):
+        return self.__running.is_set()
+
+    def start(self):
+        self.error = None
+        self.buffer.abort(None)
+        self.__running.set()
+
+    def pause(self):
+        self.__running.clear()
+
+    def close(self):
+        self.__alive = False
+        self.__running.clear()
+        self.__thread.join()
+
+    def integration_time_micros(self,it):
+        '''
+        Queue a new integration time, applied before the next frame is read.
+        Returns at once; the frame in flight finishes with the old value
+        '''
+        self.__pendingIT = int(it)
+
+    def temperature(self):
+        '''
+        Returns the detector temperature (C) read at most temperatureEvery s
+        before the last frame, None if the spectrometer has no sensor
+        '''
+        return self.__temperature
+
+    def __check(self):
+        if self.error is not None:
+            raise self.error
+
+    def frame_buffer(self,dtype=None):
+        '''
+        Returns a new array shaped like one frame, to pass as out below
+        '''
+        return np.zeros(self.buffer.data.shape[1],self.buffer.data.dtype if dtype is None else dtype)
+
+    def latest(self,out=None):
+        '''
+        Returns (count, start, stop, y) for the newest frame, or None.
+        y is out if given, otherwise a new copy. Raises the error which
+        stopped the worker, if any
+        '''
+        self.__check()
+        return self.buffer.latest(out)
+
+    def next_frame(self,since=None,timeout=None,out=None):
+        '''
+        Returns a frame whose exposure started at or after time since (default now),
+        written into out if given. If the worker is paused the device is read
+        directly on the calling thread. Raises the error which stopped the worker
+        '''
+        self.__check()
+        if since is None:
+            since = time()
+        if not self.running:
+            with self.lock:
+                y, t0, t1 = self.__read()
+            if self.timer is not None:
+                self.timer.record('readout',t1-t0)
+            if out is None:
+                return y
+            np.copyto(out,y,casting='unsafe')
+            return out
+        count = self.buffer.count
+        while True:
+            if not self.buffer.wait(count,timeout):
+                raise TimeoutError("No new spectrum within {} s".format(timeout))
+            count, start, stop, y = self.buffer.latest(out)
+            if start >= since:
+                return y
@@ -0,0 +1,179 @@
+"""Unattended calibration of the monochromator
+---Classes---
+AutoCalibration:
+    Steps the stage through a list of positions with Monochromator.scan, so
+    that each move overlaps with fitting the previous spectrum, fits the line
+    at every point off the calling thread and rejects bad fits (weak, noisy,
+    saturated, implausibly narrow or wide lines, and outliers from the final
+    calibration) automatically. Given an AutoExposure, it re-exposes at every
+    point, so bright and dim lines are all fitted near the same fraction of
+    saturation instead of being rejected. Dense calibrations of 50 or more points take
+    about as long as the moves themselves
+"""
+
+#%%
+import threading
+import numpy as np
+from .fitting import fit_gauss
+#%%
+STEPS = 50 # default number of calibration points
+
+class AutoCalibration:
+    '''Background move -> settle -> acquire -> fit calibration run
+    ---Initialization Parameters---
+        mono: Monochromator to calibrate
+        acquire: Callable returning a fresh raw (unprocessed) frame
+        x: Wavelength axis of the spectra
+        settle: Seconds or SettleDetector, see Monochromator.scan
+        half: Half width (nm) of the fit window around the brightest pixel
+        minSNR: Smallest accepted amplitude / amplitude error
+        maxCenterErr: Largest accepted error on the line center (nm)
+        widthRange: Accepted range of the gauss width parameter (nm)
+        saturation: Points where any raw frame reaches this many counts are rejected
+        process: Optional callable process(acquire) building the spectrum that
+                  is fitted from raw frames, e.g. SpectrumProcessor.fill
+        outlier: Points further than this many robust standard deviations
+                  from the calibration are rejected
+        workers: Number of fitting threads
+        exposure: Optional exposure.AutoExposure which adjusts the integration
+                   time on the raw frames of every point before the spectrum
+                   is taken
+        set_it: Callable set_it(it) changing the integration time (us), needed
+                 with exposure
+        it: Integration time (us) at the start of the run, needed with exposure
+    ---Variables---
+    points:
+        List of (position, p, perr, reason) for every point, where reason is
+        None for accepted points
+    stopped:
+        threading.Event set by stop
+    it:
+        Current integration time (us) when exposure is used
+    ---Methods---
+    acquire_point:
+        Spectrum to fit and the peak raw counts it was built from
+    check:
+        Reason to reject a fit, or None
+    run:
+        Generator performing the run, yielding each point as it is fitted
+    stop:
+        End a run (from any thread) after the point in hand
+    finish:
+        Reject outliers, add the accepted points to mono and create the calibration
+    '''
+    def __init__(self,mono,acquire,x,settle=0,half=50,minSNR=20,maxCenterErr=0.05,
+                 widthRange=(0.1,20),saturation=4095,outlier=4,workers=2,process=None,
+                 exposure=None,set_it=None,it=None):
+        if exposure is not None and (set_it is None or it is None):
+            raise ValueError("set_it and it are needed to adjust the exposure")
+        self.mono = mono
+        self.acquire = acquire
+        self.x = np.asarray(x)
+        self.settle = settle
+        self.half = half
+        self.minSNR = minSNR
+        self.maxCenterErr = maxCenterErr
+        self.widthRange = widthRange
+        self.saturation = saturation
+        self.outlier = outlier
+        self.workers = workers
+        self.process = process
+        self.exposure = exposure
+        self.set_it = set_it
+        self.it = it
+        self.points = []
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def acquire_point(self):
+        '''
+        Returns (spectrum, peak raw counts): saturation is judged on the raw
+        frames, before dark subtraction or averaging can hide it. With
+        exposure, the integration time is brought on target first
+        '''
+        if self.exposure is not None:
+            def set_it(it):
+                self.set_it(it)
+                self.it = it
+            self.exposure.converge(self.acquire,set_it,self.it)
+        peak = [-np.inf]
+        def raw():
+            y = self.acquire()
+            peak[0] = max(peak[0],np.max(y))
+            return y
+        y = raw() if self.process is None else self.process(raw)
+        return y, peak[0]
+
+    def fit(self,pos,y):
+        '''
+        Fit the brightest line in y, returns (p, perr)
+        '''
+        return fit_gauss(self.x,y,x0=self.x[np.argmax(y)],half=self.half)
+
+    def check(self,p,perr,peak):
+        '''
+        Returns a short reason to reject the fit, or None if it is good
+        '''
+        if not np.all(np.isfinite(perr)):
+            return "degenerate fit"
+        if peak >= self.saturation:
+            return "saturated"
+        if abs(p[1]) < self.minSNR*perr[1]:
+            return "weak line"
+        if perr[2] > self.maxCenterErr:
+            return "uncertain center"
+        if not self.widthRange[0] <= p[3] <= self.widthRange[1]:
+            return "bad width"
+        if not self.x[0] <= p[2] <= self.x[-1]:
+            return "center off detector"
+        return None
+
+    def run(self,positions):
+        '''
+        Visit positions (mm) in ascending order, yielding
+        (position, p, perr, reason, spectrum) as each fit completes, until
+        they are done or stop is called
+        '''
+        self.points = []
+        self.stopped.clear()
+        def keep(pos,point):
+            # a settle detector that acquires hands back a bare raw frame
+            y, peak = point if isinstance(point,tuple) else (point,np.max(point))
+            return (y,peak)+self.fit(pos,y)
+        scan = self.mono.scan(positions,self.acquire_point,keep,settle=self.settle,
+                              workers=self.workers,plan='sorted',units='mm')
+        try:
+            for target, pos, (y, peak, p, perr) in scan:
+                if self.stopped.is_set():
+                    return
+                reason = self.check(p,perr,peak)
+                self.points.append((pos,p,perr,reason))
+                yield pos, p, perr, reason, y
+        finally:
+            # stops the stage after the point it is on
+            scan.close()
+
+    def finish(self,model='linear',deg=None):
+        '''
+        Fit the accepted points, reject outliers (once), and load the result
+        into mono as its calibration. Returns the number of points used
+        '''
+        good = [i for i,pt in enumerate(self.points) if pt[3] is None]
+        if len(good) < 2:
+            raise RuntimeError("Only {} good calibration points".format(len(good)))
+        pos = np.array([self.points[i][0] for i in good])
+        wave = np.array([self.points[i][1][2] for i in good])
+        resid = pos-np.polyval(np.polyfit(wave,pos,1),wave)
+        mad = 1.4826*np.median(np.abs(resid-np.median(resid)))
+        if mad > 0 and len(good) > 3:
+            for i,r in zip(good,resid):
+                if abs(r) > self.outlier*mad:
+                    self.points[i] = self.points[i][:3]+("outlier",)
+        self.mono.reset_calibration()
+        for pos, p, perr, reason in self.points:
+            if reason is None:
+                self.mono.add_point(pos,p[2],p[3])
+        self.mono.create_calibration(model,deg)
+        return sum(pt[3] is None for pt in self.points)
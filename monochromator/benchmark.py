@@ -0,0 +1,115 @@
+"""Throughput benchmarks on the simulated hardware in simulate.py
+
+    python -m monochromator.benchmark [--timescale 0] [--n 200]
+
+With the default timescale of 0 the simulated stage and detector take no
+time at all, so the numbers measure the software overhead of each stage
+of a measurement: acquisition, moves, peak fitting and calibration.
+Use --timescale 1 to run against the real-time hardware model instead.
+"""
+
+#%%
+import argparse
+from time import perf_counter
+import numpy as np
+from .monochromator import Monochromator
+from .calibration import Calibration
+from .acquisition import Acquisition
+from .fitting import fit_gauss, fit_gauss_batch
+from .simulate import SimulatedAPT, SimulatedSpectrometer
+#%%
+def simulated_setup(timescale=0.0,seed=0):
+    '''
+    Returns a (Monochromator, SimulatedSpectrometer) pair on a simulated stage
+    whose true calibration is 0.04 mm/nm
+    '''
+    stage = SimulatedAPT(timescale=timescale,position=15.0)
+    truth = Calibration([400,800],[31.0,15.0])
+    mono = Monochromator(aptdll=stage)
+    spec = SimulatedSpectrometer(stage,truth.to_wave,seed=seed)
+    spec.integration_time_micros(10000)
+    mono.reset_calibration()
+    for lam in np.linspace(420,780,5):
+        mono.add_point(truth.to_pos(lam),lam,1.0)
+    mono.create_calibration()
+    return mono, spec
+
+def timed(f,n):
+    '''
+    Call f() n times, returning calls per second
+    '''
+    t0 = perf_counter()
+    for _ in range(n):
+        f()
+    return n/(perf_counter()-t0)
+
+def bench_acquisition(mono,spec,n):
+    acq = Acquisition(spec)
+    acq.start()
+    count = acq.buffer.count
+    t0 = perf_counter()
+    while acq.buffer.count < count+n:
+        acq.buffer.wait(acq.buffer.count,timeout=1)
+    rate = (acq.buffer.count-count)/(perf_counter()-t0)
+    acq.close()
+    return {'frames/s':rate}
+
+def bench_moves(mono,spec,n):
+    rng = np.random.default_rng(0)
+    waves = rng.uniform(420,780,n)
+    visits = iter(waves[rng.integers(n,size=n)])
+    rate = timed(lambda: mono.go_to_wave(next(visits)),n)
+    ordered, predicted = mono.plan_scan(waves)
+    t0 = perf_counter()
+    for lam in ordered:
+        mono.go_to_wave(lam)
+    return {'moves/s':rate,'planned moves/s':n/(perf_counter()-t0),
+            'predicted hardware s':predicted}
+
+def bench_fit(mono,spec,n):
+    x = spec.wavelengths()
+    mono.go_to_wave(600)
+    y = spec.intensities()
+    x0 = x[np.argmax(y)]
+    return {'fits/s':timed(lambda: fit_gauss(x,y,x0=x0,half=50),n)}
+
+def bench_batch_fit(mono,spec,n):
+    x = spec.wavelengths()
+    mono.go_to_wave(600)
+    y = np.array([spec.intensities() for _ in range(n)])
+    seeds = [x[np.argmax(y[0])]]
+    t0 = perf_counter()
+    fit_gauss_batch(x,y,seeds,half=20)
+    batch = n/(perf_counter()-t0)
+    t0 = perf_counter()
+    for yi in y:
+        fit_gauss(x,yi,x0=seeds[0],half=20)
+    return {'batched fits/s':batch,'looped fits/s':n/(perf_counter()-t0)}
+
+def bench_calibration(mono,spec,n):
+    pos, wave = mono.calibration.pos, mono.calibration.wave
+    waves = np.linspace(400,800,10000)
+    out = {}
+    for model in ('linear','poly','spline'):
+        cal = Calibration(wave,pos,model,deg=3 if model == 'poly' else None)
+        out[model+' builds/s'] = timed(lambda: Calibration(wave,pos,model,deg=3 if model == 'poly' else None),max(n//10,1))
+        out[model+' 10k conversions/s'] = timed(lambda: cal.to_wave(cal.to_pos(waves)),n)
+    return out
+
+BENCHMARKS = {'acquisition':bench_acquisition,'moves':bench_moves,
+              'fit':bench_fit,'batch fit':bench_batch_fit,'calibration':bench_calibration}
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--timescale',type=float,default=0.0)
+    parser.add_argument('--n',type=int,default=200)
+    parser.add_argument('benchmarks',nargs='*',default=list(BENCHMARKS))
+    args = parser.parse_args(args)
+    mono, spec = simulated_setup(args.timescale)
+    for name in args.benchmarks:
+        for k,v in BENCHMARKS[name](mono,spec,args.n).items():
+            print("{0:<12} {1:<28} {2:>12.1f}".format(name,k,v))
+    mono.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,239 +1,799 @@
-#%%
-import tkinter as tk
-import os
-from time import sleep
-from tkinter import messagebox
-from tkinter import filedialog
-from spectrometer import Spectrometer
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-from scipy.optimize import minimize
-def gauss(x,p):
-    return np.abs(p[0])+np.abs(p[1])*np.exp(-((x-p[2])/p[3])**2)
-
-class Calibrate(tk.Frame):
-    def __init__(self,monochromator):
-        tk.Frame.__init__(self,None)
-        self.master.title("Calibration Window")
-        self.master.protocol("WM_DELETE_WINDOW", lambda : self.master.destroy())
-        if not messagebox.askyesno("Title","Create a new calibration file?"):
-            fname = filedialog.askopenfilename(title="Load Calibration File",
-                                               initialdir = os.getcwd(),
-                                               filetypes = (("calibration files","*.cal"),("all files","*.*")))
-            monochromator.load_calibration_points(fname)
-            self.master.destroy()
-        else:
-            self.spec = Spectrometer()
-            self.specRunning = True
-            self.mono = monochromator
-            self.mono.reset_calibration()
-            self.create_widgets()
-            self.start_aquisition()
-            self.mainloop()
-            self.spec.close()
-        
-    def create_widgets(self):
-        # Create MPL Figure
-        self.mpl = MPL(self.master,
-                       self.spec.wavelengths(),self.spec.intensities(),
-                       #np.arange(0,100,0.1),gauss(np.arange(0,100,0.1),[200,2700,40,5]),
-                       #self.spec.wavelengths,self.spec.intensities,
-                       column=0,row=2,columnspan=2)
-        
-        # Create Spectrometer control window
-        self.specFrame = tk.LabelFrame(self.master,text="Spectrometer Controls")
-        self.specFrame.grid(column=0,row=0)
-        self.ITLabel = tk.Label(self.specFrame,text="IT (ms)")
-        self.ITLabel.grid(column=0,row=0,sticky=tk.E)
-        self.ITvariable = tk.StringVar()
-        self.set_IT(20)
-        self.ITEntry = tk.Entry(self.specFrame,
-                                textvariable=self.ITvariable,
-                                width=6)
-        self.ITEntry.grid(column=1,row=0)
-        self.ITUpdateButton = tk.Button(self.specFrame,text="Update",
-                                        command=lambda: self.set_IT(self.ITvariable.get()))
-        self.ITUpdateButton.grid(column=2,row=0,sticky=tk.W)
-        self.PPLabel = tk.Label(self.specFrame,text="Aquire:")
-        self.PPLabel.grid(column=0,row=1,sticky=tk.E)
-        self.playButton = tk.Button(self.specFrame,text="Play",
-                                    command=lambda: self.start_aquisition())
-        self.playButton.grid(column=1,row=1)
-        self.pauseButton = tk.Button(self.specFrame,text="Pause",
-                                    command=lambda: self.stop_aquisition())
-        self.pauseButton.grid(column=2,row=1)
-        
-        # Create calibration setup
-        self.calFrame = tk.LabelFrame(self.master,text="Spectrometer Controls")
-        self.calFrame.grid(column=1,row=0)
-        self.PosLabel = tk.Label(self.calFrame,text="Starting Position:")
-        self.PosLabel.grid(column=0,row=0,sticky=tk.E)
-        self.Posvariable = tk.StringVar()
-        self.set_Pos(self.mono.lower_bound)
-        self.PosEntry = tk.Entry(self.calFrame,
-                                textvariable=self.Posvariable,
-                                width=6)
-        self.PosEntry.grid(column=1,row=0)
-        self.PosUpdateButton = tk.Button(self.calFrame,text="Move",
-                                        command=lambda: self.set_Pos(self.Posvariable.get()))
-        self.PosUpdateButton.grid(column=2,row=0,sticky=tk.W)
-        self.stepLabel = tk.Label(self.calFrame,text="Number of Steps:")
-        self.stepLabel.grid(column=0,row=1,sticky=tk.E)
-        self.Stepvariable = tk.StringVar()
-        self.Stepvariable.set("3")
-        self.StepEntry = tk.Entry(self.calFrame,
-                                textvariable=self.Stepvariable,
-                                width=6)
-        self.StepEntry.grid(column=1,row=1)
-        self.startCalButton = tk.Button(self.calFrame,
-                                         text="Start Calibration",
-                                         command = lambda: self.start_calibration())
-        self.startCalButton.grid(column=0,row=2)
-        self.nextButton = tk.Button(self.calFrame,
-                                    text="Next Position",
-                                    command = lambda: self.next_position())
-        self.nextButton.grid(column=1,row=2)
-        self.nextButton.config(state='disabled')
-        
-        
-    def set_IT(self,IT):
-        try:
-            it = int(IT)*1000
-        except:
-            it = 100*1000
-        if it<10*1000:
-            it = 10*1000
-        elif it>10*1000*1000:
-            it = 10*1000*1000
-        self.spec.integration_time_micros(it)
-        self.ITvariable.set(str(it//1000))
-        self.mpl.update_spectrum(self.spec.intensities())
-    
-    def set_Pos(self,POS):
-        try:
-            pos = int(POS)
-        except:
-            pos = 100
-        if pos<0:
-            pos = 0
-        elif pos>150:
-            pos = 150
-        self.mono.set_lower_bound(pos)
-        self.Posvariable.set(str(pos))
-        self.mono.move(self.mono.lower_bound)
-        
-    def start_aquisition(self):
-        self.specRunning = True
-        self.aquire()
-    
-    def aquire(self):
-#        y = self.mpl.spectrum.get_ydata()
-        self.mpl.update_spectrum(self.spec.intensities())#(0.99*y)
-        if self.specRunning:
-            self.master.after(0,self.aquire)
-            
-    def stop_aquisition(self):
-        self.specRunning = False
-        
-    def start_calibration(self):
-        self.stop_aquisition()
-        self.playButton.config(state="disabled")
-        self.pauseButton.config(state="disabled")
-        self.PosUpdateButton.config(state="disabled")
-        self.startCalButton.config(state="disabled")
-        self.nextButton.config(state='normal')
-        try:
-            n = int(self.Stepvariable.get())
-        except:
-            n = 5
-        if n<2:
-            n = 2
-        elif n>10:
-            n = 10
-        self.mmSpace = list(self.mono.lower_bound-np.linspace(5,31-4,n))
-        self.mono.move(self.mmSpace.pop(0))
-        sleep(0.1)
-        self.mpl.update_spectrum(self.spec.intensities())
-        self.mpl.gen_fit()
-        
-    def next_position(self):
-        self.mono.add_point(self.mono.mot.getPos(),*self.mpl.p[-2:])
-        try:
-            mm = self.mmSpace.pop(0)
-        except IndexError:
-            self.save_calibration_file()
-            self.master.destroy()
-        else:
-            self.mono.move(mm)
-            sleep(0.1)
-            self.mpl.update_spectrum(self.spec.intensities())
-            self.mpl.gen_fit()
-        
-    
-    def save_calibration_file(self):
-        path = filedialog.askdirectory(initialdir = os.getcwd(),
-                                      title= "Calibration File Directory")
-        self.mono.save_calibration_points(path)
-    
-    
-class MPL:
-    def __init__(self,master,x,y,p=[0,0,500,5],**kwargs):
-        self.x = x
-        self.p = np.array(p)
-        
-        # Create tk Frame to hold MPL plot
-        self.frame = tk.Frame(master)
-        self.frame.grid(**kwargs)
-        
-        # Create MPL figure
-        self.fig = plt.figure(figsize=(10,5))
-        self.ax = self.fig.add_subplot(111)
-        self.spectrum, = self.ax.plot(x,y,color="blue")
-        self.ax.set_xlabel("Wavelength (nm)")
-        self.ax.set_ylabel("Counts")
-        self.ax.set_ylim(0,4000)
-        
-        # Attached MPL figure and toolbar to tk Frame
-        self.canvas = FigureCanvasTkAgg(self.fig,self.frame)
-        self.canvas.get_tk_widget().pack()
-        self.toolbar = NavigationToolbar2Tk(self.canvas,self.frame)
-        self.toolbar.update()
-        
-        # initialize fit
-        self.fit, = self.ax.plot(x,gauss(x,self.p),color="black")
-        
-        # Setup MPL click collbacks
-        self.canvas.mpl_connect('button_press_event',self.click)
-        
-    def click(self,event):
-        if event.inaxes == self.ax:
-            if event.button == 1:
-                print("Left click @ x=",event.xdata," y=",event.ydata)
-                self.p[1],self.p[2] = event.ydata,event.xdata
-                self.update_fit()
-            if event.button == 2:
-                print("Scroll click @ x=",event.xdata," y=",event.ydata)
-            if event.button == 3:
-                print("Right click @ x=",event.xdata," y=",event.ydata)
-                self.gen_fit()
-    
-    def update_fit(self):
-        self.fit.set_ydata(gauss(self.x,self.p))
-        self.fig.canvas.draw()
-        
-    def update_spectrum(self,y):
-        self.spectrum.set_ydata(y)
-        self.fig.canvas.draw()
-        
-    def gen_fit(self):
-        y = self.spectrum.get_ydata()
-        x0 = self.x[np.argmax(y)]
-        y0 = np.max(y)
-        mask = np.array(np.abs(self.x-x0)<50)
-        def diff(p):
-            return np.sum((y[mask]-gauss(self.x,p)[mask])**2)
-        fit = minimize(diff,[y[0],y0,x0,1])
-#        print(fit)
-        self.p = np.copy(fit.x)
+#%%
+import tkinter as tk
+import os
+import threading
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from tkinter import messagebox
+from tkinter import filedialog
+from .acquisition import Acquisition
+from .fitting import gauss, fit_gauss
+from .settle import SettleDetector
+from .processing import SpectrumProcessor
+from .darks import DarkCache
+from .exposure import AutoExposure
+from .autocal import AutoCalibration, STEPS
+from .timing import PhaseTimer
+from .tracking import PeakTracker
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+class Calibrate(tk.Frame):
+    def __init__(self,monochromator,spectrometer=None,darkFile=None):
+        tk.Frame.__init__(self,None)
+        self.master.title("Calibration Window")
+        self.master.protocol("WM_DELETE_WINDOW", lambda : self.master.destroy())
+        if not messagebox.askyesno("Title","Create a new calibration file?"):
+            fname = filedialog.askopenfilename(title="Load Calibration File",
+                                               initialdir = os.getcwd(),
+                                               filetypes = (("calibration files","*.npz *.cal"),("all files","*.*")))
+            monochromator.load_calibration_points(fname)
+            self.master.destroy()
+        else:
+            if spectrometer is None:
+                from .spectrometer import Spectrometer
+                spectrometer = Spectrometer()
+            self.spec = spectrometer
+            self.acq = Acquisition(self.spec)
+            self.proc = SpectrumProcessor(len(self.spec.wavelengths()))
+            self.acq.processor = self.proc
+            # readout, move, fit and draw latencies for the status bar
+            self.timing = PhaseTimer()
+            self.acq.timer = self.timing
+            monochromator.mot.timer = self.timing
+            # darks persist between sessions, one file per spectrometer
+            if darkFile is None:
+                darkFile = os.path.join(os.path.expanduser("~"),".monochromator",
+                                        "darks_{}.npz".format(getattr(self.spec,"serial_number","default")))
+            self.darks = DarkCache(darkFile,maxTempDelta=2.0)
+            self.exposure = AutoExposure()
+            self.ITchanged = 0
+            self.rawFrame = np.zeros(len(self.spec.wavelengths()))
+            self.settle = SettleDetector(monochromator.mot.getPos,self.acq.next_frame,
+                                         self.spec.wavelengths())
+            self.specRunning = False
+            self.procBusy = False # a worker is building spectra with self.proc
+            self.refresh = 20 # ms between checks for a new frame
+            self.lastFrame = 0
+            self.liveFrame = np.zeros(len(self.spec.wavelengths())) # reused for every live frame
+            self.mono = monochromator
+            self.mono.reset_calibration()
+            self.create_widgets()
+            self.start_aquisition()
+            self.calThread = None
+            self.mainloop()
+            self.mpl.fitter.shutdown(wait=False)
+            # the window may close mid run: stop using the devices before closing them
+            if self.calThread is not None:
+                self.autocal.stop()
+                self.calThread.join()
+            self.mono.mot.mover.submit(lambda: None).result()
+            self.acq.close()
+            self.spec.close()
+        
+    def create_widgets(self):
+        # Create MPL Figure
+        self.mpl = MPL(self.master,
+                       self.spec.wavelengths(),self.spec.intensities(),
+                       #np.arange(0,100,0.1),gauss(np.arange(0,100,0.1),[200,2700,40,5]),
+                       #self.spec.wavelengths,self.spec.intensities,
+                       column=0,row=2,columnspan=2)
+        self.mpl.timer = self.timing
+        self.mpl.renderer.timer = self.timing
+        
+        # Create timing status bar
+        self.statusFrame = tk.Frame(self.master)
+        self.statusFrame.grid(column=0,row=3,columnspan=2,sticky=tk.EW)
+        self.timingvariable = tk.StringVar()
+        self.timingLabel = tk.Label(self.statusFrame,textvariable=self.timingvariable,anchor=tk.W)
+        self.timingLabel.pack(side=tk.LEFT,fill=tk.X,expand=True)
+        self.timingExportButton = tk.Button(self.statusFrame,text="Export Timing",
+                                            command=lambda: self.export_timing())
+        self.timingExportButton.pack(side=tk.RIGHT)
+        self.timingResetButton = tk.Button(self.statusFrame,text="Reset",
+                                           command=lambda: self.timing.reset())
+        self.timingResetButton.pack(side=tk.RIGHT)
+        self.update_timing()
+        
+        # Create Spectrometer control window
+        self.specFrame = tk.LabelFrame(self.master,text="Spectrometer Controls")
+        self.specFrame.grid(column=0,row=0)
+        self.ITLabel = tk.Label(self.specFrame,text="IT (ms)")
+        self.ITLabel.grid(column=0,row=0,sticky=tk.E)
+        self.ITvariable = tk.StringVar()
+        self.darkvariable = tk.StringVar(value="Take Dark")
+        self.set_IT(20,refresh=False)
+        self.ITEntry = tk.Entry(self.specFrame,
+                                textvariable=self.ITvariable,
+                                width=6)
+        self.ITEntry.grid(column=1,row=0)
+        self.ITUpdateButton = tk.Button(self.specFrame,text="Update",
+                                        command=lambda: self.set_IT(self.ITvariable.get()))
+        self.ITUpdateButton.grid(column=2,row=0,sticky=tk.W)
+        self.autoITvariable = tk.IntVar()
+        self.autoITButton = tk.Checkbutton(self.specFrame,text="Auto",
+                                           variable=self.autoITvariable)
+        self.autoITButton.grid(column=3,row=0,sticky=tk.W)
+        self.PPLabel = tk.Label(self.specFrame,text="Aquire:")
+        self.PPLabel.grid(column=0,row=1,sticky=tk.E)
+        self.playButton = tk.Button(self.specFrame,text="Play",
+                                    command=lambda: self.start_aquisition())
+        self.playButton.grid(column=1,row=1)
+        self.pauseButton = tk.Button(self.specFrame,text="Pause",
+                                    command=lambda: self.stop_aquisition())
+        self.pauseButton.grid(column=2,row=1)
+        self.avgLabel = tk.Label(self.specFrame,text="Average:")
+        self.avgLabel.grid(column=0,row=2,sticky=tk.E)
+        self.avgModevariable = tk.StringVar()
+        self.avgModevariable.set(self.proc.mode)
+        self.avgModeMenu = tk.OptionMenu(self.specFrame,self.avgModevariable,
+                                         *SpectrumProcessor.MODES,
+                                         command=lambda mode: self.set_processing(mode,self.avgNvariable.get()))
+        self.avgModeMenu.grid(column=1,row=2)
+        self.avgNvariable = tk.StringVar()
+        self.avgNvariable.set(str(self.proc.n))
+        self.avgNEntry = tk.Entry(self.specFrame,
+                                  textvariable=self.avgNvariable,
+                                  width=6)
+        self.avgNEntry.grid(column=2,row=2)
+        self.avgNEntry.bind("<Return>",lambda e: self.set_processing(self.avgModevariable.get(),self.avgNvariable.get()))
+        self.darkButton = tk.Button(self.specFrame,textvariable=self.darkvariable,
+                                    command=lambda: self.take_dark())
+        self.darkButton.grid(column=1,row=3)
+        self.clearDarkButton = tk.Button(self.specFrame,text="Clear Dark",
+                                         command=lambda: self.proc.set_dark(None))
+        self.clearDarkButton.grid(column=2,row=3)
+        self.trackvariable = tk.IntVar()
+        self.trackButton = tk.Checkbutton(self.specFrame,text="Track Peak",
+                                          variable=self.trackvariable,
+                                          command=lambda: self.set_tracking(self.trackvariable.get()))
+        self.trackButton.grid(column=1,row=4,columnspan=2,sticky=tk.W)
+        
+        # Create calibration setup
+        self.calFrame = tk.LabelFrame(self.master,text="Spectrometer Controls")
+        self.calFrame.grid(column=1,row=0)
+        self.PosLabel = tk.Label(self.calFrame,text="Starting Position:")
+        self.PosLabel.grid(column=0,row=0,sticky=tk.E)
+        self.Posvariable = tk.StringVar()
+        self.set_Pos(self.mono.lower_bound)
+        self.PosEntry = tk.Entry(self.calFrame,
+                                textvariable=self.Posvariable,
+                                width=6)
+        self.PosEntry.grid(column=1,row=0)
+        self.PosUpdateButton = tk.Button(self.calFrame,text="Move",
+                                        command=lambda: self.set_Pos(self.Posvariable.get()))
+        self.PosUpdateButton.grid(column=2,row=0,sticky=tk.W)
+        self.stepLabel = tk.Label(self.calFrame,text="Number of Steps:")
+        self.stepLabel.grid(column=0,row=1,sticky=tk.E)
+        self.Stepvariable = tk.StringVar()
+        self.Stepvariable.set("3")
+        self.StepEntry = tk.Entry(self.calFrame,
+                                textvariable=self.Stepvariable,
+                                width=6)
+        self.StepEntry.grid(column=1,row=1)
+        self.startCalButton = tk.Button(self.calFrame,
+                                         text="Start Calibration",
+                                         command = lambda: self.start_calibration())
+        self.startCalButton.grid(column=0,row=2)
+        self.nextButton = tk.Button(self.calFrame,
+                                    text="Next Position",
+                                    command = lambda: self.next_position())
+        self.nextButton.grid(column=1,row=2)
+        self.autoCalButton = tk.Button(self.calFrame,
+                                       text="Auto Calibrate",
+                                       command = lambda: self.start_auto_calibration())
+        self.autoCalButton.grid(column=2,row=2)
+        self.stopCalButton = tk.Button(self.calFrame,
+                                       text="Stop",
+                                       command = lambda: self.autocal.stop())
+        self.stopCalButton.grid(column=2,row=3)
+        self.stopCalButton.config(state='disabled')
+        self.autoStepLabel = tk.Label(self.calFrame,text="Auto Calibration Steps:")
+        self.autoStepLabel.grid(column=0,row=3,sticky=tk.E)
+        self.autoStepvariable = tk.StringVar()
+        self.autoStepvariable.set(str(STEPS))
+        self.autoStepEntry = tk.Entry(self.calFrame,
+                                      textvariable=self.autoStepvariable,
+                                      width=6)
+        self.autoStepEntry.grid(column=1,row=3)
+        self.calStatusvariable = tk.StringVar()
+        self.calStatusLabel = tk.Label(self.calFrame,textvariable=self.calStatusvariable)
+        self.calStatusLabel.grid(column=0,row=4,columnspan=3)
+        self.nextButton.config(state='disabled')
+        
+        
+    def set_IT(self,IT,refresh=True):
+        try:
+            it = int(IT)*1000
+        except:
+            it = 100*1000
+        if it<10*1000:
+            it = 10*1000
+        elif it>10*1000*1000:
+            it = 10*1000*1000
+        self.acq.integration_time_micros(it) # applied by the worker, before its next frame
+        self.IT = it
+        self.ITchanged = time()
+        self.ITvariable.set(str(it//1000))
+        # swap in the cached (or interpolated) dark for the new integration
+        # time, an average over the old one is invalid
+        self.update_dark()
+        self.proc.reset()
+        if refresh and not self.specRunning:
+            self.refresh_spectrum()
+        
+    def refresh_spectrum(self):
+        # While paused, show one spectrum at the new settings, built on the
+        # mover thread as it may take several long exposures
+        self.set_spectrometer_controls("disabled")
+        self.wait_for_spectrum(self.mono.mot.mover.submit(self.proc.fill,self.acq.next_frame))
+        
+    def wait_for_spectrum(self,future):
+        if not future.done():
+            self.master.after(20,self.wait_for_spectrum,future)
+            return
+        self.set_spectrometer_controls("normal")
+        try:
+            self.mpl.update_spectrum(future.result())
+        except Exception as e:
+            messagebox.showerror("Spectrometer",str(e))
+    
+    def set_processing(self,mode,N):
+        try:
+            n = int(N)
+        except:
+            n = 1
+        if n<1:
+            n = 1
+        elif n>1000:
+            n = 1000
+        self.proc.configure(mode,n)
+        self.avgNvariable.set(str(n))
+        
+    def auto_exposure(self):
+        # Judge only raw frames whose exposure started at the current setting
+        if self.procBusy:
+            return
+        frame = self.acq.latest(out=self.rawFrame)
+        if frame is None or frame[1] < self.ITchanged:
+            return
+        it = self.exposure.next_it(self.IT,self.rawFrame)
+        if it is not None and it//1000 != self.IT//1000:
+            self.set_IT(it//1000)
+        
+    def set_tracking(self,on):
+        self.trackvariable.set(int(bool(on)))
+        if on and not self.mpl.tracking:
+            self.mpl.start_tracking()
+        elif not on and self.mpl.tracking:
+            self.mpl.stop_tracking()
+        
+    def update_timing(self):
+        self.timingvariable.set(self.timing.summary())
+        self.master.after(500,self.update_timing)
+        
+    def export_timing(self):
+        fname = filedialog.asksaveasfilename(title="Export Timing",
+                                             initialdir = os.getcwd(),
+                                             defaultextension=".csv",
+                                             filetypes = (("csv files","*.csv"),("json files","*.json")))
+        if not fname:
+            return
+        if fname.endswith(".json"):
+            self.timing.to_json(fname)
+        else:
+            self.timing.to_csv(fname)
+        
+    def update_dark(self):
+        # Darks from another detector temperature, or outside the cached
+        # integration times, are not used: the button asks for a fresh one
+        dark = self.darks.get(self.IT,self.acq.temperature())
+        self.proc.set_dark(dark)
+        self.darkvariable.set("Take Dark" if dark is not None else "Take Dark (!)")
+        
+    def take_dark(self):
+        # Average at least 5 raw frames on the mover thread, the light path
+        # should be blocked. At long integration times this takes minutes
+        self.set_spectrometer_controls("disabled")
+        self.darkvariable.set("Taking Dark...")
+        dark = SpectrumProcessor(self.proc.size,'mean',n=max(self.proc.n,5))
+        self.wait_for_dark(self.mono.mot.mover.submit(dark.fill,self.acq.next_frame),self.IT)
+        
+    def wait_for_dark(self,future,it):
+        if not future.done():
+            self.master.after(20,self.wait_for_dark,future,it)
+            return
+        self.set_spectrometer_controls("normal")
+        try:
+            dark = future.result()
+        except Exception as e:
+            self.update_dark()
+            messagebox.showerror("Dark",str(e))
+            return
+        self.darks.add(it,dark,self.acq.temperature())
+        self.darks.save()
+        self.update_dark()
+        self.proc.reset()
+    
+    def set_Pos(self,POS):
+        try:
+            pos = int(POS)
+        except:
+            pos = 100
+        if pos<0:
+            pos = 0
+        elif pos>150:
+            pos = 150
+        self.mono.set_lower_bound(pos)
+        self.Posvariable.set(str(pos))
+        self.mono.move(self.mono.lower_bound)
+        
+    def start_aquisition(self):
+        if self.specRunning or self.procBusy:
+            return
+        self.specRunning = True
+        self.acq.start()
+        self.aquire()
+    
+    def aquire(self):
+        # Readout and averaging happen on the acquisition thread, only draw
+        # the newest processed frame
+        if self.acq.error is not None:
+            self.stop_aquisition()
+            messagebox.showerror("Spectrometer","Readout failed: {}".format(self.acq.error))
+            return
+        count, y = self.proc.latest(out=self.liveFrame)
+        if count != self.lastFrame:
+            self.lastFrame = count
+            self.mpl.update_spectrum(y)
+            self.trackvariable.set(int(self.mpl.tracking)) # a middle click also starts tracking
+            if self.autoITvariable.get():
+                self.auto_exposure()
+        if self.specRunning:
+            self.master.after(self.refresh,self.aquire)
+            
+    def stop_aquisition(self):
+        self.specRunning = False
+        self.acq.pause()
+        
+    def start_calibration(self):
+        self.stop_aquisition()
+        self.set_tracking(False)
+        self.trackButton.config(state="disabled")
+        self.playButton.config(state="disabled")
+        self.pauseButton.config(state="disabled")
+        self.PosUpdateButton.config(state="disabled")
+        self.startCalButton.config(state="disabled")
+        self.autoCalButton.config(state="disabled")
+        self.nextButton.config(state='normal')
+        try:
+            n = int(self.Stepvariable.get())
+        except:
+            n = 5
+        if n<2:
+            n = 2
+        elif n>10:
+            n = 10
+        self.mmSpace = list(self.mono.lower_bound-np.linspace(5,31-4,n))
+        self.spectra, self.positions = [], []
+        self.move_and_fit(self.mmSpace.pop(0))
+        
+    def start_auto_calibration(self):
+        self.stop_aquisition()
+        self.set_tracking(False)
+        self.set_auto_calibration_controls("disabled")
+        try:
+            n = int(self.autoStepvariable.get())
+        except:
+            n = STEPS
+        if n<2:
+            n = 2
+        elif n>500:
+            n = 500
+        positions = self.mono.lower_bound-np.linspace(5,31-4,n)
+        self.spectra, self.positions = [], []
+        # Moves, acquisition and fits all happen off the tk thread
+        self.autocal = AutoCalibration(self.mono,self.acq.next_frame,self.mpl.x,
+                                       settle=SettleDetector(self.mono.mot.getPos),
+                                       half=self.mpl.half,process=self.proc.fill,
+                                       exposure=self.exposure if self.autoITvariable.get() else None,
+                                       set_it=self.set_run_IT,it=self.IT)
+        self.calResults = Queue()
+        def run():
+            try:
+                for point in self.autocal.run(positions):
+                    self.calResults.put(point)
+            except Exception as e:
+                self.calResults.put(e)
+            else:
+                self.calResults.put(None)
+        self.calThread = threading.Thread(target=run,daemon=True)
+        self.calThread.start()
+        self.poll_auto_calibration(n)
+        
+    def set_run_IT(self,it):
+        # Called on the auto calibration thread, between points. The tk
+        # side (self.IT and the entry) follows in poll_auto_calibration
+        self.acq.integration_time_micros(it)
+        self.proc.set_dark(self.darks.get(it,self.acq.temperature()))
+        
+    def set_spectrometer_controls(self,state):
+        # everything which changes self.proc or the integration time, while
+        # a worker builds spectra with them
+        self.procBusy = state == "disabled"
+        for b in (self.ITEntry,self.ITUpdateButton,self.autoITButton,self.avgModeMenu,
+                  self.avgNEntry,self.darkButton,self.clearDarkButton):
+            b.config(state=state)
+        
+    def set_auto_calibration_controls(self,state):
+        for b in (self.playButton,self.pauseButton,self.PosUpdateButton,self.startCalButton,
+                  self.autoCalButton,self.trackButton,self.autoStepEntry):
+            b.config(state=state)
+        self.set_spectrometer_controls(state)
+        self.stopCalButton.config(state="normal" if state == "disabled" else "disabled")
+        self.nextButton.config(state="disabled")
+        
+    def poll_auto_calibration(self,n):
+        # the controls come back unless the run is still going or the window closed
+        reenable = True
+        try:
+            while True:
+                try:
+                    point = self.calResults.get_nowait()
+                except Empty:
+                    reenable = False
+                    self.master.after(20,self.poll_auto_calibration,n)
+                    return
+                if point is None:
+                    break
+                if isinstance(point,Exception):
+                    raise point
+                if self.autocal.stopped.is_set():
+                    continue # drain what was fitted before the stop
+                pos, p, perr, reason, y = point
+                if self.autocal.it is not None and self.autocal.it != self.IT:
+                    self.IT = self.autocal.it
+                    self.ITchanged = time()
+                    self.ITvariable.set(str(self.IT//1000))
+                self.mpl.p = p
+                self.mpl.guessed = True
+                self.mpl.update_spectrum(y)
+                self.mpl.update_fit()
+                self.spectra.append(y)
+                self.positions.append(pos)
+                self.calStatusvariable.set("Point {0}/{1}: {2}".format(len(self.autocal.points),n,
+                                                                       "ok" if reason is None else reason))
+            self.calThread = None
+            if self.autocal.stopped.is_set():
+                self.calStatusvariable.set("Auto calibration stopped")
+                return
+            used = self.autocal.finish()
+            self.calStatusvariable.set("Calibrated with {0}/{1} points".format(used,n))
+            self.save_calibration_file()
+            reenable = False
+            self.master.destroy()
+        except Exception as e:
+            self.calThread = None
+            self.calStatusvariable.set("Auto calibration failed")
+            messagebox.showerror("Auto Calibration",str(e))
+        finally:
+            if reenable:
+                self.set_auto_calibration_controls("normal")
+                self.update_dark() # the run may have changed the integration time
+        
+    def next_position(self):
+        pos = self.stagePos
+        self.mono.add_point(pos,*self.mpl.p[-2:])
+        self.spectra.append(np.copy(self.mpl.spectrum.get_ydata()))
+        self.positions.append(pos)
+        try:
+            mm = self.mmSpace.pop(0)
+        except IndexError:
+            self.save_calibration_file()
+            self.master.destroy()
+        else:
+            self.move_and_fit(mm)
+            
+    def move_and_fit(self,mm):
+        # Move, settle and acquire on the mover thread, queued behind the move,
+        # and keep the window responsive until the spectrum is in
+        self.nextButton.config(state='disabled')
+        self.set_spectrometer_controls("disabled")
+        move = self.mono.move_async(mm)
+        def settle():
+            move.result()
+            pos, y = self.settle.wait(mm,self.mono.mot.tol)
+            return pos, self.proc.fill(self.acq.next_frame,first=y)
+        self.wait_for_move(self.mono.mot.mover.submit(settle),mm)
+        
+    def wait_for_move(self,settled,mm):
+        if not settled.done():
+            self.master.after(10,self.wait_for_move,settled,mm)
+            return
+        self.set_spectrometer_controls("normal")
+        try:
+            self.stagePos, y = settled.result()
+        except Exception as e:
+            if messagebox.askretrycancel("Calibration",str(e)):
+                self.move_and_fit(mm)
+            else:
+                self.master.destroy()
+            return
+        self.mpl.update_spectrum(y)
+        self.mpl.gen_fit()
+        self.nextButton.config(state='normal')
+    
+    def save_calibration_file(self):
+        path = filedialog.askdirectory(initialdir = os.getcwd(),
+                                      title= "Calibration File Directory")
+        self.mono.save_calibration_points(path,spectra=np.array(self.spectra),
+                                          positions=np.array(self.positions),
+                                          wavelengths=self.mpl.x)
+    
+    
+class Renderer:
+    '''Blits a set of animated artists over a cached background
+    ---Initialization Parameters---
+        canvas: FigureCanvasTkAgg holding the figure
+        artists: List of artists which change between frames, these are set
+                  to animated so that a full canvas.draw() skips them
+        fps: Maximum number of redraws per second
+    ---Variables---
+    background:
+        Cached copy of the static parts of the figure (axes, ticks, labels),
+        refreshed whenever matplotlib does a full draw (resize, zoom, pan...)
+    timer:
+        Optional timing.PhaseTimer, every redraw is recorded as 'draw'
+    ---Methods---
+    request_draw:
+        Schedule a blit, no more often than fps. Requests arriving while a blit
+        is pending are merged, so only the newest artist data is ever drawn
+    '''
+    def __init__(self,canvas,artists,fps=30):
+        self.canvas = canvas
+        self.artists = list(artists)
+        self.fps = fps
+        self.background = None
+        self.timer = None
+        self.__pending = False
+        self.__last = 0
+        for a in self.artists:
+            a.set_animated(True)
+        self.canvas.mpl_connect('draw_event',self.on_draw)
+
+    def on_draw(self,event):
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for a in self.artists:
+            a.axes.draw_artist(a)
+
+    def request_draw(self):
+        if self.__pending:
+            return
+        wait = 1/self.fps - (time()-self.__last)
+        if wait <= 0:
+            self.blit()
+        else:
+            self.__pending = True
+            self.canvas.get_tk_widget().after(int(1000*wait)+1,self.blit)
+
+    def blit(self):
+        self.__pending = False
+        self.__last = time()
+        if self.background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_artists()
+            self.canvas.blit(self.canvas.figure.bbox)
+        if self.timer is not None:
+            self.timer.record('draw',time()-self.__last)
+
+
+class MPL:
+    def __init__(self,master,x,y,p=[0,0,500,5],fps=30,half=50,**kwargs):
+        self.x = x
+        self.p = np.array(p)
+        self.perr = np.full(4,np.nan)
+        self.guessed = False # True once self.p holds a click guess or a fit
+        self.half = half # nm either side of the peak used in fits
+        self.timer = None # optional timing.PhaseTimer, fits are recorded as 'fit'
+        self.debounce = 50 # ms without clicks before an interactive fit starts
+        self.fitter = ThreadPoolExecutor(1) # runs interactive fits off the tk thread
+        self.__fitId = 0 # bumped by every fit, stale results are dropped
+        self.__fitFuture = None
+        self.__pendingFit = None
+        self.tracker = PeakTracker(x)
+        self.tracking = False
+        self.stripSpan = 60 # s of history visible in the strip chart
+        
+        # Create tk Frame to hold MPL plot
+        self.frame = tk.Frame(master)
+        self.frame.grid(**kwargs)
+        
+        # Create MPL figure
+        self.fig = plt.figure(figsize=(10,5))
+        self.grid = self.fig.add_gridspec(2,1,height_ratios=[3,1],hspace=0.4)
+        self.ax = self.fig.add_subplot(self.grid[:,0])
+        self.spectrum, = self.ax.plot(x,y,color="blue")
+        self.ax.set_xlabel("Wavelength (nm)")
+        self.ax.set_ylabel("Counts")
+        self.ax.set_ylim(0,4000)
+        
+        # Strip chart of the tracked line, only shown while tracking
+        self.stripAx = self.fig.add_subplot(self.grid[1,0])
+        self.stripAx.set_xlabel("Time (s)")
+        self.stripAx.set_ylabel("Center (nm)",color="red")
+        self.stripAx.set_xlim(0,self.stripSpan)
+        self.fwhmAx = self.stripAx.twinx()
+        self.fwhmAx.set_ylabel("FWHM (nm)",color="green")
+        self.centerTrace, = self.stripAx.plot([],[],color="red")
+        self.fwhmTrace, = self.fwhmAx.plot([],[],color="green")
+        for a in (self.stripAx,self.fwhmAx,self.centerTrace,self.fwhmTrace):
+            a.set_visible(False)
+        
+        # Attached MPL figure and toolbar to tk Frame
+        self.canvas = FigureCanvasTkAgg(self.fig,self.frame)
+        self.canvas.get_tk_widget().pack()
+        self.toolbar = NavigationToolbar2Tk(self.canvas,self.frame)
+        self.toolbar.update()
+        
+        # initialize fit
+        self.fit, = self.ax.plot(x,gauss(x,self.p),color="black")
+        
+        # Only the spectrum, fit and strip chart change between frames, so blit them
+        self.renderer = Renderer(self.canvas,[self.spectrum,self.fit,
+                                              self.centerTrace,self.fwhmTrace],fps=fps)
+        self.canvas.draw()
+        
+        # Setup MPL click collbacks
+        self.canvas.mpl_connect('button_press_event',self.click)
+        
+    def click(self,event):
+        if event.inaxes == self.ax:
+            if event.button == 1:
+                print("Left click @ x=",event.xdata," y=",event.ydata)
+                self.__fitId += 1 # a manual guess replaces any fit still running
+                self.p[1],self.p[2] = event.ydata,event.xdata
+                self.guessed = True
+                self.update_fit()
+            if event.button == 2:
+                print("Scroll click @ x=",event.xdata," y=",event.ydata)
+                self.start_tracking(event.xdata)
+            if event.button == 3:
+                print("Right click @ x=",event.xdata," y=",event.ydata)
+                self.request_fit(event.xdata)
+    
+    def update_fit(self):
+        self.fit.set_ydata(gauss(self.x,self.p))
+        self.renderer.request_draw()
+        
+    def update_spectrum(self,y):
+        self.spectrum.set_ydata(y)
+        if self.tracking:
+            self.update_tracking(y)
+        self.renderer.request_draw()
+        
+    def start_tracking(self,x0=None):
+        '''
+        Fit every new spectrum, warm-started from the previous frame, following
+        the line nearest x0 (default the brightest), and show its center and
+        FWHM in the strip chart
+        '''
+        self.tracker.start(x0)
+        self.tracking = True
+        self.centerTrace.set_data([],[])
+        self.fwhmTrace.set_data([],[])
+        self.ax.set_subplotspec(self.grid[0,0])
+        for a in (self.stripAx,self.fwhmAx,self.centerTrace,self.fwhmTrace):
+            a.set_visible(True)
+        self.stripAx.set_xlim(0,self.stripSpan)
+        self.canvas.draw()
+        
+    def stop_tracking(self):
+        self.tracking = False
+        self.ax.set_subplotspec(self.grid[:,0])
+        for a in (self.stripAx,self.fwhmAx,self.centerTrace,self.fwhmTrace):
+            a.set_visible(False)
+        self.canvas.draw()
+        
+    def update_tracking(self,y):
+        t0 = time()
+        found = self.tracker.update(y)
+        if self.timer is not None:
+            self.timer.record('track',time()-t0)
+        if found is None:
+            return
+        self.p, self.perr = found
+        self.guessed = True
+        self.fit.set_ydata(gauss(self.x,self.p))
+        t, c, w = self.tracker.history()
+        t = t-self.tracker.started
+        self.centerTrace.set_data(t,c)
+        self.fwhmTrace.set_data(t,w)
+        # the blitted background holds the strip chart axes, so only redraw
+        # in full when the traces leave them
+        redraw = False
+        if t[-1] > self.stripAx.get_xlim()[1]:
+            self.stripAx.set_xlim(t[-1]-0.5*self.stripSpan,t[-1]+0.5*self.stripSpan)
+            redraw = True
+        for ax, v, pad in ((self.stripAx,c,0.05),(self.fwhmAx,w,0.05)):
+            lo, hi = ax.get_ylim()
+            if v.min() < lo or v.max() > hi or len(v) == 1:
+                pad = max(0.5*np.ptp(v),pad)
+                ax.set_ylim(v.min()-pad,v.max()+pad)
+                redraw = True
+        if redraw:
+            self.canvas.draw_idle()
+        
+    def fit_spectrum(self,y,x0=None,p0=None):
+        '''
+        Fit the line nearest x0 (default the brightest pixel) in y, starting
+        from p0 (default a moment guess), returns (p, perr)
+        '''
+        if x0 is None:
+            x0 = self.x[np.argmax(y)]
+        t0 = time()
+        p, perr = fit_gauss(self.x,y,p0=p0,x0=x0,half=self.half)
+        if self.timer is not None:
+            self.timer.record('fit',time()-t0)
+        return p, perr
+        
+    def gen_fit(self):
+        # a blocking fit supersedes any interactive one still running
+        self.__fitId += 1
+        y = self.spectrum.get_ydata()
+        x0 = self.x[np.argmax(y)]
+        self.p, self.perr = self.fit_spectrum(y,x0,self.guess(x0))
+        self.guessed = True
+        self.update_fit()
+
+    def guess(self,x0):
+        '''
+        Copy of self.p to start a fit around x0 from, None if there is no
+        guess yet or it belongs to a line outside the fit window
+        '''
+        if not self.guessed or abs(self.p[2]-x0) > self.half:
+            return None
+        return self.p.copy()
+        
+    def request_fit(self,x0=None):
+        '''
+        Fit the displayed spectrum around x0 on the fitting thread, once no
+        other request has arrived for self.debounce ms. Only the newest request
+        is fitted; queued ones are cancelled, running ones are left to finish
+        and their results dropped. The fit is drawn when it arrives
+        '''
+        widget = self.canvas.get_tk_widget()
+        if self.__pendingFit is not None:
+            widget.after_cancel(self.__pendingFit)
+        self.__pendingFit = widget.after(self.debounce,self.__submit_fit,x0)
+        
+    def __submit_fit(self,x0):
+        self.__pendingFit = None
+        if self.__fitFuture is not None:
+            self.__fitFuture.cancel()
+        self.__fitId += 1
+        y = np.array(self.spectrum.get_ydata(),dtype=float) # the live view keeps drawing
+        if x0 is None:
+            x0 = self.x[np.argmax(y)]
+        self.__fitFuture = self.fitter.submit(self.fit_spectrum,y,x0,self.guess(x0))
+        self.__poll_fit(self.__fitId,self.__fitFuture)
+        
+    def __poll_fit(self,fitId,future):
+        if fitId != self.__fitId:
+            return
+        if not future.done():
+            self.canvas.get_tk_widget().after(10,self.__poll_fit,fitId,future)
+            return
+        try:
+            self.p, self.perr = future.result()
+        except Exception as e:
+            print("Fit failed:",e)
+            return
+        self.guessed = True
         self.update_fit()
\ No newline at end of file
@@ -0,0 +1,300 @@
+"""Mapping between wavelength and stage position
+---Classes---
+Calibration:
+    Fits stage position (mm) as a function of wavelength (nm) with a linear,
+    polynomial or smoothing spline model. Both directions work elementwise on
+    numpy arrays, and a dense lookup table can be precomputed so that bulk
+    conversions of any model (and inversion of the nonlinear ones) are a
+    single np.interp call
+
+CalibrationAccumulator:
+    Running weighted sums of the calibration points, from which the least
+    squares line and its residual error follow in constant time, so points
+    can be added, removed or down-weighted one at a time
+"""
+
+#%%
+import numpy as np
+#%%
+class Calibration:
+    '''Invertible wavelength <-> position model
+    ---Initialization Parameters---
+        wave: Wavelengths (nm) of the calibration points
+        pos: Stage positions (mm) of the calibration points
+        model: 'linear', 'poly' or 'spline'
+        deg: Polynomial degree ('poly') or spline order ('spline', default 3)
+        lut: Number of points in the lookup table (0 to skip building one)
+        weights: Optional weight of each point (e.g. 1/sigma**2), 0 excludes it
+    ---Variables---
+    a, b:
+        Intercept and slope of the least squares line pos = a + b*wave, which
+        is kept for every model
+    coef:
+        Polynomial coefficients (highest power first) for 'linear' and 'poly'
+    ---Methods---
+    to_pos, to_wave:
+        Convert wavelengths to positions and back
+    build_lut:
+        Tabulate the model over a wavelength range
+    set_line:
+        Replace the line of a 'linear' model, e.g. from a CalibrationAccumulator
+    '''
+    def __init__(self,wave,pos,model='linear',deg=None,lut=4096,weights=None):
+        self.__points = None
+        self.wave = np.asarray(wave,dtype=float)
+        self.pos = np.asarray(pos,dtype=float)
+        self.model = model
+        self.deg = deg
+        self.weights = None if weights is None else np.asarray(weights,dtype=float)
+        w = None if weights is None else np.sqrt(self.weights)
+        if np.count_nonzero(np.ones(len(self.wave)) if w is None else w) < 2:
+            raise ValueError("At least two calibration points are needed")
+        self.b, self.a = np.polyfit(self.wave,self.pos,1,w=w)
+        self.coef = np.array([self.b,self.a])
+        self.spline = None
+        if model == 'poly':
+            self.coef = np.polyfit(self.wave,self.pos,2 if deg is None else deg,w=w)
+        elif model == 'spline':
+            from scipy.interpolate import UnivariateSpline
+            i = np.argsort(self.wave)
+            self.spline = UnivariateSpline(self.wave[i],self.pos[i],None if w is None else w[i],
+                                           k=3 if deg is None else deg)
+        elif model != 'linear':
+            raise ValueError("Unknown calibration model '{}'".format(model))
+        self.lut = None
+        if lut:
+            self.build_lut(n=lut)
+
+    def set_line(self,a,b,points=None):
+        '''
+        Set the intercept and slope, and for the 'linear' model the mapping
+        itself, without refitting. The lookup table is dropped. points is the
+        CalibrationAccumulator the line came from: wave, pos and weights are
+        then read from it on first use, so that residuals stay consistent
+        with the line without copying the points on every update
+        '''
+        self.__points = points
+        self.a, self.b = a, b
+        if self.model == 'linear':
+            self.coef = np.array([b,a])
+            self.lut = None
+
+    def __sync(self):
+        if self.__points is not None:
+            points, self.__points = self.__points, None
+            self.__wave, self.__pos, self.__weights = points.arrays()
+
+    @property
+    def wave(self):
+        self.__sync()
+        return self.__wave
+
+    @wave.setter
+    def wave(self,wave):
+        self.__sync()
+        self.__wave = wave
+
+    @property
+    def pos(self):
+        self.__sync()
+        return self.__pos
+
+    @pos.setter
+    def pos(self,pos):
+        self.__sync()
+        self.__pos = pos
+
+    @property
+    def weights(self):
+        self.__sync()
+        return self.__weights
+
+    @weights.setter
+    def weights(self,weights):
+        self.__sync()
+        self.__weights = weights
+
+    def __call__(self,lam):
+        return self.to_pos(lam)
+
+    def evaluate(self,lam):
+        '''
+        Evaluate the model directly (no lookup table)
+        '''
+        if self.spline is not None:
+            return self.spline(lam)
+        return np.polyval(self.coef,lam)
+
+    def build_lut(self,wmin=None,wmax=None,n=4096):
+        '''
+        Tabulate the model on n points from wmin to wmax (defaults to the
+        calibration points padded by 10% either side). Outside this range
+        to_pos and to_wave fall back on the model itself
+        '''
+        if wmin is None or wmax is None:
+            lo, hi = np.min(self.wave), np.max(self.wave)
+            pad = 0.1*(hi-lo)
+            wmin = lo-pad if wmin is None else wmin
+            wmax = hi+pad if wmax is None else wmax
+        w = np.linspace(wmin,wmax,n)
+        p = self.evaluate(w)
+        d = np.diff(p)
+        if not (np.all(d > 0) or np.all(d < 0)):
+            raise ValueError("Calibration is not monotonic between {0} and {1} nm".format(wmin,wmax))
+        self.lut = (w,p)
+        return self.lut
+
+    def to_pos(self,lam):
+        '''
+        Stage position(s) (mm) for wavelength(s) lam (nm)
+        '''
+        lam = np.asarray(lam,dtype=float)
+        if self.model == 'linear':
+            return self.a+self.b*lam
+        if self.lut is None:
+            return self.evaluate(lam)
+        w, p = self.lut
+        inside = (lam >= w[0]) & (lam <= w[-1])
+        if np.all(inside):
+            return np.interp(lam,w,p)
+        return np.where(inside,np.interp(lam,w,p),self.evaluate(lam))
+
+    def to_wave(self,pos):
+        '''
+        Wavelength(s) (nm) for stage position(s) pos (mm). Nonlinear models are
+        inverted through the lookup table, and give nan outside of it
+        '''
+        pos = np.asarray(pos,dtype=float)
+        if self.model == 'linear':
+            return (pos-self.a)/self.b
+        if self.lut is None:
+            self.build_lut()
+        w, p = self.lut
+        if p[0] > p[-1]:
+            w, p = w[::-1], p[::-1]
+        return np.interp(pos,p,w,left=np.nan,right=np.nan)
+
+    def residuals(self):
+        '''
+        Position residuals (mm) of the calibration points
+        '''
+        return self.pos-self.evaluate(self.wave)
+
+
+class CalibrationAccumulator:
+    '''Weighted least squares line pos = a + b*wave from running sums
+    ---Variables---
+    points:
+        dict of key -> (wave, pos, weight) for every point added
+    a, b:
+        Intercept and slope of the current line
+    sigma:
+        Residual standard error (mm) of a unit weight point
+    covariance:
+        (2,2) covariance of [a, b], scaled by sigma**2
+    n:
+        Number of points with nonzero weight
+    unweighted:
+        True if every point has weight 1
+    ---Methods---
+    add:
+        Add a point, returns its key
+    remove:
+        Remove a point
+    reweight:
+        Change the weight of a point (0 excludes it, but keeps it)
+    arrays:
+        Wavelengths, positions and weights of all points, in the order added
+    '''
+    def __init__(self,wave=(),pos=(),weights=None):
+        self.points = {}
+        self.__next = 0
+        self.__origin = None
+        # sums of w, w*x, w*y, w*x*x, w*x*y, w*y*y about the origin
+        self.__s = np.zeros(6)
+        self.n = 0
+        self.__weighted = 0 # number of points with a weight other than 1
+        for i,(w,p) in enumerate(zip(wave,pos)):
+            self.add(w,p,1.0 if weights is None else weights[i])
+
+    def __update(self,wave,pos,weight):
+        x, y = wave-self.__origin[0], pos-self.__origin[1]
+        self.__s += weight*np.array([1,x,y,x*x,x*y,y*y])
+        self.n += int(np.sign(weight))
+
+    def add(self,wave,pos,weight=1.0):
+        if self.__origin is None:
+            # sums about the first point, so they do not lose precision
+            self.__origin = (float(wave),float(pos))
+        key = self.__next
+        self.__next += 1
+        self.points[key] = (float(wave),float(pos),float(weight))
+        self.__weighted += weight != 1
+        if weight:
+            self.__update(wave,pos,weight)
+        return key
+
+    def remove(self,key):
+        wave, pos, weight = self.points.pop(key)
+        self.__weighted -= weight != 1
+        if weight:
+            self.__update(wave,pos,-weight)
+
+    def reweight(self,key,weight):
+        wave, pos, old = self.points[key]
+        self.points[key] = (wave,pos,float(weight)) # in place, arrays() keeps the order
+        self.__weighted += (weight != 1)-(old != 1)
+        if old:
+            self.__update(wave,pos,-old)
+        if weight:
+            self.__update(wave,pos,weight)
+
+    @property
+    def unweighted(self):
+        return self.__weighted == 0
+
+    def arrays(self):
+        '''
+        Returns (wave, pos, weights) arrays of every point (including those of
+        weight 0), weights None if all are 1
+        '''
+        wave, pos, weights = np.array(list(self.points.values()),dtype=float).reshape(-1,3).T
+        return wave, pos, None if self.unweighted else weights
+
+    def __line(self):
+        S, Sx, Sy, Sxx, Sxy, Syy = self.__s
+        det = S*Sxx-Sx*Sx
+        if self.n < 2 or det <= 0:
+            raise ValueError("At least two calibration points at different wavelengths are needed")
+        b = (S*Sxy-Sx*Sy)/det
+        a = (Sy-b*Sx)/S
+        return a, b
+
+    @property
+    def b(self):
+        return self.__line()[1]
+
+    @property
+    def a(self):
+        a, b = self.__line()
+        return self.__origin[1]+a-b*self.__origin[0]
+
+    @property
+    def covariance(self):
+        S, Sx, Sy, Sxx, Sxy, Syy = self.__s
+        det = S*Sxx-Sx*Sx
+        s2 = self.sigma**2
+        # about the origin, then moved back: a = y0 + a' - b*x0
+        vb, va, cab = s2*S/det, s2*Sxx/det, -s2*Sx/det
+        x0 = self.__origin[0]
+        return np.array([[va+x0*x0*vb-2*x0*cab,cab-x0*vb],
+                         [cab-x0*vb,vb]])
+
+    @property
+    def sigma(self):
+        if self.n < 3:
+            return np.nan
+        a, b = self.__line()
+        S, Sx, Sy, Sxx, Sxy, Syy = self.__s
+        ssr = max(Syy-a*Sy-b*Sxy,0)
+        return np.sqrt(ssr/(self.n-2))
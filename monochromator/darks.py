@@ -0,0 +1,98 @@
+"""Cache of dark frames for each integration time
+---Classes---
+DarkCache:
+    Dark frames keyed by integration time, with optional invalidation by age
+    or detector temperature. A dark for an integration time that was never
+    measured is interpolated (per pixel, linearly in integration time) from
+    the cached ones on either side, since the dark signal is an offset plus
+    a thermal rate, but never extrapolated beyond them. The cache is saved
+    to and restored from an .npz file, so switching between integration
+    times which have been bracketed once needs no extra dark acquisition
+"""
+
+#%%
+import os
+from time import time
+import numpy as np
+#%%
+class DarkCache:
+    '''Dark frames keyed by integration time (us)
+    ---Initialization Parameters---
+        path: Optional .npz file the cache is loaded from (if it exists) and saved to
+        maxAge: Darks older than this (s) are ignored, None to keep forever
+        maxTempDelta: Darks taken more than this (C) away from the current
+                       detector temperature are ignored, None to ignore temperature
+    ---Variables---
+    darks:
+        dict of integration time -> (frame, temperature or nan, time.time() taken)
+    ---Methods---
+    add:
+        Store a dark frame
+    get:
+        Dark frame for an integration time, measured or interpolated, None
+        if it has to be measured
+    save, load:
+        Write the cache to / read it from path
+    '''
+    def __init__(self,path=None,maxAge=None,maxTempDelta=None):
+        self.path = path
+        self.maxAge = maxAge
+        self.maxTempDelta = maxTempDelta
+        self.darks = {}
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def add(self,it,frame,temperature=None):
+        self.darks[int(it)] = (np.array(frame,dtype=float),
+                               np.nan if temperature is None else float(temperature),
+                               time())
+
+    def clear(self):
+        self.darks = {}
+
+    def valid(self,it,temperature=None):
+        '''
+        True if the dark stored for it has not expired
+        '''
+        frame, temp, taken = self.darks[it]
+        if self.maxAge is not None and time()-taken > self.maxAge:
+            return False
+        if self.maxTempDelta is not None and temperature is not None and not np.isnan(temp):
+            return abs(temperature-temp) <= self.maxTempDelta
+        return True
+
+    def get(self,it,temperature=None):
+        '''
+        Returns the dark frame for integration time it (us) at the detector
+        temperature (C), None if there is no valid dark for it and no valid
+        pair on either side of it to interpolate from. Darks are never
+        extrapolated, a hot pixel's thermal rate is too uncertain for that
+        '''
+        it = int(it)
+        its = sorted(i for i in self.darks if self.valid(i,temperature))
+        if it in its:
+            return self.darks[it][0]
+        j = np.searchsorted(its,it)
+        if j == 0 or j == len(its):
+            return None
+        i0, i1 = its[j-1], its[j]
+        f0, f1 = self.darks[i0][0], self.darks[i1][0]
+        return f0+(f1-f0)*(it-i0)/(i1-i0)
+
+    def save(self,path=None):
+        path = self.path if path is None else path
+        its = sorted(self.darks)
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d,exist_ok=True)
+        with open(path,'wb') as f:
+            np.savez(f,it=np.array(its,dtype=np.int64),
+                     frames=np.array([self.darks[i][0] for i in its]),
+                     temperature=np.array([self.darks[i][1] for i in its]),
+                     taken=np.array([self.darks[i][2] for i in its]))
+
+    def load(self,path=None):
+        path = self.path if path is None else path
+        with np.load(path) as npz:
+            self.darks = {int(i):(f,t,tk) for i,f,t,tk in zip(npz['it'],npz['frames'],
+                                                              npz['temperature'],npz['taken'])}
@@ -0,0 +1,129 @@
+"""Quick check of a calibration against one or two reference lines
+---Classes---
+DriftCheck:
+    Moves to the calibrated positions of one or two reference wavelengths,
+    fits the line the spectrometer sees at each, and estimates the offset
+    (one line) or offset and scale (two lines) by which the output has
+    drifted from the calibration. Each term is only kept if it stands out
+    of its fit error, and drifts within tolerance are corrected in place,
+    larger ones call for a full calibration. This takes a few seconds, so
+    it can run before every measurement block
+"""
+
+#%%
+from time import time
+import numpy as np
+from .fitting import fit_gauss
+#%%
+class DriftCheck:
+    '''Offset and scale drift of a loaded calibration
+    ---Initialization Parameters---
+        mono: Monochromator with a calibration
+        acquire: Callable returning a fresh spectrum
+        x: Wavelength axis of the spectra
+        waves: One or two reference wavelengths (nm), by default a quarter and
+                three quarters of the way across the calibrated range
+        settle: Seconds or SettleDetector, see Monochromator.scan
+        half: Half width (nm) of the fit window around the brightest pixel
+        minSNR: Smallest accepted amplitude / amplitude error
+        tolerance: Largest shift (nm) at the reference wavelengths which is
+                    corrected, beyond it the calibration is left alone
+        maxScale: Largest relative scale change which is corrected
+        nsigma: Offset and scale are only corrected beyond nsigma times their errors
+        minShift: Smallest shift (nm) at the reference wavelengths worth correcting
+    ---Methods---
+    measure:
+        Visit the reference wavelengths, returns the fitted line centers and errors
+    estimate:
+        Offset and scale, with their errors, from measured centers
+    run:
+        Measure, estimate, and correct the calibration if within tolerance
+    '''
+    def __init__(self,mono,acquire,x,waves=None,settle=0,half=10,minSNR=20,
+                 tolerance=1.0,maxScale=0.01,nsigma=3,minShift=0.05):
+        self.mono = mono
+        self.acquire = acquire
+        self.x = np.asarray(x)
+        if waves is None:
+            lo, hi = np.min(mono.calibration.wave), np.max(mono.calibration.wave)
+            waves = [lo+0.25*(hi-lo),lo+0.75*(hi-lo)]
+        self.waves = np.atleast_1d(np.asarray(waves,dtype=float))
+        if not 1 <= len(self.waves) <= 2:
+            raise ValueError("One or two reference wavelengths are needed")
+        self.settle = settle
+        self.half = half
+        self.minSNR = minSNR
+        self.tolerance = tolerance
+        self.maxScale = maxScale
+        self.nsigma = nsigma
+        self.minShift = minShift
+
+    def measure(self):
+        '''
+        Returns (measured positions, centers, center errors) of the line seen
+        at each reference wavelength
+        '''
+        pos, centers, errs = [], [], []
+        for lam in self.waves:
+            p, y, t = self.mono.move_and_acquire(self.mono.get_pos(lam),self.acquire,self.settle)
+            fit, perr = fit_gauss(self.x,y,x0=self.x[np.argmax(y)],half=self.half)
+            if not (np.all(np.isfinite(perr)) and abs(fit[1]) >= self.minSNR*perr[1]):
+                raise RuntimeError("No usable line at {} nm".format(lam))
+            pos.append(p)
+            centers.append(fit[2])
+            errs.append(perr[2])
+        return np.array(pos), np.array(centers), np.array(errs)
+
+    def estimate(self,centers,errs=None,waves=None):
+        '''
+        Returns (offset, scale, offset error, scale error) such that the
+        wavelength actually reached when asking for lam is offset + scale*lam.
+        waves are the wavelengths asked for (default the references) and errs
+        the errors of the centers (default 0). A scale which does not stand out
+        of its error is dropped, leaving an offset only
+        '''
+        waves = self.waves if waves is None else np.asarray(waves,dtype=float)
+        errs = np.zeros(len(centers)) if errs is None else np.asarray(errs,dtype=float)
+        shift = np.asarray(centers)-waves
+        if len(waves) == 2:
+            d = waves[1]-waves[0]
+            scale, scaleErr = 1+(shift[1]-shift[0])/d, np.hypot(*errs)/abs(d)
+            if abs(scale-1) > self.nsigma*scaleErr:
+                # offset error from both centers through the extrapolation to 0 nm
+                k = waves[0]/d
+                return (centers[0]-scale*waves[0],scale,
+                        np.hypot((1+k)*errs[0],k*errs[1]),scaleErr)
+        # offset only: weighted mean shift
+        if np.all(errs > 0):
+            w = 1/errs**2
+            return np.sum(w*shift)/np.sum(w), 1.0, 1/np.sqrt(np.sum(w)), 0.0
+        return np.mean(shift), 1.0, 0.0, 0.0
+
+    def run(self,apply=True):
+        '''
+        Measure the drift and, if apply and it is within tolerance, correct the
+        calibration of mono (see Monochromator.apply_drift). The drift is taken
+        against the wavelengths the calibration gives at the measured stage
+        positions, and is only corrected if it stands out of the fit errors and
+        moves a reference by at least minShift. Returns a dict of offset, scale,
+        their errors, shift (nm, at each reference), error (nm, of each center),
+        within_tolerance, applied and the time taken (s)
+        '''
+        t0 = time()
+        pos, centers, errs = self.measure()
+        waves = np.atleast_1d(self.mono.get_wave(pos))
+        offset, scale, offsetErr, scaleErr = self.estimate(centers,errs,waves)
+        shift = centers-waves
+        ok = np.all(np.abs(shift) <= self.tolerance) and abs(scale-1) <= self.maxScale
+        correction = offset+(scale-1)*waves
+        if scale == 1:
+            significant = abs(offset) > self.nsigma*offsetErr
+        else:
+            significant = True # estimate keeps the scale only if it stands out
+        significant = significant and np.max(np.abs(correction)) >= self.minShift
+        applied = bool(apply and ok and significant)
+        if applied:
+            self.mono.apply_drift(offset,scale)
+        return {'offset':offset,'scale':scale,'offset_error':offsetErr,'scale_error':scaleErr,
+                'shift':shift,'error':errs,'within_tolerance':bool(ok),
+                'significant':bool(significant),'applied':applied,'time':time()-t0}
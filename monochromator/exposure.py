@@ -0,0 +1,74 @@
+"""Automatic choice of the spectrometer integration time
+---Classes---
+AutoExposure:
+    Picks the integration time which puts the peak at a target fraction of
+    saturation. The detector response is linear in integration time above
+    the dark level, so one unsaturated frame is enough to predict the right
+    integration time; saturated frames cut it by a fixed factor
+"""
+
+#%%
+import numpy as np
+#%%
+class AutoExposure:
+    '''Integration time controller
+    ---Initialization Parameters---
+        target: Desired peak counts as a fraction of saturation
+        tolerance: No change is made while the peak is within target +/- tolerance
+        saturation: Saturation level (counts), 4095 for the 12 bit USB2000
+        itMin, itMax: Allowed integration time range (us)
+        backoff: Factor the integration time is divided by after a saturated frame
+    ---Methods---
+    next_it:
+        The integration time to use after a frame taken at it, or None to keep it
+    converge:
+        Acquire and adjust until the peak is on target
+    '''
+    def __init__(self,target=0.7,tolerance=0.1,saturation=4095,
+                 itMin=10*1000,itMax=10*1000*1000,backoff=5):
+        self.target = target
+        self.tolerance = tolerance
+        self.saturation = saturation
+        self.itMin = itMin
+        self.itMax = itMax
+        self.backoff = backoff
+
+    def next_it(self,it,y,offset=None):
+        '''
+        it             int       Integration time (us) y was taken with
+        y              array     Raw (not dark subtracted) frame
+        offset         float     Dark level (counts), defaults to the median of y
+        Returns the new integration time (us), or None if y is on target
+        '''
+        peak = np.max(y)
+        offset = np.median(y) if offset is None else offset
+        if peak >= 0.98*self.saturation:
+            new = it/self.backoff
+        else:
+            frac = peak/self.saturation
+            if abs(frac-self.target) <= self.tolerance:
+                return None
+            signal = max(peak-offset,1.0)
+            new = it*(self.target*self.saturation-offset)/signal
+        new = int(min(max(new,self.itMin),self.itMax))
+        return None if new == int(it) else new
+
+    def converge(self,acquire,set_it,it,maxFrames=6):
+        '''
+        Acquire frames, adjusting the integration time through set_it(it),
+        until the peak is on target (or the range limit is reached)
+        acquire        callable  acquire() -> fresh raw frame at the current setting
+        set_it         callable  set_it(it) sets the integration time (us)
+        it             int       Current integration time (us)
+        Returns (integration time, last frame)
+        '''
+        for _ in range(maxFrames):
+            y = acquire()
+            new = self.next_it(it,y)
+            if new is None:
+                break
+            it = new
+            set_it(it)
+        else:
+            y = acquire()
+        return it, y
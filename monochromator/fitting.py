@@ -0,0 +1,287 @@
+"""Least squares fitting of a single gaussian peak on a constant background
+---Functions---
+gauss:
+    The peak model, p = [background, amplitude, center, width]
+
+gauss_jacobian:
+    Analytic derivatives of gauss with respect to p
+
+roi:
+    Contiguous slice of a sorted wavelength axis around a center
+
+moment_guess:
+    Initial parameters from the moments of the background subtracted data
+
+fit_gauss:
+    Levenberg-Marquardt fit of gauss, returning the parameters and their
+    standard errors. On a typical 100-200 pixel ROI this takes well under a
+    millisecond, so it can be run on every live frame.
+
+multi_gauss:
+    Sum of several gauss peaks on a common background, evaluated for a
+    stack of spectra at once
+
+fit_gauss_batch:
+    Levenberg-Marquardt fit of multi_gauss to every spectrum of a 2-D stack,
+    with all spectra iterated together as batched linear algebra (and
+    optionally split over a process pool), for reprocessing recorded scans
+"""
+
+#%%
+import numpy as np
+#%%
+def gauss(x,p):
+    return np.abs(p[0])+np.abs(p[1])*np.exp(-((x-p[2])/p[3])**2)
+
+def gauss_jacobian(x,p):
+    '''
+    Returns the (len(x),4) matrix of d gauss/d p
+    '''
+    u = (x-p[2])/p[3]
+    e = np.exp(-u**2)
+    a = np.abs(p[1])
+    J = np.empty((len(x),4))
+    J[:,0] = 1 if p[0] >= 0 else -1
+    J[:,1] = e if p[1] >= 0 else -e
+    J[:,2] = 2*a*e*u/p[3]
+    J[:,3] = J[:,2]*u
+    return J
+
+def roi(x,x0,half):
+    '''
+    Slice of the (ascending) array x covering x0-half <= x <= x0+half
+    '''
+    lo = np.searchsorted(x,x0-half,side='left')
+    hi = np.searchsorted(x,x0+half,side='right')
+    return slice(lo,hi)
+
+def moment_guess(x,y):
+    '''
+    Estimate [background, amplitude, center, width] from y above its minimum:
+    the center is the first moment and the width follows from the extent of
+    the pixels above half maximum
+    '''
+    bg = np.min(y)
+    w = y-bg
+    amp = np.max(w)
+    if amp <= 0:
+        return np.array([bg,0,np.mean(x),(x[-1]-x[0])/4])
+    # contiguous run of pixels above half maximum around the peak
+    i = np.argmax(w)
+    low = w < 0.5*amp
+    lo = i-np.argmax(low[i::-1]) + 1 if low[:i].any() else 0
+    hi = i+np.argmax(low[i:]) if low[i:].any() else len(w)
+    top = slice(lo,hi)
+    c = np.sum(w[top]*x[top])/np.sum(w[top])
+    fwhm = x[hi-1]-x[lo]+np.median(np.diff(x))
+    return np.array([bg,amp,c,fwhm/(2*np.sqrt(np.log(2)))])
+
+def fit_gauss(x,y,p0=None,x0=None,half=50,maxiter=50,tol=1e-8):
+    '''
+    Fit gauss to y(x) within the ROI x0 +/- half (the whole array if x0 is None)
+    x          array     Ascending wavelength axis
+    y          array     Counts
+    p0         array     Initial guess, defaults to moment_guess over the ROI
+    Returns (p, perr) where perr are the 1 sigma standard errors, estimated
+    from the residuals and the Jacobian at the solution, pixel by pixel so
+    that they hold for shot noise (nan if the fit is degenerate)
+    '''
+    if x0 is not None:
+        sl = roi(x,x0,half)
+        x, y = x[sl], y[sl]
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    p = moment_guess(x,y) if p0 is None else np.array(p0,dtype=float)
+    if len(x) <= 4:
+        return p, np.full(4,np.nan)
+
+    r = y-gauss(x,p)
+    cost = r @ r
+    lam = 1e-3
+    for _ in range(maxiter):
+        J = gauss_jacobian(x,p)
+        A = J.T @ J
+        g = J.T @ r
+        improved = False
+        while lam < 1e10:
+            try:
+                dp = np.linalg.solve(A+lam*np.diag(np.diag(A)+1e-12),g)
+            except np.linalg.LinAlgError:
+                lam *= 10
+                continue
+            pn = p+dp
+            rn = y-gauss(x,pn)
+            cn = rn @ rn
+            if cn < cost:
+                lam = max(lam/10,1e-12)
+                improved = True
+                break
+            lam *= 10
+        if not improved:
+            break
+        done = cost-cn <= tol*cost
+        p, r, cost = pn, rn, cn
+        if done:
+            break
+
+    p[3] = np.abs(p[3])
+    try:
+        J = gauss_jacobian(x,p)
+        # sandwich estimate: shot noise makes the peak pixels far noisier than
+        # the background, which a single residual variance would average away
+        Ainv = np.linalg.inv(J.T @ J)
+        Jr = J*r[:,None]
+        cov = Ainv @ (Jr.T @ Jr) @ Ainv*len(x)/(len(x)-4)
+        perr = np.sqrt(np.abs(np.diag(cov)))
+    except np.linalg.LinAlgError:
+        perr = np.full(4,np.nan)
+    return p, perr
+
+def multi_gauss(x,p):
+    '''
+    x    (m,n) or (n,)  Wavelengths of each spectrum
+    p    (m,1+3k)       [background, amplitude1, center1, width1, amplitude2, ...]
+    Returns the (m,n) model
+    '''
+    x = np.broadcast_to(x,(len(p),np.shape(x)[-1]))
+    u = (x[:,:,None]-p[:,None,2::3])/p[:,None,3::3]
+    return np.abs(p[:,:1])+np.einsum('mnk,mk->mn',np.exp(-u**2),np.abs(p[:,1::3]))
+
+def multi_gauss_jacobian(x,p):
+    '''
+    Returns the (m,n,1+3k) derivatives of multi_gauss with respect to p
+    '''
+    x = np.broadcast_to(x,(len(p),np.shape(x)[-1]))
+    w = p[:,None,3::3]
+    u = (x[:,:,None]-p[:,None,2::3])/w
+    e = np.exp(-u**2)
+    J = np.empty(x.shape+(p.shape[1],))
+    J[:,:,0] = np.sign(p[:,:1])+(p[:,:1] == 0)
+    J[:,:,1::3] = e*(np.sign(p[:,None,1::3])+(p[:,None,1::3] == 0))
+    J[:,:,2::3] = 2*np.abs(p[:,None,1::3])*e*u/w
+    J[:,:,3::3] = J[:,:,2::3]*u
+    return J
+
+def _lm_batch(x,y,p,maxiter,tol):
+    '''
+    Levenberg-Marquardt on a stack: x, y (m,n) windows, p (m,q) initial
+    parameters. Every spectrum keeps its own damping and stops on its own,
+    each iteration tries one step for all spectra still running.
+    Returns (p, perr, rms residual, converged)
+    '''
+    m, q = p.shape
+    p = p.copy()
+    r = y-multi_gauss(x,p)
+    cost = np.einsum('mn,mn->m',r,r)
+    lam = np.full(m,1e-3)
+    active = np.ones(m,dtype=bool)
+    converged = np.zeros(m,dtype=bool)
+    eye = np.eye(q)
+    for _ in range(maxiter):
+        i = np.flatnonzero(active)
+        if len(i) == 0:
+            break
+        J = multi_gauss_jacobian(x[i],p[i])
+        Jt = J.transpose(0,2,1)
+        A = Jt @ J
+        g = (Jt @ r[i][:,:,None])[:,:,0]
+        D = np.einsum('mqq->mq',A)+1e-12
+        try:
+            dp = np.linalg.solve(A+lam[i,None,None]*D[:,:,None]*eye,g[:,:,None])[:,:,0]
+        except np.linalg.LinAlgError:
+            lam[i] *= 10
+            active[i[lam[i] >= 1e10]] = False
+            continue
+        pn = p[i]+dp
+        rn = y[i]-multi_gauss(x[i],pn)
+        cn = np.einsum('mn,mn->m',rn,rn)
+        better = cn < cost[i]
+        done = better & (cost[i]-cn <= tol*cost[i])
+        k = i[better]
+        p[k], r[k], cost[k] = pn[better], rn[better], cn[better]
+        lam[k] = np.maximum(lam[k]/10,1e-12)
+        lam[i[~better]] *= 10
+        converged[i[done]] = True
+        active[i[done | (lam[i] >= 1e10)]] = False
+    # a step the damping can no longer improve on is a minimum too
+    converged |= lam >= 1e10
+    p[:,3::3] = np.abs(p[:,3::3])
+    n = x.shape[1]
+    J = multi_gauss_jacobian(x,p)
+    A = J.transpose(0,2,1) @ J
+    perr = np.full((m,q),np.nan)
+    ok = np.linalg.matrix_rank(A) == q
+    if ok.any() and n > q:
+        # sandwich estimate, as in fit_gauss
+        Ainv = np.linalg.inv(A[ok])
+        Jr = J[ok]*r[ok][:,:,None]
+        cov = Ainv @ (Jr.transpose(0,2,1) @ Jr) @ Ainv*n/(n-q)
+        perr[ok] = np.sqrt(np.abs(np.einsum('mqq->mq',cov)))
+    return p, perr, np.sqrt(cost/n), converged
+
+def _fit_chunk(args):
+    return _lm_batch(*args)
+
+def fit_gauss_batch(x,y,seeds,width=None,half=10,maxiter=100,tol=1e-8,workers=None,chunk=256):
+    '''
+    Fit k gauss peaks on a common background to each of m spectra
+    x          array     (n,) ascending wavelength axis
+    y          array     (m,n) stack of spectra
+    seeds      array     (k,) initial centers shared by all spectra, or (m,k) per spectrum
+    width      array     Initial width parameter(s) (nm), scalar or (k,). By default
+                          estimated from the first spectrum
+    half       float     Each spectrum is fitted within [min(seeds)-half, max(seeds)+half]
+    workers    int       Split the stack over a pool of this many processes
+                          (on Windows, call from under if __name__ == '__main__')
+    chunk      int       Spectra iterated together, bounds the memory used
+    Returns a dict of arrays: p, perr (m,1+3k) as for multi_gauss; background (m,);
+    amplitude, center, width and their errors amplitude_err, center_err,
+    width_err (m,k); residual (m,) rms residual; converged (m,)
+    '''
+    x = np.asarray(x,dtype=float)
+    y = np.atleast_2d(np.asarray(y,dtype=float))
+    m = len(y)
+    seeds = np.asarray(seeds,dtype=float)
+    seeds = np.broadcast_to(seeds if seeds.ndim == 2 else seeds[None,:],(m,seeds.shape[-1]))
+    k = seeds.shape[1]
+    # windows of a common number of pixels so the stack stays rectangular
+    lo = np.searchsorted(x,seeds.min(1)-half,side='left')
+    hi = np.searchsorted(x,seeds.max(1)+half,side='right')
+    n = int(np.max(hi-lo))
+    lo = np.clip(lo,0,len(x)-n)
+    idx = lo[:,None]+np.arange(n)
+    xw = x[idx]
+    yw = np.take_along_axis(y,idx,axis=1)
+    # peaks are looked for within half the distance to the nearest other seed
+    reach = min(half,np.min(np.diff(np.sort(seeds[0])))/2) if k > 1 else half
+    if width is None:
+        width = np.empty(k)
+        for j,c in enumerate(seeds[0]):
+            sl = roi(x,c,reach)
+            width[j] = moment_guess(x[sl],y[0,sl])[3]
+    width = np.broadcast_to(width,(k,))
+    p0 = np.empty((m,1+3*k))
+    p0[:,0] = yw.min(1)
+    for j in range(k):
+        # start each peak at the brightest pixel in reach of its seed
+        near = np.where(np.abs(xw-seeds[:,j:j+1]) <= reach,yw,-np.inf)
+        top = np.argmax(near,axis=1)
+        p0[:,2+3*j] = xw[np.arange(m),top]
+        p0[:,1+3*j] = np.maximum(yw[np.arange(m),top]-p0[:,0],1e-6)
+        p0[:,3+3*j] = width[j]
+    parts = [(xw[i:i+chunk],yw[i:i+chunk],p0[i:i+chunk],maxiter,tol) for i in range(0,m,chunk)]
+    if workers is not None and workers > 1:
+        # only needed here, and slow to import for the single fits of the GUI
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_fit_chunk,parts))
+    else:
+        results = [_fit_chunk(a) for a in parts]
+    p, perr, rms, converged = (np.concatenate(v) for v in zip(*results))
+    # peaks which wandered out of their window did not find a line
+    converged &= np.all((p[:,2::3] >= xw[:,:1]) & (p[:,2::3] <= xw[:,-1:]) &
+                        (p[:,3::3] <= xw[:,-1:]-xw[:,:1]),axis=1)
+    return {'p':p,'perr':perr,'background':np.abs(p[:,0]),
+            'amplitude':np.abs(p[:,1::3]),'center':p[:,2::3],'width':p[:,3::3],
+            'amplitude_err':perr[:,1::3],'center_err':perr[:,2::3],'width_err':perr[:,3::3],
+            'residual':rms,'converged':converged}
@@ -1,551 +1,804 @@
-#%%
-import tkinter as tk
-import os
-from time import sleep
-from tkinter import messagebox
-from tkinter import filedialog
-import seabreeze.spectrometers as sb
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-from scipy.optimize import minimize
-
-def gauss(x,p):
-    return np.abs(p[0])+np.abs(p[1])*np.exp(-((x-p[2])/p[3])**2)
-
-from time import localtime
-def today():
-    t = localtime()
-    return "{0}{1:0>2}{2:0>2}-{3:0>2}{4:0>2}{5:0>2}".format(str(t.tm_year)[-2:],t.tm_mon,t.tm_mday,t.tm_hour,t.tm_min,t.tm_sec)
-from ctypes import c_long, c_float, windll, pointer
-
-class APTMotor():
-    def __init__(self,SerialNum=None, HWTYPE=31, loc='', verbose=False, dllname='APT.dll'):
-        '''
-        HWTYPE_BSC001		11	// 1 Ch benchtop stepper driver
-        HWTYPE_BSC101		12	// 1 Ch benchtop stepper driver
-        HWTYPE_BSC002		13	// 2 Ch benchtop stepper driver
-        HWTYPE_BDC101		14	// 1 Ch benchtop DC servo driver
-        HWTYPE_SCC001		21	// 1 Ch stepper driver card (used within BSC102,103 units)
-        HWTYPE_DCC001		22	// 1 Ch DC servo driver card (used within BDC102,103 units)
-        HWTYPE_ODC001		24	// 1 Ch DC servo driver cube
-        HWTYPE_OST001		25	// 1 Ch stepper driver cube
-        HWTYPE_MST601		26	// 2 Ch modular stepper driver module
-        HWTYPE_TST001		29	// 1 Ch Stepper driver T-Cube
-        HWTYPE_TDC001		31	// 1 Ch DC servo driver T-Cube
-        HWTYPE_LTSXXX		42	// LTS300/LTS150 Long Travel Integrated Driver/Stages
-        HWTYPE_L490MZ		43	// L490MZ Integrated Driver/Labjack
-        HWTYPE_BBD10X		44	// 1/2/3 Ch benchtop brushless DC servo driver
-        '''
-
-        self.verbose = verbose
-        self.Connected = False
-        if not os.path.exists(loc+dllname):
-            print("ERROR: DLL not found")
-        self.aptdll = windll.LoadLibrary(loc+dllname)
-        self.aptdll.EnableEventDlg(True)
-        self.aptdll.APTInit()
-        self.HWType = c_long(HWTYPE)
-        self.blCorr = 0.10 #100um backlash correction
-        if SerialNum is not None:
-            if self.verbose: print("Serial is", SerialNum)
-            self.SerialNum = c_long(SerialNum)
-            self.initializeHardwareDevice()
-        # TODO : Error reporting to know if initialisation went sucessfully or not.
-        else:
-            if self.verbose: print("No serial, please setSerialNumber")
-
-    def getNumberOfHardwareUnits(self):
-        '''
-        Returns the number of HW units connected that are available to be interfaced
-        '''
-        numUnits = c_long()
-        self.aptdll.GetNumHWUnitsEx(self.HWType, pointer(numUnits))
-        return numUnits.value
-
-    def initializeHardwareDevice(self):
-        '''
-        Initialises the motor.
-        You can only get the position of the motor and move the motor after it has been initialised.
-        Once initiallised, it will not respond to other objects trying to control it, until released.
-        '''
-        if self.verbose: print('initializeHardwareDevice serial', self.SerialNum)
-        result = self.aptdll.InitHWDevice(self.SerialNum)
-        if result == 0:
-            self.Connected = True
-            if self.verbose: print('initializeHardwareDevice connection SUCESS')
-        # need some kind of error reporting here
-        else:
-            raise Exception('Connection Failed. Check Serial Number!')
-        return True
-
-        '''
-        Controlling the motors
-        m = move
-        c = controlled velocity
-        b = backlash correction
-
-        Rel = relative distance from current position.
-        Abs = absolute position
-        '''
-    def getPos(self):
-        '''
-        Obtain the current absolute position of the stage
-        '''
-        if self.verbose: print('getPos probing...')
-        if not self.Connected:
-            raise Exception('Please connect first! Use initializeHardwareDevice')
-
-        position = c_float()
-        self.aptdll.MOT_GetPosition(self.SerialNum, pointer(position))
-        if self.verbose: print('getPos ', position.value)
-        return position.value
-
-    def mRel(self, relDistance):
-        '''
-        Moves the motor a relative distance specified
-        relDistance    float     Relative position desired
-        '''
-        if self.verbose: print('mRel ', relDistance, c_float(relDistance))
-        if not self.Connected:
-            print('Please connect first! Use initializeHardwareDevice')
-            #raise Exception('Please connect first! Use initializeHardwareDevice')
-        relativeDistance = c_float(relDistance)
-        self.aptdll.MOT_MoveRelativeEx(self.SerialNum, relativeDistance, True)
-        if self.verbose: print('mRel SUCESS')
-        return True
-
-    def mAbs(self, absPosition):
-        '''
-        Moves the motor to the Absolute position specified
-        absPosition    float     Position desired
-        '''
-        if self.verbose: print('mAbs ', absPosition, c_float(absPosition))
-        if not self.Connected:
-            raise Exception('Please connect first! Use initializeHardwareDevice')
-        absolutePosition = c_float(absPosition)
-        self.aptdll.MOT_MoveAbsoluteEx(self.SerialNum, absolutePosition, True)
-        if self.verbose: print('mAbs SUCESS')
-        return True
-
-    def mcRel(self, relDistance, moveVel=0.5):
-        '''
-        Moves the motor a relative distance specified at a controlled velocity
-        relDistance    float     Relative position desired
-        moveVel        float     Motor velocity, mm/sec
-        '''
-        if self.verbose: print('mcRel ', relDistance, c_float(relDistance), 'mVel', moveVel)
-        if not self.Connected:
-            raise Exception('Please connect first! Use initializeHardwareDevice')
-        # Save velocities to reset after move
-        maxVel = self.getVelocityParameterLimits()[1]
-        # Set new desired max velocity
-        self.setVel(moveVel)
-        self.mRel(relDistance)
-        self.setVel(maxVel)
-        if self.verbose: print('mcRel SUCESS')
-        return True
-
-    def mcAbs(self, absPosition, moveVel=0.5):
-        '''
-        Moves the motor to the Absolute position specified at a controlled velocity
-        absPosition    float     Position desired
-        moveVel        float     Motor velocity, mm/sec
-        '''
-        if self.verbose: print('mcAbs ', absPosition, c_float(absPosition), 'mVel', moveVel)
-        if not self.Connected:
-            raise Exception('Please connect first! Use initializeHardwareDevice')
-        # Save velocities to reset after move
-        minVel, acc, maxVel = self.getVelocityParameters()
-        # Set new desired max velocity
-        self.setVel(moveVel)
-        self.mAbs(absPosition)
-        self.setVel(maxVel)
-        if self.verbose: print('mcAbs SUCESS')
-        return True
-
-    def mbRel(self, relDistance):
-        '''
-        Moves the motor a relative distance specified
-        relDistance    float     Relative position desired
-        '''
-        if self.verbose: print('mbRel ', relDistance, c_float(relDistance))
-        if not self.Connected:
-            print('Please connect first! Use initializeHardwareDevice')
-            #raise Exception('Please connect first! Use initializeHardwareDevice')
-        self.mRel(relDistance-self.blCorr)
-        self.mRel(self.blCorr)
-        if self.verbose: print('mbRel SUCESS')
-        return True
-
-    def mbAbs(self, absPosition):
-        '''
-        Moves the motor to the Absolute position specified
-        absPosition    float     Position desired
-        '''
-        if self.verbose: print('mbAbs ', absPosition, c_float(absPosition))
-        if not self.Connected:
-            raise Exception('Please connect first! Use initializeHardwareDevice')
-        if (absPosition < self.getPos()):
-            if self.verbose: print('backlash mAbs', absPosition - self.blCorr)
-            self.mAbs(absPosition-self.blCorr)
-        self.mAbs(absPosition)
-        if self.verbose: print('mbAbs SUCESS')
-        return True
-
-
-    def go_home(self):
-        '''
-        Move the stage to home position and reset position entry
-        '''
-        if self.verbose: print('Going home')
-        if not self.Connected:
-            raise Exception('Please connect first! Use initializeHardwareDevice')
-        if self.verbose: print('go_home SUCESS')
-        self.aptdll.MOT_MoveHome(self.SerialNum)
-        return True
-
-
-    def cleanUpAPT(self):
-        '''
-        Releases the APT object
-        Use when exiting the program
-        '''
-        self.aptdll.APTCleanUp()
-        if self.verbose: print('APT cleaned up')
-        self.Connected = False
-
-
-class Monochromator:
-    def __init__(self,reset=True,SerialNum=20808447, HWTYPE=13, loc='C:/Users/vanschej/Documents/Python Scripts/PyAPT/',verbose=False, dllname='APT.dll'):
-        self.mot = APTMotor(SerialNum=SerialNum, HWTYPE=HWTYPE, loc=loc,verbose=verbose, dllname=dllname)
-        self.reset_calibration()
-        self.set_lower_bound(10)
-        if reset:
-            self.go_home()
-
-    def go_home(self):
-        self.mot.go_home()
-        self.move(self.lower_bound+5)
-
-    def move(self,mm):
-#        print(mm)
-        self.mot.mbAbs(mm)
-
-    def set_lower_bound(self,mm):
-        self.lower_bound = mm
-
-    def reset_calibration(self):
-        self.__calibration = [[],[],[]]
-
-    def add_point(self,pos,wave,fwhm):
-        self.__calibration[0].append(pos)
-        self.__calibration[1].append(wave)
-        self.__calibration[2].append(fwhm)
-
-    def create_calibration(self):
-        self.__b=np.sum((np.array(self.__calibration[1])-np.mean(self.__calibration[1]))*(np.array(self.__calibration[0])-np.mean(self.__calibration[0])))/np.sum((np.array(self.__calibration[1])-np.mean(self.__calibration[1]))**2)
-        self.__a=np.mean(self.__calibration[0])-self.__b*np.mean(self.__calibration[1])
-        self.__monoBound = [np.ceil((self.lower_bound-self.__a)/self.__b),np.floor((self.lower_bound-31-self.__a)/self.__b)]
-
-    def save_calibration_points(self,path_to_folder):
-        self.create_calibration()
-        oldD = os.getcwd()
-        os.chdir(path_to_folder)
-        f = open(today()+".cal","w")
-        for c in self.__calibration:
-            f.write(",".join([str(cc) for cc in c])+"\n")
-        f.write("{0},{1},{2},{3}\n".format(self.__b,self.__a,*self.__monoBound))
-        f.close()
-        os.chdir(oldD)
-
-    def load_calibration_points(self,file):
-        f = open(file)
-        calibrationPoints = [[float(ll) for ll in l.strip("\n").split(",")] for l in f]
-        check_old = np.array(calibrationPoints.pop())
-        self.reset_calibration()
-        for p,w,f in zip(*calibrationPoints):
-            self.add_point(p,w,f)
-        self.create_calibration()
-        check_new = np.append([self.__b,self.__a],self.__monoBound)
-        return np.all(np.abs(check_old-check_new)/check_old < 0.1)
-
-    def get_pos(self,lam):
-        res = self.__a+self.__b*lam
-        #assert res>=iniPos and res<=iniPos+31
-        return(res)
-
-    def go_to_wave(self,lam):
-        self.move(self.get_pos(lam))
-
-    def shutdown(self):
-        self.mot.cleanUpAPT()
-
-class Calibrate(tk.Frame):
-    def __init__(self,monochromator):
-        tk.Frame.__init__(self,None)
-        self.master.title("Calibration Window")
-        self.master.protocol("WM_DELETE_WINDOW", lambda : self.master.destroy())
-        self.spec = Spectrometer()
-        self.specRunning = True
-        self.mono = monochromator
-        self.mono.reset_calibration()
-        self.create_widgets()
-        self.start_aquisition()
-        self.mainloop()
-        self.spec.close()
-
-    def create_widgets(self):
-        # Create MPL Figure
-        self.mpl = MPL(self.master,
-                       self.spec.wavelengths(),self.spec.intensities(),
-                       #np.arange(0,100,0.1),gauss(np.arange(0,100,0.1),[200,2700,40,5]),
-                       #self.spec.wavelengths,self.spec.intensities,
-                       column=0,row=2,columnspan=2)
-
-        # Create Spectrometer control window
-        self.specFrame = tk.LabelFrame(self.master,text="Spectrometer Controls")
-        self.specFrame.grid(column=0,row=0)
-        self.ITLabel = tk.Label(self.specFrame,text="IT (ms)")
-        self.ITLabel.grid(column=0,row=0,sticky=tk.E)
-        self.ITvariable = tk.StringVar()
-        self.set_IT(20)
-        self.ITEntry = tk.Entry(self.specFrame,
-                                textvariable=self.ITvariable,
-                                width=6)
-        self.ITEntry.grid(column=1,row=0)
-        self.ITUpdateButton = tk.Button(self.specFrame,text="Update",
-                                        command=lambda: self.set_IT(self.ITvariable.get()))
-        self.ITUpdateButton.grid(column=2,row=0,sticky=tk.W)
-        self.PPLabel = tk.Label(self.specFrame,text="Aquire:")
-        self.PPLabel.grid(column=0,row=1,sticky=tk.E)
-        self.playButton = tk.Button(self.specFrame,text="Play",
-                                    command=lambda: self.start_aquisition())
-        self.playButton.grid(column=1,row=1)
-        self.pauseButton = tk.Button(self.specFrame,text="Pause",
-                                    command=lambda: self.stop_aquisition())
-        self.pauseButton.grid(column=2,row=1)
-
-        # Create calibration setup
-        self.calFrame = tk.LabelFrame(self.master,text="Spectrometer Controls")
-        self.calFrame.grid(column=1,row=0)
-        self.PosLabel = tk.Label(self.calFrame,text="Starting Position:")
-        self.PosLabel.grid(column=0,row=0,sticky=tk.E)
-        self.Posvariable = tk.StringVar()
-        self.set_Pos(self.mono.lower_bound)
-        self.PosEntry = tk.Entry(self.calFrame,
-                                textvariable=self.Posvariable,
-                                width=6)
-        self.PosEntry.grid(column=1,row=0)
-        self.PosUpdateButton = tk.Button(self.calFrame,text="Move",
-                                        command=lambda: self.set_Pos(self.Posvariable.get()))
-        self.PosUpdateButton.grid(column=2,row=0,sticky=tk.W)
-        self.stepLabel = tk.Label(self.calFrame,text="Number of Steps:")
-        self.stepLabel.grid(column=0,row=1,sticky=tk.E)
-        self.Stepvariable = tk.StringVar()
-        self.Stepvariable.set("3")
-        self.StepEntry = tk.Entry(self.calFrame,
-                                textvariable=self.Stepvariable,
-                                width=6)
-        self.StepEntry.grid(column=1,row=1)
-        self.startCalButton = tk.Button(self.calFrame,
-                                         text="Start Calibration",
-                                         command = lambda: self.start_calibration())
-        self.startCalButton.grid(column=0,row=2)
-        self.nextButton = tk.Button(self.calFrame,
-                                    text="Next Position",
-                                    command = lambda: self.next_position())
-        self.nextButton.grid(column=1,row=2)
-        self.nextButton.config(state='disabled')
-
-
-    def set_IT(self,IT):
-        try:
-            it = int(IT)*1000
-        except:
-            it = 100*1000
-        if it<10*1000:
-            it = 10*1000
-        elif it>10*1000*1000:
-            it = 10*1000*1000
-        self.spec.integration_time_micros(it)
-        self.ITvariable.set(str(it//1000))
-        self.mpl.update_spectrum(self.spec.intensities())
-
-    def set_Pos(self,POS):
-        try:
-            pos = int(POS)
-        except:
-            pos = 100
-        if pos<0:
-            pos = 0
-        elif pos>150:
-            pos = 150
-        self.mono.set_lower_bound(pos)
-        self.Posvariable.set(str(pos))
-        self.mono.move(self.mono.lower_bound)
-
-    def start_aquisition(self):
-        self.specRunning = True
-        self.aquire()
-
-    def aquire(self):
-#        y = self.mpl.spectrum.get_ydata()
-        self.mpl.update_spectrum(self.spec.intensities())#(0.99*y)
-        if self.specRunning:
-            self.master.after(0,self.aquire)
-
-    def stop_aquisition(self):
-        self.specRunning = False
-
-    def start_calibration(self):
-        self.stop_aquisition()
-        self.playButton.config(state="disabled")
-        self.pauseButton.config(state="disabled")
-        self.PosUpdateButton.config(state="disabled")
-        self.startCalButton.config(state="disabled")
-        self.nextButton.config(state='normal')
-        try:
-            n = int(self.Stepvariable.get())
-        except:
-            n = 5
-        if n<2:
-            n = 2
-        elif n>10:
-            n = 10
-        self.mmSpace = list(self.mono.lower_bound-np.linspace(5,31-4,n))
-        self.mono.move(self.mmSpace.pop(0))
-        sleep(0.1)
-        self.mpl.update_spectrum(self.spec.intensities())
-        self.mpl.gen_fit()
-
-    def next_position(self):
-        self.mono.add_point(self.mono.mot.getPos(),*self.mpl.p[-2:])
-        try:
-            mm = self.mmSpace.pop(0)
-        except IndexError:
-            self.save_calibration_file()
-            self.master.destroy()
-        else:
-            self.mono.move(mm)
-            sleep(0.1)
-            self.mpl.update_spectrum(self.spec.intensities())
-            self.mpl.gen_fit()
-
-
-    def save_calibration_file(self):
-        path = filedialog.askdirectory(initialdir = os.getcwd(),
-                                      title= "Calibration File Directory")
-        self.mono.save_calibration_points(path)
-
-
-class MPL:
-    def __init__(self,master,x,y,p=[0,0,500,5],**kwargs):
-        self.x = x
-        self.p = np.array(p)
-
-        # Create tk Frame to hold MPL plot
-        self.frame = tk.Frame(master)
-        self.frame.grid(**kwargs)
-
-        # Create MPL figure
-        self.fig = plt.figure(figsize=(10,5))
-        self.ax = self.fig.add_subplot(111)
-        self.spectrum, = self.ax.plot(x,y,color="blue")
-        self.ax.set_xlabel("Wavelength (nm)")
-        self.ax.set_ylabel("Counts")
-        self.ax.set_ylim(0,4000)
-
-        # Attached MPL figure and toolbar to tk Frame
-        self.canvas = FigureCanvasTkAgg(self.fig,self.frame)
-        self.canvas.get_tk_widget().pack()
-        self.toolbar = NavigationToolbar2Tk(self.canvas,self.frame)
-        self.toolbar.update()
-
-        # initialize fit
-        self.fit, = self.ax.plot(x,gauss(x,self.p),color="black")
-
-        # Setup MPL click collbacks
-        self.canvas.mpl_connect('button_press_event',self.click)
-
-    def click(self,event):
-        if event.inaxes == self.ax:
-            if event.button == 1:
-                print("Left click @ x=",event.xdata," y=",event.ydata)
-                self.p[1],self.p[2] = event.ydata,event.xdata
-                self.update_fit()
-            if event.button == 2:
-                print("Scroll click @ x=",event.xdata," y=",event.ydata)
-            if event.button == 3:
-                print("Right click @ x=",event.xdata," y=",event.ydata)
-                self.gen_fit()
-
-    def update_fit(self):
-        self.fit.set_ydata(gauss(self.x,self.p))
-        self.fig.canvas.draw()
-
-    def update_spectrum(self,y):
-        self.spectrum.set_ydata(y)
-        self.fig.canvas.draw()
-
-    def gen_fit(self):
-        y = self.spectrum.get_ydata()
-        x0 = self.x[np.argmax(y)]
-        y0 = np.max(y)
-        mask = np.array(np.abs(self.x-x0)<50)
-        def diff(p):
-            return np.sum((y[mask]-gauss(self.x,p)[mask])**2)
-        fit = minimize(diff,[y[0],y0,x0,1])
-#        print(fit)
-        self.p = np.copy(fit.x)
-        self.update_fit()
-
-#%
-class selectionBox(tk.LabelFrame):
-    def __init__(self,master,variable,valueList,label="",textList=None):
-        tk.LabelFrame.__init__(self,master,text=label)
-        self.variable = variable
-        self.RBList = []
-        self.gen_list(valueList,textList)
-
-
-    def gen_list(self,valueList,textList=None):
-        for rb in self.RBList:
-            rb.destroy()
-        if textList is None:
-            tL = [str(v) for v in valueList]
-        else:
-            tL = textList
-        self.RBList = [tk.Radiobutton(self,text=t,variable=self.variable,value=v,indicatoron=0)\
-                       for t,v in zip(tL,valueList)]
-        for i,rb in enumerate(self.RBList):
-            rb.grid(column=0,row=i)
-
-class Spectrometer(sb.Spectrometer):
-    def __init__(self):
-        def scan():
-            return sb.list_devices()
-        deviceList = scan()
-        if len(deviceList) == 1:
-            sb.Spectrometer.__init__(self,deviceList[0])
-        else:
-            root = tk.Tk()
-            root.title("Spectrometer Selection")
-            root.geometry("200x200")
-            d = tk.StringVar()
-            buttonList = selectionBox(root,d,deviceList,label="Select Spectrometer")
-            buttonList.grid(column=0,row=1,columnspan=2)
-            def rescan(buttonList):
-                deviceList = scan()
-                buttonList.gen_list(deviceList)
-            tk.Button(root,text="Rescan",command= lambda : rescan(buttonList)).grid(column=0,row=0)
-            def load():
-                try:
-                    sb.Spectrometer.__init__(self,d.get())
-                except:
-                    print("Problem loading device \'%s\', try again" % d.get())
-                else:
-                    root.destroy()
-            tk.Button(root,text="Load",command=load).grid(column=1,row=0)
-            root.protocol("WM_DELETE_WINDOW", lambda : root.destroy())
-            root.mainloop()
+"""Motion and calibration core of the monochromator
+---Classes---
+APTMotor:
+    ctypes wrapper around the Thorlabs APT.dll for a single stage
+
+Monochromator:
+    Moves the stage to wavelengths through a Calibration
+
+Only numpy (and the standard library) is imported here, so that scripts which
+just need Monochromator.go_to_wave start quickly. The GUI (Calibrate, MPL) and
+the spectrometer (Spectrometer, selectionBox) used to live in this module, and
+are still available from it, but are only imported on first use
+"""
+
+#%%
+import os
+import threading
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time, perf_counter
+import numpy as np
+from .planner import MotionPlanner
+from .calibration import Calibration, CalibrationAccumulator
+from .session import save_session, load_session
+
+from time import localtime
+def today():
+    t = localtime()
+    return "{0}{1:0>2}{2:0>2}-{3:0>2}{4:0>2}{5:0>2}".format(str(t.tm_year)[-2:],t.tm_mon,t.tm_mday,t.tm_hour,t.tm_min,t.tm_sec)
+from ctypes import c_long, c_float, pointer
+
+_lazy = {'Calibrate':'.calibrate','MPL':'.calibrate',
+         'Spectrometer':'.spectrometer','selectionBox':'.spectrometer'}
+def __getattr__(name):
+    # GUI and spectrometer classes pull in tkinter, matplotlib and seabreeze
+    if name in _lazy:
+        from importlib import import_module
+        return getattr(import_module(_lazy[name],__package__),name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__,name))
+
+class APTMotor():
+    def __init__(self,SerialNum=None, HWTYPE=31, loc='', verbose=False, dllname='APT.dll', aptdll=None):
+        '''
+        aptdll: Object standing in for the loaded APT.dll, e.g. simulate.SimulatedAPT()
+                (by default loc+dllname is loaded with ctypes.windll)
+
+        HWTYPE_BSC001		11	// 1 Ch benchtop stepper driver
+        HWTYPE_BSC101		12	// 1 Ch benchtop stepper driver
+        HWTYPE_BSC002		13	// 2 Ch benchtop stepper driver
+        HWTYPE_BDC101		14	// 1 Ch benchtop DC servo driver
+        HWTYPE_SCC001		21	// 1 Ch stepper driver card (used within BSC102,103 units)
+        HWTYPE_DCC001		22	// 1 Ch DC servo driver card (used within BDC102,103 units)
+        HWTYPE_ODC001		24	// 1 Ch DC servo driver cube
+        HWTYPE_OST001		25	// 1 Ch stepper driver cube
+        HWTYPE_MST601		26	// 2 Ch modular stepper driver module
+        HWTYPE_TST001		29	// 1 Ch Stepper driver T-Cube
+        HWTYPE_TDC001		31	// 1 Ch DC servo driver T-Cube
+        HWTYPE_LTSXXX		42	// LTS300/LTS150 Long Travel Integrated Driver/Stages
+        HWTYPE_L490MZ		43	// L490MZ Integrated Driver/Labjack
+        HWTYPE_BBD10X		44	// 1/2/3 Ch benchtop brushless DC servo driver
+        '''
+
+        self.verbose = verbose
+        self.Connected = False
+        if aptdll is None:
+            from ctypes import windll # windows only
+            if not os.path.exists(loc+dllname):
+                print("ERROR: DLL not found")
+            aptdll = windll.LoadLibrary(loc+dllname)
+        self.aptdll = aptdll
+        self.aptdll.EnableEventDlg(True)
+        self.aptdll.APTInit()
+        self.HWType = c_long(HWTYPE)
+        self.blCorr = 0.10 #100um backlash correction
+        self.tol = 0.001 #1um, distance from target counted as arrived
+        self.commandedPos = None # target of the last move, None if unknown
+        self.confirmedPos = None # last position read from the hardware
+        self.validateEvery = 20 # moves between hardware reads in knownPos
+        self.movesSinceRead = 0
+        self.inFlight = 0 # asynchronous moves not yet arrived
+        self.moveTimeout = 5 # s allowed on top of twice the planned move time
+        self.planner = MotionPlanner(self.blCorr)
+        self.lock = threading.RLock() # serializes calls into the dll
+        self.mover = ThreadPoolExecutor(1) # waits on asynchronous moves
+        self.timer = None # optional timing.PhaseTimer, records backlash corrected moves as 'move'
+        if SerialNum is not None:
+            if self.verbose: print("Serial is", SerialNum)
+            self.SerialNum = c_long(SerialNum)
+            self.initializeHardwareDevice()
+        # TODO : Error reporting to know if initialisation went sucessfully or not.
+        else:
+            if self.verbose: print("No serial, please setSerialNumber")
+
+    def getNumberOfHardwareUnits(self):
+        '''
+        Returns the number of HW units connected that are available to be interfaced
+        '''
+        numUnits = c_long()
+        self.aptdll.GetNumHWUnitsEx(self.HWType, pointer(numUnits))
+        return numUnits.value
+
+    def initializeHardwareDevice(self):
+        '''
+        Initialises the motor.
+        You can only get the position of the motor and move the motor after it has been initialised.
+        Once initiallised, it will not respond to other objects trying to control it, until released.
+        '''
+        if self.verbose: print('initializeHardwareDevice serial', self.SerialNum)
+        result = self.aptdll.InitHWDevice(self.SerialNum)
+        if result == 0:
+            self.Connected = True
+            if self.verbose: print('initializeHardwareDevice connection SUCESS')
+        # need some kind of error reporting here
+        else:
+            raise Exception('Connection Failed. Check Serial Number!')
+        return True
+
+        '''
+        Controlling the motors
+        m = move
+        c = controlled velocity
+        b = backlash correction
+
+        Rel = relative distance from current position.
+        Abs = absolute position
+        '''
+    def getPos(self):
+        '''
+        Obtain the current absolute position of the stage
+        '''
+        if self.verbose: print('getPos probing...')
+        if not self.Connected:
+            raise Exception('Please connect first! Use initializeHardwareDevice')
+
+        position = c_float()
+        with self.lock:
+            self.aptdll.MOT_GetPosition(self.SerialNum, pointer(position))
+            self.confirmedPos = position.value
+            self.movesSinceRead = 0
+        if self.verbose: print('getPos ', position.value)
+        return position.value
+
+    def knownPos(self):
+        '''
+        Position of the stage for planning decisions (e.g. backlash direction)
+        without a round trip through the dll: the target of the last move.
+        The hardware is only read if no move has been commanded since the
+        position became unknown, every validateEvery moves, or while an
+        asynchronous move is under way (without updating the cache, as the
+        stage is still between positions). Use getPos for anything recorded
+        '''
+        with self.lock:
+            moving = self.inFlight > 0
+        if moving:
+            return self.getPos()
+        if self.commandedPos is None or self.movesSinceRead >= self.validateEvery:
+            pos = self.getPos()
+            if self.commandedPos is None or abs(pos-self.commandedPos) > self.tol:
+                self.commandedPos = pos
+            return pos
+        return self.commandedPos
+
+    def __commanded(self, absPosition):
+        with self.lock:
+            self.commandedPos = absPosition
+            self.movesSinceRead += 1
+
+    def mRel(self, relDistance, wait=True):
+        '''
+        Moves the motor a relative distance specified
+        relDistance    float     Relative position desired
+        wait           bool      Block until the move is complete
+        '''
+        if self.verbose: print('mRel ', relDistance, c_float(relDistance))
+        if not self.Connected:
+            print('Please connect first! Use initializeHardwareDevice')
+            #raise Exception('Please connect first! Use initializeHardwareDevice')
+        relativeDistance = c_float(relDistance)
+        with self.lock:
+            self.aptdll.MOT_MoveRelativeEx(self.SerialNum, relativeDistance, wait)
+            self.__commanded(None if self.commandedPos is None else self.commandedPos+relDistance)
+        if self.verbose: print('mRel SUCESS')
+        return True
+
+    def mAbs(self, absPosition, wait=True):
+        '''
+        Moves the motor to the Absolute position specified
+        absPosition    float     Position desired
+        wait           bool      Block until the move is complete
+        '''
+        if self.verbose: print('mAbs ', absPosition, c_float(absPosition))
+        if not self.Connected:
+            raise Exception('Please connect first! Use initializeHardwareDevice')
+        absolutePosition = c_float(absPosition)
+        with self.lock:
+            self.aptdll.MOT_MoveAbsoluteEx(self.SerialNum, absolutePosition, wait)
+            self.__commanded(absPosition)
+        if self.verbose: print('mAbs SUCESS')
+        return True
+
+    def getVelocityParameters(self):
+        '''
+        Returns [minimum velocity (mm/s), acceleration (mm/s^2), maximum velocity (mm/s)]
+        '''
+        minimumVelocity = c_float()
+        acceleration = c_float()
+        maximumVelocity = c_float()
+        with self.lock:
+            self.aptdll.MOT_GetVelParams(self.SerialNum, pointer(minimumVelocity), pointer(acceleration), pointer(maximumVelocity))
+        return [minimumVelocity.value, acceleration.value, maximumVelocity.value]
+
+    def getVelocityParameterLimits(self):
+        '''
+        Returns [maximum acceleration (mm/s^2), maximum velocity (mm/s)] allowed by the stage
+        '''
+        maximumAcceleration = c_float()
+        maximumVelocity = c_float()
+        with self.lock:
+            self.aptdll.MOT_GetVelParamLimits(self.SerialNum, pointer(maximumAcceleration), pointer(maximumVelocity))
+        return [maximumAcceleration.value, maximumVelocity.value]
+
+    def setVelocityParameters(self, minVel, acc, maxVel):
+        '''
+        Sets the minimum velocity, acceleration and maximum velocity used by moves
+        '''
+        with self.lock:
+            self.aptdll.MOT_SetVelParams(self.SerialNum, c_float(minVel), c_float(acc), c_float(maxVel))
+        return True
+
+    def setVel(self, maxVel):
+        '''
+        Sets the maximum velocity (mm/s) used by moves
+        '''
+        if self.verbose: print('setVel', maxVel)
+        minVel, acc, oldVel = self.getVelocityParameters()
+        self.setVelocityParameters(minVel, acc, maxVel)
+        return oldVel
+
+    def mcRel(self, relDistance, moveVel=0.5):
+        '''
+        Moves the motor a relative distance specified at a controlled velocity
+        relDistance    float     Relative position desired
+        moveVel        float     Motor velocity, mm/sec
+        '''
+        if self.verbose: print('mcRel ', relDistance, c_float(relDistance), 'mVel', moveVel)
+        if not self.Connected:
+            raise Exception('Please connect first! Use initializeHardwareDevice')
+        # Save velocities to reset after move
+        maxVel = self.getVelocityParameterLimits()[1]
+        # Set new desired max velocity
+        self.setVel(moveVel)
+        self.mRel(relDistance)
+        self.setVel(maxVel)
+        if self.verbose: print('mcRel SUCESS')
+        return True
+
+    def mcAbs(self, absPosition, moveVel=0.5):
+        '''
+        Moves the motor to the Absolute position specified at a controlled velocity
+        absPosition    float     Position desired
+        moveVel        float     Motor velocity, mm/sec
+        '''
+        if self.verbose: print('mcAbs ', absPosition, c_float(absPosition), 'mVel', moveVel)
+        if not self.Connected:
+            raise Exception('Please connect first! Use initializeHardwareDevice')
+        # Save velocities to reset after move
+        minVel, acc, maxVel = self.getVelocityParameters()
+        # Set new desired max velocity
+        self.setVel(moveVel)
+        self.mAbs(absPosition)
+        self.setVel(maxVel)
+        if self.verbose: print('mcAbs SUCESS')
+        return True
+
+    def mbRel(self, relDistance):
+        '''
+        Moves the motor a relative distance specified
+        relDistance    float     Relative position desired
+        '''
+        if self.verbose: print('mbRel ', relDistance, c_float(relDistance))
+        if not self.Connected:
+            print('Please connect first! Use initializeHardwareDevice')
+            #raise Exception('Please connect first! Use initializeHardwareDevice')
+        self.mRel(relDistance-self.blCorr)
+        self.mRel(self.blCorr)
+        if self.verbose: print('mbRel SUCESS')
+        return True
+
+    def mbAbs(self, absPosition):
+        '''
+        Moves the motor to the Absolute position specified
+        absPosition    float     Position desired
+        '''
+        if self.verbose: print('mbAbs ', absPosition, c_float(absPosition))
+        if not self.Connected:
+            raise Exception('Please connect first! Use initializeHardwareDevice')
+        t0 = perf_counter()
+        if (absPosition < self.knownPos()):
+            if self.verbose: print('backlash mAbs', absPosition - self.blCorr)
+            self.mAbs(absPosition-self.blCorr)
+        self.mAbs(absPosition)
+        if self.timer is not None:
+            self.timer.record('move',perf_counter()-t0)
+        if self.verbose: print('mbAbs SUCESS')
+        return True
+
+    def mbAbsBatch(self, positions, mode='sorted'):
+        '''
+        Visits each of positions with backlash correction, in the order chosen
+        by self.planner so that overshoots are rare. A generator yielding
+        (index, position) once the stage has arrived at positions[index]
+        mode           str       Planning mode, see MotionPlanner.order
+        '''
+        self.planner.blCorr = self.blCorr
+        for i in self.planner.order(positions, self.knownPos(), mode):
+            self.mbAbs(positions[i])
+            yield i, positions[i]
+
+    def waitForPos(self, absPosition, tol=None, timeout=None, poll=0.005):
+        '''
+        Polls the stage until it is within tol of absPosition
+        absPosition    float     Target position
+        tol            float     Tolerance, defaults to self.tol
+        timeout        float     Seconds before raising TimeoutError, defaults to twice
+                                  the planned time of the remaining move plus moveTimeout
+        Returns the reported position
+        '''
+        tol = self.tol if tol is None else tol
+        t0 = time()
+        pos = self.getPos()
+        if timeout is None:
+            timeout = 2*self.planner.move_time(pos-absPosition)+self.moveTimeout
+        while True:
+            if abs(pos-absPosition) <= tol:
+                return pos
+            if time()-t0 > timeout:
+                raise TimeoutError('Stage at {0}, not {1}, after {2} s'.format(pos,absPosition,timeout))
+            sleep(poll)
+            pos = self.getPos()
+
+    def mAbsAsync(self, absPosition, tol=None, timeout=None):
+        '''
+        Starts a move to the Absolute position specified and returns immediately
+        Returns a concurrent.futures.Future which resolves to the stage position
+        once it is within tol of absPosition. Like every asynchronous move, the
+        command is issued from the mover thread, after any moves queued before it
+        '''
+        def move():
+            self.mAbs(absPosition, wait=False)
+            return self.waitForPos(absPosition, tol, timeout)
+        return self.__track(self.mover.submit(move))
+
+    def __track(self, future):
+        # the cached position is invalid until the move has finished
+        with self.lock:
+            self.inFlight += 1
+        def done(f):
+            with self.lock:
+                self.inFlight -= 1
+        future.add_done_callback(done)
+        return future
+
+    def mRelAsync(self, relDistance, tol=None, timeout=None):
+        '''
+        Starts a relative move and returns a Future, see mAbsAsync. The
+        distance is relative to where the moves queued before it end up
+        '''
+        def move():
+            target = self.knownPos()+relDistance
+            self.mAbs(target, wait=False)
+            return self.waitForPos(target, tol, timeout)
+        return self.__track(self.mover.submit(move))
+
+    def mbAbsAsync(self, absPosition, tol=None, timeout=None):
+        '''
+        Backlash corrected version of mAbsAsync: when moving down, the stage
+        first overshoots by blCorr and then approaches absPosition from below
+        '''
+        if not self.Connected:
+            raise Exception('Please connect first! Use initializeHardwareDevice')
+        t0 = perf_counter()
+        def move():
+            # the direction is decided once the moves queued before are done
+            if absPosition < self.knownPos():
+                self.mAbs(absPosition-self.blCorr, wait=False)
+                self.waitForPos(absPosition-self.blCorr, tol, timeout)
+            self.mAbs(absPosition, wait=False)
+            return self.waitForPos(absPosition, tol, timeout)
+        future = self.__track(self.mover.submit(move))
+        if self.timer is not None:
+            future.add_done_callback(lambda f: self.timer.record('move',perf_counter()-t0))
+        return future
+
+
+    def go_home(self):
+        '''
+        Move the stage to home position and reset position entry
+        '''
+        if self.verbose: print('Going home')
+        if not self.Connected:
+            raise Exception('Please connect first! Use initializeHardwareDevice')
+        if self.verbose: print('go_home SUCESS')
+        with self.lock:
+            self.aptdll.MOT_MoveHome(self.SerialNum)
+            self.commandedPos = None
+        return True
+
+
+    def cleanUpAPT(self):
+        '''
+        Releases the APT object
+        Use when exiting the program
+        '''
+        self.mover.shutdown()
+        self.aptdll.APTCleanUp()
+        if self.verbose: print('APT cleaned up')
+        self.Connected = False
+
+
+class Monochromator:
+    def __init__(self,reset=True,SerialNum=20808447, HWTYPE=13, loc='C:/Users/vanschej/Documents/Python Scripts/PyAPT/',verbose=False, dllname='APT.dll', aptdll=None):
+        self.mot = APTMotor(SerialNum=SerialNum, HWTYPE=HWTYPE, loc=loc,verbose=verbose, dllname=dllname, aptdll=aptdll)
+        self.reset_calibration()
+        self.set_lower_bound(10)
+        if reset:
+            self.go_home()
+
+    def go_home(self):
+        self.mot.go_home()
+        self.move(self.lower_bound+5)
+
+    def move(self,mm):
+#        print(mm)
+        self.mot.mbAbs(mm)
+
+    def move_async(self,mm,tol=None,timeout=None):
+        '''
+        Start a backlash corrected move and return a Future which resolves to
+        the stage position once it has arrived within tol
+        '''
+        return self.mot.mbAbsAsync(mm,tol,timeout)
+
+    def move_and_acquire(self,mm,acquire,settle=0):
+        '''
+        Move to mm, let the stage settle and read out a spectrum. Returns the
+        measured position, the spectrum and the time.time() its readout started
+        settle         float     Seconds to wait after the move, or a SettleDetector.
+                                  If the detector acquires its own spectra, its last
+                                  one is used instead of acquire()
+        '''
+        self.move(mm)
+        y = None
+        if hasattr(settle,'wait'):
+            # the detector may hand back the spectrum it settled on
+            t0 = time()
+            pos, y = settle.wait(mm,self.mot.tol)
+        else:
+            if settle:
+                sleep(settle)
+            pos = self.mot.getPos()
+        if y is None:
+            t0 = time()
+            y = acquire()
+        return pos, y, t0
+
+    def set_lower_bound(self,mm):
+        self.lower_bound = mm
+
+    def reset_calibration(self):
+        self.__calibration = [[],[],[]]
+        self.__weights = []
+        self.accumulator = CalibrationAccumulator()
+        self.calibration = None
+
+    def add_point(self,pos,wave,fwhm,weight=1.0):
+        '''
+        Add a calibration point, returns its index
+        '''
+        self.__calibration[0].append(pos)
+        self.__calibration[1].append(wave)
+        self.__calibration[2].append(fwhm)
+        self.__weights.append(weight)
+        return self.accumulator.add(wave,pos,weight)
+
+    def remove_point(self,i):
+        '''
+        Drop point i from the calibration (it is kept, with weight 0, but not
+        saved), see weight_point
+        '''
+        self.weight_point(i,0)
+
+    def weight_point(self,i,weight):
+        '''
+        Change the weight of point i. A linear calibration is updated in
+        constant time, other models are refit on the next create_calibration
+        '''
+        self.__weights[i] = weight
+        self.accumulator.reweight(i,weight)
+        self.update_calibration()
+
+    def fold_point(self,pos,wave,fwhm,weight=1.0):
+        '''
+        Fold a single check point, with the fitted width of its line, into the
+        existing calibration without refitting a linear one. Returns the shift
+        (mm) this makes at wave
+        '''
+        if self.calibration is None:
+            raise RuntimeError("There is no calibration to fold a point into")
+        old = self.get_pos(wave)
+        self.add_point(pos,wave,fwhm,weight)
+        if self.calibration.model == 'linear':
+            self.update_calibration()
+        else:
+            self.create_calibration(self.calibration.model,self.calibration.deg)
+        return self.get_pos(wave)-old
+
+    def update_calibration(self):
+        '''
+        Bring a linear calibration up to date with the running sums of the
+        points, without refitting. Does nothing for the other models
+        '''
+        if self.calibration is None or self.calibration.model != 'linear':
+            return
+        self.calibration.set_line(self.accumulator.a,self.accumulator.b,self.accumulator)
+        self.__set_line(self.calibration.a,self.calibration.b)
+
+    def __set_line(self,a,b):
+        self.__a, self.__b = a, b
+        # wavelengths at the ends of the travel through the calibration itself,
+        # so that nonlinear models are inverted rather than taken as a line.
+        # Their inverse only holds over the lookup table, so the ends are kept in it
+        ends = np.array([self.lower_bound,self.lower_bound-31],dtype=float)
+        if self.calibration.model != 'linear':
+            w, p = self.calibration.lut if self.calibration.lut is not None else self.calibration.build_lut()
+            ends = np.clip(ends,min(p[0],p[-1]),max(p[0],p[-1]))
+        lo, hi = self.calibration.to_wave(ends)
+        self.__monoBound = [np.ceil(lo),np.floor(hi)]
+
+    def apply_drift(self,offset,scale=1.0):
+        '''
+        Correct the calibration for an output which has drifted so that asking
+        for lam gives offset + scale*lam (see drift.DriftCheck): the wavelengths
+        of all calibration points are mapped through the drift, and a linear
+        calibration is updated from them (other models are refit)
+        '''
+        calibration = self.calibration
+        if calibration is None:
+            raise RuntimeError("There is no calibration to correct")
+        pos, wave, fwhm = self.__calibration
+        weights = self.__weights
+        self.reset_calibration()
+        for p,w,f,wt in zip(pos,wave,fwhm,weights):
+            self.add_point(p,offset+scale*w,scale*f,wt)
+        self.calibration = calibration
+        if calibration.model == 'linear':
+            self.update_calibration()
+        else:
+            self.create_calibration(calibration.model,calibration.deg)
+
+    def create_calibration(self,model='linear',deg=None):
+        '''
+        Fit the calibration points, see Calibration for the available models
+        '''
+        pos, wave, fwhm = (np.asarray(c,dtype=float) for c in self.__calibration)
+        self.calibration = Calibration(wave,pos,model,deg,weights=None if self.accumulator.unweighted
+                                       else np.asarray(self.__weights,dtype=float))
+        self.__set_line(self.calibration.a,self.calibration.b)
+
+    def save_calibration_points(self,path_to_folder,fmt='npz',spectra=None,positions=None,wavelengths=None):
+        '''
+        Write the calibration to path_to_folder/<timestamp>.<fmt> and return the file name
+        fmt            str       'npz' for the binary session format (see session.py),
+                                  which can also hold the raw spectra of the session,
+                                  or 'cal' for the legacy comma separated text file
+                                  (with a row of weights if any point is reweighted)
+        spectra        array     Optional (m,npix) spectra taken during calibration
+        positions      array     Optional (m,) stage positions of the spectra
+        wavelengths    array     Optional (npix,) wavelength axis of the spectra
+        '''
+        if self.calibration is None:
+            self.create_calibration()
+        else:
+            self.create_calibration(self.calibration.model,self.calibration.deg)
+        fname = os.path.join(path_to_folder,today()+"."+fmt)
+        coef = [self.__b,self.__a,*self.__monoBound]
+        keep = [w != 0 for w in self.__weights] # removed points are not saved
+        points = [[v for v,k in zip(c,keep) if k] for c in self.__calibration]
+        weights = [w for w in self.__weights if w != 0]
+        if fmt == 'npz':
+            save_session(fname,points,coef,self.calibration.model,self.calibration.deg,
+                         spectra=spectra,positions=positions,wavelengths=wavelengths,
+                         lower_bound=self.lower_bound,weights=weights)
+            return fname
+        if any(w != 1 for w in weights):
+            # a fourth row, only when needed so unweighted files stay legacy
+            points = points+[weights]
+        with open(fname,"w") as f:
+            for c in points:
+                f.write(",".join([str(cc) for cc in c])+"\n")
+            f.write("{0},{1},{2},{3}\n".format(*coef))
+        return fname
+
+    def load_calibration_points(self,file):
+        '''
+        Load a .cal or .npz calibration file and refit it. Returns True if the
+        refit coefficients agree with the stored ones to within 10%
+        '''
+        weights = None
+        if file.endswith(".npz"):
+            session = load_session(file)
+            calibrationPoints, check_old = session.points, session.coef
+            model, deg = session.model, session.deg
+            weights = getattr(session,'weights',None)
+        else:
+            with open(file) as f:
+                calibrationPoints = [[float(ll) for ll in l.strip("\n").split(",")] for l in f]
+            check_old = np.array(calibrationPoints.pop())
+            model, deg = 'linear', None
+            if len(calibrationPoints) == 4:
+                weights = calibrationPoints.pop()
+        if weights is None:
+            weights = np.ones(len(calibrationPoints[0]))
+        self.reset_calibration()
+        for p,w,f,wt in zip(*calibrationPoints,weights):
+            self.add_point(p,w,f,wt)
+        self.create_calibration(model,deg)
+        check_new = np.append([self.__b,self.__a],self.__monoBound)
+        return np.all(np.abs(check_old-check_new)/check_old < 0.1)
+
+    def get_pos(self,lam):
+        res = self.calibration.to_pos(lam)
+        #assert res>=iniPos and res<=iniPos+31
+        return(res if np.ndim(res) else float(res))
+
+    def get_wave(self,mm):
+        res = self.calibration.to_wave(mm)
+        return(res if np.ndim(res) else float(res))
+
+    def go_to_wave(self,lam):
+        self.move(self.get_pos(lam))
+
+    def plan_scan(self,wavelengths,mode='sorted'):
+        '''
+        Order wavelengths to minimize backlash overshoots, see MotionPlanner.order
+        Returns (wavelengths in visiting order, predicted total move time in s)
+        '''
+        wavelengths = np.asarray(wavelengths,dtype=float)
+        pos = self.get_pos(wavelengths)
+        start = self.mot.knownPos()
+        planner = self.mot.planner
+        planner.blCorr = self.mot.blCorr
+        order = planner.order(pos,start,mode)
+        return wavelengths[order], planner.predict(pos,start,order)
+
+    def scan(self,wavelengths,acquire,process=None,settle=0,workers=1,depth=4,plan=None,units='nm',
+             writer=None,it=None):
+        '''
+        Step through wavelengths, yielding (wavelength, position, result) for
+        each point in order. Moves and readouts run on a background thread, and
+        the stage leaves for point N+1 as soon as point N has been read out, so
+        the move overlaps with process() and with whatever the caller does
+        with each result
+        wavelengths    iterable  Wavelengths (nm) to visit
+        acquire        callable  acquire() -> spectrum, called once the stage has arrived
+        process        callable  process(wavelength,spectrum) -> result, run on
+                                  a pool of workers (default: the spectrum itself)
+        settle         float     Seconds to wait after each move before acquiring, or
+                                  a SettleDetector, see move_and_acquire
+        workers        int       Number of process() workers
+        depth          int       Maximum number of points read out ahead of the caller
+        plan           str       If given, visit the wavelengths in the order from
+                                  plan_scan(wavelengths,plan) rather than as listed
+        units          str       'mm' to step through stage positions instead of
+                                  wavelengths, e.g. before there is a calibration
+        writer         ScanWriter If given, every raw spectrum is appended to it as
+                                  soon as it is read out, so long scans keep
+                                  constant memory and survive a crash
+        it             int       Integration time (us) recorded with every spectrum in
+                                  writer, or a callable returning it (default writer.it)
+        '''
+        if units not in ('nm','mm'):
+            raise ValueError("units must be 'nm' or 'mm', not '{}'".format(units))
+        if writer is not None and it is None:
+            if not writer.it:
+                raise ValueError("Give the integration time (it) to record with the scan")
+            it = writer.it
+        toPos = self.get_pos if units == 'nm' else float
+        if plan is not None and units == 'nm':
+            wavelengths, _ = self.plan_scan(wavelengths,plan)
+        elif plan is not None:
+            wavelengths = np.asarray(wavelengths,dtype=float)
+            wavelengths = wavelengths[self.mot.planner.order(wavelengths,self.mot.knownPos(),plan)]
+        if process is None:
+            process = lambda lam, y: y
+        pending = Queue(depth)
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(workers)
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pending.put(item,timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def run():
+            try:
+                for lam in wavelengths:
+                    if stop.is_set():
+                        return
+                    pos, y, t0 = self.move_and_acquire(toPos(lam),acquire,settle)
+                    if writer is not None:
+                        writer.append(y,pos,lam if units == 'nm' else np.nan,
+                                      it=it() if callable(it) else it,start=t0)
+                    if not put((lam,pos,pool.submit(process,lam,y))):
+                        return
+            except Exception as e:
+                put(e)
+            else:
+                put(None)
+
+        mover = threading.Thread(target=run,daemon=True)
+        mover.start()
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                if isinstance(item,Exception):
+                    raise item
+                lam, pos, result = item
+                yield lam, pos, result.result()
+        finally:
+            stop.set()
+            mover.join()
+            pool.shutdown(wait=False)
+
+    def fly_scan(self,start,stop,acquire,vel=0.5,poll=0.005):
+        '''
+        Sweep the stage at constant velocity from wavelength start to stop while
+        calling acquire() back to back. Each spectrum is assigned the wavelength
+        at the middle of its acquire() call, interpolated from timestamped
+        getPos samples taken throughout the sweep and converted through the
+        calibration. The stage always sweeps towards increasing position, after
+        a backlash corrected move to a run-up point long enough to reach vel
+        start, stop   float     Wavelength range (nm)
+        acquire       callable  acquire() -> spectrum
+        vel           float     Sweep velocity (mm/s)
+        poll          float     Interval (s) between position samples
+        Returns (wavelengths, spectra, positions, times) with one entry per
+        spectrum, where times are the time.time() midpoints of each acquire()
+        '''
+        p0, p1 = sorted([self.get_pos(start),self.get_pos(stop)])
+        minVel, acc, maxVel = self.mot.getVelocityParameters()
+        runup = vel**2/(2*acc)+self.mot.tol
+        self.move(p0-runup)
+
+        samples = []
+        errors = []
+        done = threading.Event()
+        def sample():
+            try:
+                while not done.is_set():
+                    p = self.mot.getPos()
+                    samples.append((time(),p))
+                    if p >= p1+runup-self.mot.tol:
+                        return
+                    sleep(poll)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                # always stop the acquisition loop, even if reading failed
+                done.set()
+
+        self.mot.setVel(vel)
+        try:
+            self.mot.mAbs(p1+runup,wait=False)
+            sampler = threading.Thread(target=sample,daemon=True)
+            sampler.start()
+            times, spectra = [], []
+            while not done.is_set():
+                t0 = time()
+                y = acquire()
+                times.append(0.5*(t0+time()))
+                spectra.append(y)
+            sampler.join()
+        finally:
+            self.mot.setVel(maxVel)
+        if errors:
+            raise errors[0]
+
+        t, p = np.array(samples).T
+        times = np.array(times)
+        positions = np.interp(times,t,p)
+        # keep the frames taken while moving at constant velocity
+        keep = (positions >= p0) & (positions <= p1)
+        positions = positions[keep]
+        return (np.asarray(self.get_wave(positions)),np.array(spectra)[keep],
+                positions,times[keep])
+
+    def shutdown(self):
+        self.mot.cleanUpAPT()
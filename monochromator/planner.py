@@ -0,0 +1,95 @@
+"""Backlash aware ordering of batches of stage moves
+---Classes---
+MotionPlanner:
+    Orders a set of target positions so that backlash overshoots (an extra
+    move of blCorr below any target approached from above) are rare, and
+    predicts how long the resulting sequence of moves will take using a
+    trapezoidal velocity profile
+"""
+
+#%%
+import numpy as np
+#%%
+class MotionPlanner:
+    '''Plans and times batches of backlash corrected absolute moves
+    ---Initialization Parameters---
+        blCorr: Backlash overshoot (mm), a target below the current position
+                 is approached by first moving to target-blCorr
+        vel: Maximum stage velocity (mm/s)
+        acc: Stage acceleration (mm/s^2)
+        overhead: Fixed time per move (s) for command latency and settling
+    ---Methods---
+    move_time:
+        Time for a single move of a given length
+    moves:
+        Expand an ordered list of targets into the moves actually made
+    order:
+        Choose the order in which to visit a set of targets
+    predict:
+        Total time to visit targets in a given order
+    '''
+    def __init__(self,blCorr=0.10,vel=2.0,acc=1.5,overhead=0.05):
+        self.blCorr = blCorr
+        self.vel = vel
+        self.acc = acc
+        self.overhead = overhead
+
+    def move_time(self,d):
+        '''
+        Time (s) to travel distance d (mm), accelerating to vel if there is room.
+        Works elementwise on arrays
+        '''
+        d = np.abs(d)
+        dAcc = self.vel**2/self.acc # distance spent accelerating and decelerating
+        return self.overhead+np.where(d >= dAcc,
+                                      d/self.vel+self.vel/self.acc,
+                                      2*np.sqrt(d/self.acc))
+
+    def moves(self,targets,start):
+        '''
+        Returns the array of positions the stage moves through when visiting
+        targets in order from start, including backlash overshoots
+        '''
+        path = []
+        pos = start
+        for t in targets:
+            if t < pos:
+                path.append(t-self.blCorr)
+            path.append(t)
+            pos = t
+        return np.array(path)
+
+    def predict(self,targets,start,order=None):
+        '''
+        Predicted time (s) to visit targets from start, in the given order of
+        indices (default: as listed)
+        '''
+        targets = np.asarray(targets,dtype=float)
+        if order is not None:
+            targets = targets[order]
+        path = self.moves(targets,start)
+        if len(path) == 0:
+            return 0.0
+        return float(np.sum(self.move_time(np.diff(np.append(start,path)))))
+
+    def order(self,targets,start,mode='sorted'):
+        '''
+        Returns the indices of targets in the order they should be visited
+        mode     'sorted'  One ascending sweep: at most one overshoot, at the start
+                 'sweeps'  The cheaper (by predict) of one ascending sweep and two:
+                            targets above start first, then those below it
+                 'none'    Keep the listed order
+        '''
+        targets = np.asarray(targets,dtype=float)
+        if mode == 'none':
+            return np.arange(len(targets))
+        up = np.argsort(targets,kind='stable')
+        if mode == 'sorted':
+            return up
+        if mode != 'sweeps':
+            raise ValueError("Unknown planning mode '{}'".format(mode))
+        above = targets[up] >= start
+        split = np.append(up[above],up[~above])
+        if self.predict(targets,start,split) < self.predict(targets,start,up):
+            return split
+        return up
@@ -0,0 +1,190 @@
+"""Streaming processing of spectra between acquisition and display or fitting
+---Classes---
+SpectrumProcessor:
+    Dark subtraction followed by one of: no averaging, co-adding blocks of N
+    frames, a sliding mean over the last N frames or an exponential moving
+    average, together with a per-pixel variance estimate. Every update is
+    O(1) per frame and works in place on preallocated arrays
+"""
+
+#%%
+import threading
+import numpy as np
+#%%
+class SpectrumProcessor:
+    '''Incremental averaging of a stream of spectra
+    ---Initialization Parameters---
+        size: Number of pixels per frame
+        mode: 'raw'    each frame as is
+              'coadd'  sum of each block of n frames, output once per block
+              'mean'   mean of the last n frames, output every frame
+              'ema'    exponential moving average with weight alpha
+        n: Frames per block / window
+        alpha: Weight of the newest frame in 'ema'
+        dark: Optional dark frame (or constant) subtracted from every frame
+    ---Variables---
+    output, variance:
+        The latest processed frame and per-pixel variance of the frames that
+        went into it (for 'coadd' the variance of the sum)
+    count:
+        Number of outputs produced since the last reset
+    ---Methods---
+    push:
+        Feed one raw frame, returns True if a new output was produced
+    latest:
+        Copy the newest output out
+    fill:
+        Reset and feed frames from a callable until an output built only from
+        those frames is ready
+    '''
+    MODES = ('raw','coadd','mean','ema')
+
+    def __init__(self,size,mode='raw',n=1,alpha=0.1,dark=None):
+        self.size = size
+        self.lock = threading.Lock()
+        self.dark = None
+        self.__y = np.zeros(size)
+        self.output = np.zeros(size)
+        self.variance = np.zeros(size)
+        self.configure(mode,n,alpha)
+        self.set_dark(dark)
+
+    def configure(self,mode=None,n=None,alpha=None):
+        '''
+        Change the averaging mode, n or alpha (and reset)
+        '''
+        with self.lock:
+            if mode is not None:
+                if mode not in self.MODES:
+                    raise ValueError("Unknown processing mode '{}'".format(mode))
+                self.mode = mode
+            if n is not None:
+                self.n = max(int(n),1)
+            if alpha is not None:
+                self.alpha = alpha
+            self.__sum = np.zeros(self.size)
+            self.__sum2 = np.zeros(self.size)
+            self.__window = np.zeros((self.n if self.mode == 'mean' else 1,self.size))
+            self.__scratch = np.zeros(self.size)
+            self.__reset()
+
+    def __reset(self):
+        self.__sum[:] = 0
+        self.__sum2[:] = 0
+        self.__k = 0 # frames in the current block / window / ema
+        self.__seen = 0
+        self.count = 0
+
+    def reset(self):
+        with self.lock:
+            self.__reset()
+
+    def set_dark(self,dark):
+        '''
+        Set the dark frame (array or scalar) subtracted from every frame, None for none
+        '''
+        with self.lock:
+            self.dark = None if dark is None else np.broadcast_to(np.asarray(dark,dtype=float),(self.size,)).copy()
+
+    @property
+    def ready(self):
+        '''
+        True once an output built from a full block / window exists
+        '''
+        return self.count > 0 and (self.mode in ('raw','coadd') or self.__seen >= self.n)
+
+    def push(self,frame):
+        '''
+        Feed one raw frame, returns True if output was updated
+        '''
+        with self.lock:
+            y, s, s2, d = self.__y, self.__sum, self.__sum2, self.__scratch
+            np.copyto(y,frame,casting='unsafe')
+            if self.dark is not None:
+                y -= self.dark
+            self.__seen += 1
+            if self.mode == 'raw':
+                self.output[:] = y
+                self.variance[:] = 0
+            elif self.mode == 'coadd':
+                s += y
+                np.multiply(y,y,out=d)
+                s2 += d
+                self.__k += 1
+                if self.__k < self.n:
+                    return False
+                # variance of the sum = n * per-frame variance
+                self.output[:] = s
+                np.multiply(s,s,out=d)
+                d /= -self.n
+                d += s2
+                d *= self.n/max(self.n-1,1)
+                self.variance[:] = d
+                s[:] = 0
+                s2[:] = 0
+                self.__k = 0
+            elif self.mode == 'mean':
+                i = self.__seen % self.n
+                w = self.__window[i]
+                if self.__k == self.n:
+                    # drop the oldest frame from the window sums
+                    s -= w
+                    np.multiply(w,w,out=d)
+                    s2 -= d
+                else:
+                    self.__k += 1
+                w[:] = y
+                s += y
+                np.multiply(y,y,out=d)
+                s2 += d
+                k = self.__k
+                np.divide(s,k,out=self.output)
+                np.multiply(self.output,s,out=d)
+                np.subtract(s2,d,out=d)
+                d /= max(k-1,1)
+                np.maximum(d,0,out=self.variance)
+            else:
+                if self.__k == 0:
+                    self.output[:] = y
+                    self.variance[:] = 0
+                    self.__k = 1
+                else:
+                    # exponentially weighted mean and variance, West (1979)
+                    a = self.alpha
+                    np.subtract(y,self.output,out=d)
+                    d *= a
+                    self.output += d
+                    d *= d
+                    d /= a
+                    self.variance += d
+                    self.variance *= 1-a
+            self.count += 1
+            return True
+
+    def latest(self,out=None,variance=None):
+        '''
+        Returns (count, output) with output copied into out if given, and the
+        variance into variance if given
+        '''
+        with self.lock:
+            if out is None:
+                out = self.output.copy()
+            else:
+                np.copyto(out,self.output,casting='unsafe')
+            if variance is not None:
+                np.copyto(variance,self.variance,casting='unsafe')
+            return self.count, out
+
+    def fill(self,acquire,out=None,first=None):
+        '''
+        Reset, then push frames from acquire() until ready. Returns the output
+        (for 'ema', after n frames)
+        first          array     Optional frame already in hand, pushed before acquiring
+        '''
+        self.reset()
+        if first is not None and self.push(first) and self.ready:
+            return self.latest(out)[1]
+        while True:
+            self.push(acquire())
+            if self.ready:
+                return self.latest(out)[1]
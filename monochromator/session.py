@@ -0,0 +1,292 @@
+"""Binary calibration and scan-session files
+---Functions---
+save_session:
+    Write calibration points, fit coefficients and (optionally) the raw
+    spectra of a session to a versioned, uncompressed .npz file
+
+load_session:
+    Read such a file back. Array members are memory mapped straight out of
+    the zip container, so opening a session with thousands of spectra only
+    reads the headers
+
+load_scan:
+    Open a scan directory written by ScanWriter
+
+---Classes---
+Session:
+    Holds the contents of a session file as attributes
+
+ScanWriter:
+    Append-only writer for long scans. Spectra and their per-frame metadata
+    are written into preallocated, memory mapped .npy chunks, so memory use
+    stays constant however long the scan runs, and everything up to the last
+    flush survives a crash
+
+ScanReader:
+    Memory mapped, read-only view of a scan directory
+"""
+
+#%%
+import os
+import json
+import struct
+import zipfile
+from time import time
+import numpy as np
+#%%
+FORMAT_VERSION = 1
+
+class Session:
+    '''Contents of a session file
+    ---Variables---
+    version:
+        Format version the file was written with
+    points:
+        (3,n) array of calibration [positions, wavelengths, fwhm]
+    model, deg:
+        Calibration model and degree, see Calibration
+    coef:
+        [b, a, *monoBound] as written to the last line of a .cal file
+    spectra, positions, wavelengths:
+        Raw (m,npix) spectra, the (m,) stage positions they were taken at and
+        the (npix,) wavelength axis, or None if not saved
+    '''
+    def __init__(self,**kwargs):
+        self.spectra = None
+        self.positions = None
+        self.wavelengths = None
+        self.__dict__.update(kwargs)
+
+def save_session(path,points,coef,model='linear',deg=None,
+                 spectra=None,positions=None,wavelengths=None,**extra):
+    '''
+    Write a session file
+    path           str       File name (written as given, no extension is added)
+    points         array     (3,n) calibration [positions, wavelengths, fwhm]
+    coef           array     [b, a, *monoBound]
+    spectra        array     Optional (m,npix) raw spectra
+    positions      array     Optional (m,) stage positions of the spectra
+    wavelengths    array     Optional (npix,) wavelength axis of the spectra
+    extra                    Further arrays or scalars to store
+    '''
+    arrays = dict(version=np.array(FORMAT_VERSION),
+                  points=np.asarray(points,dtype=float),
+                  coef=np.asarray(coef,dtype=float),
+                  model=np.array(model),
+                  deg=np.array(-1 if deg is None else deg))
+    for k,v in dict(spectra=spectra,positions=positions,wavelengths=wavelengths,**extra).items():
+        if v is not None:
+            arrays[k] = np.asarray(v)
+    with open(path,'wb') as f:
+        np.savez(f,**arrays)
+
+def _memmap_member(path,info):
+    '''
+    Memory map a stored (uncompressed) .npy member of a zip file, or return
+    None if that is not possible
+    '''
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path,'rb') as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+        nameLen, extraLen = struct.unpack('<HH',header[26:30])
+        f.seek(info.header_offset+30+nameLen+extraLen)
+        version = np.lib.format.read_magic(f)
+        if version == (1,0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        elif version == (2,0):
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        else:
+            return None
+        offset = f.tell()
+    if dtype.hasobject or np.prod(shape) == 0:
+        return None
+    return np.memmap(path,dtype=dtype,mode='r',offset=offset,shape=shape,
+                     order='F' if fortran else 'C')
+
+def load_session(path,mmap=True):
+    '''
+    Read a session file written by save_session
+    mmap           bool      Memory map the large array members instead of reading them
+    Returns a Session
+    '''
+    contents = {}
+    with zipfile.ZipFile(path) as zf, np.load(path) as npz:
+        for info in zf.infolist():
+            key = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            a = _memmap_member(path,info) if mmap and key in ('spectra','positions') else None
+            contents[key] = npz[key] if a is None else a
+    version = int(contents.pop('version'))
+    if version > FORMAT_VERSION:
+        raise ValueError("{0} was written with format version {1}, newer than {2}".format(path,version,FORMAT_VERSION))
+    contents['model'] = str(contents['model'])
+    deg = int(contents.pop('deg'))
+    return Session(version=version,deg=None if deg < 0 else deg,**contents)
+
+
+SCAN_META = np.dtype([('position','f8'),('wavelength','f8'),('it','i8'),
+                      ('start','f8'),('stop','f8')])
+
+class ScanWriter:
+    '''Streams spectra to a directory of preallocated .npy chunks
+    ---Initialization Parameters---
+        path: Directory to create (it must not already hold a scan)
+        axis: (npix,) wavelength axis of the detector
+        chunk: Number of spectra per chunk file
+        dtype: Storage type of the spectra, e.g. np.float32 or np.uint16
+        flushEvery: Spectra between flushes of the memory maps to disk
+        attrs: Further JSON serializable values stored in the header
+    ---Variables---
+    count:
+        Number of spectra written
+    it:
+        Integration time (us) recorded by append when none is given
+    ---Methods---
+    append:
+        Write one spectrum and its metadata
+    flush:
+        Push everything written so far to disk
+    close:
+        Flush and release the files (also done when used as a context manager)
+    ---Layout---
+    header.json      version, npix, dtype, chunk and attrs
+    axis.npy         the detector wavelength axis
+    spectra_NNNN.npy (chunk,npix) spectra
+    meta_NNNN.npy    (chunk,) records of position, wavelength, it, start, stop
+    count            number of valid spectra at the last flush, followed by
+                     "closed" once the writer has been closed
+    '''
+    def __init__(self,path,axis,chunk=1024,dtype=np.float32,flushEvery=16,**attrs):
+        self.path = path
+        os.makedirs(path,exist_ok=True)
+        if os.path.exists(os.path.join(path,"header.json")):
+            raise FileExistsError("{} already holds a scan".format(path))
+        self.axis = np.asarray(axis,dtype=float)
+        self.chunk = chunk
+        self.dtype = np.dtype(dtype)
+        self.flushEvery = flushEvery
+        self.count = 0
+        self.it = 0
+        np.save(os.path.join(path,"axis.npy"),self.axis)
+        with open(os.path.join(path,"header.json"),"w") as f:
+            json.dump(dict(version=FORMAT_VERSION,npix=len(self.axis),dtype=self.dtype.str,
+                           chunk=chunk,created=time(),attrs=attrs),f)
+        self.__spectra = None
+        self.__meta = None
+
+    def __open_chunk(self,k):
+        self.__close_chunk()
+        self.__spectra = np.lib.format.open_memmap(os.path.join(self.path,"spectra_{:04d}.npy".format(k)),
+                                                   mode='w+',dtype=self.dtype,shape=(self.chunk,len(self.axis)))
+        self.__meta = np.lib.format.open_memmap(os.path.join(self.path,"meta_{:04d}.npy".format(k)),
+                                                mode='w+',dtype=SCAN_META,shape=(self.chunk,))
+
+    def __close_chunk(self):
+        if self.__spectra is not None:
+            self.__spectra.flush()
+            self.__meta.flush()
+            self.__spectra = self.__meta = None
+
+    def append(self,y,position=np.nan,wavelength=np.nan,it=None,start=None,stop=None):
+        '''
+        Write spectrum y with its stage position, wavelength, integration time
+        (us, default self.it) and readout start/stop times (default now)
+        '''
+        k, i = divmod(self.count,self.chunk)
+        if i == 0:
+            self.__open_chunk(k)
+        stop = time() if stop is None else stop
+        np.copyto(self.__spectra[i],y,casting='unsafe')
+        # stop is written last: a nonzero stop marks a complete record
+        self.__meta[i] = (position,wavelength,self.it if it is None else it,
+                          stop if start is None else start,0)
+        self.__meta['stop'][i] = stop
+        self.count += 1
+        if self.count % self.flushEvery == 0:
+            self.flush()
+
+    def flush(self,closed=False):
+        if self.__spectra is not None:
+            self.__spectra.flush()
+            self.__meta.flush()
+        tmp = os.path.join(self.path,"count.tmp")
+        with open(tmp,"w") as f:
+            f.write(str(self.count)+(" closed" if closed else ""))
+        os.replace(tmp,os.path.join(self.path,"count"))
+
+    def close(self):
+        self.__close_chunk()
+        self.flush(closed=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+
+class ScanReader:
+    '''Read-only, memory mapped view of a scan written by ScanWriter
+    ---Variables---
+    axis:
+        Detector wavelength axis
+    meta:
+        (n,) records of position, wavelength, it, start and stop
+    attrs:
+        Values passed to ScanWriter
+    incomplete:
+        True if the writer was never closed (the scan was cut short or
+        crashed), in which case every record completed before then is read
+    ---Methods---
+    len(), reader[i]:
+        Number of spectra, and spectrum i (or a slice, copied)
+    '''
+    def __init__(self,path):
+        self.path = path
+        with open(os.path.join(path,"header.json")) as f:
+            header = json.load(f)
+        if header['version'] > FORMAT_VERSION:
+            raise ValueError("{0} was written with format version {1}, newer than {2}".format(path,header['version'],FORMAT_VERSION))
+        self.chunk = header['chunk']
+        self.attrs = header['attrs']
+        self.axis = np.load(os.path.join(path,"axis.npy"))
+        self.chunks = []
+        metas = []
+        k = 0
+        while os.path.exists(os.path.join(path,"spectra_{:04d}.npy".format(k))):
+            self.chunks.append(np.load(os.path.join(path,"spectra_{:04d}.npy".format(k)),mmap_mode='r'))
+            metas.append(np.load(os.path.join(path,"meta_{:04d}.npy".format(k)),mmap_mode='r'))
+            k += 1
+        meta = np.concatenate(metas) if metas else np.zeros(0,SCAN_META)
+        # records after the last flush count too if they were completed
+        unwritten = np.flatnonzero(meta['stop'] == 0)
+        n = unwritten[0] if len(unwritten) else len(meta)
+        self.incomplete = True
+        try:
+            with open(os.path.join(path,"count")) as f:
+                count = f.read().split()
+            n = max(n,int(count[0]))
+            self.incomplete = count[1:] != ["closed"]
+        except (OSError,ValueError,IndexError):
+            pass
+        self.meta = np.array(meta[:n])
+
+    def __len__(self):
+        return len(self.meta)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return np.array([self[j] for j in range(*i.indices(len(self)))])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        k, j = divmod(i,self.chunk)
+        return self.chunks[k][j]
+
+def load_scan(path):
+    '''
+    Open a scan directory written by ScanWriter, returns a ScanReader
+    '''
+    return ScanReader(path)
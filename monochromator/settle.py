@@ -0,0 +1,112 @@
+"""Detect when the stage (and the line on the detector) has settled after a move
+---Classes---
+SettleDetector:
+    Replaces a fixed sleep after each move. It polls the stage until the
+    reported position stops changing and, if given a way to acquire
+    spectra, keeps taking frames until the line centroid stops shifting.
+    The time each settle took is recorded, so scans wait only as long as
+    the hardware needs
+"""
+
+#%%
+from time import time, sleep
+import numpy as np
+from .fitting import roi, moment_guess
+#%%
+class SettleDetector:
+    '''Waits for position and (optionally) spectral stability
+    ---Initialization Parameters---
+        getPos: Callable returning the stage position (mm)
+        acquire: Optional callable returning a fresh spectrum
+        x: Wavelength axis of the spectra (needed with acquire)
+        posTol: Largest change in position (mm) counted as stable
+        stableFor: Time (s) the position must stay within posTol
+        poll: Interval (s) between position reads
+        shiftTol: Largest centroid shift (nm) between consecutive frames
+                   counted as stable
+        half: Half width (nm) of the window used for the centroid
+        maxFrames: Give up on spectral stability after this many frames
+        timeout: Give up on position stability after this many seconds
+    ---Variables---
+    times:
+        Settle time (s) of every call to wait
+    frames:
+        Number of spectra taken by every call to wait
+    ---Methods---
+    wait:
+        Block until settled, returning the position and the last spectrum
+    stats:
+        Summary of the measured settle times
+    '''
+    def __init__(self,getPos,acquire=None,x=None,posTol=0.0005,stableFor=0.02,
+                 poll=0.005,shiftTol=0.02,half=10,maxFrames=5,timeout=5):
+        self.getPos = getPos
+        self.acquire = acquire
+        self.x = None if x is None else np.asarray(x)
+        self.posTol = posTol
+        self.stableFor = stableFor
+        self.poll = poll
+        self.shiftTol = shiftTol
+        self.half = half
+        self.maxFrames = maxFrames
+        self.timeout = timeout
+        self.times = []
+        self.frames = []
+
+    def centroid(self,y):
+        sl = roi(self.x,self.x[np.argmax(y)],self.half)
+        return moment_guess(self.x[sl],y[sl])[2]
+
+    def wait_position(self,target=None,tol=0.001):
+        '''
+        Poll until the position has changed by less than posTol for stableFor
+        seconds (and is within tol of target, if given), returns the last
+        position read
+        '''
+        t0 = time()
+        ref, tRef = self.getPos(), t0
+        while True:
+            sleep(self.poll)
+            p, t = self.getPos(), time()
+            if abs(p-ref) > self.posTol or (target is not None and abs(p-target) > tol):
+                ref, tRef = p, t
+            elif t-tRef >= self.stableFor:
+                return p
+            if t-t0 > self.timeout:
+                raise TimeoutError("Stage still moving after {} s".format(self.timeout))
+
+    def wait(self,target=None,tol=0.001):
+        '''
+        Block until the stage, and the line centroid if acquire was given, are
+        stable. Returns (position, last spectrum or None)
+        target         float     If given, the position must also be within tol of it
+        '''
+        t0 = time()
+        pos = self.wait_position(target,tol)
+        y = None
+        n = 0
+        if self.acquire is not None:
+            y = self.acquire()
+            c = self.centroid(y)
+            n = 1
+            while n < self.maxFrames:
+                y = self.acquire()
+                n += 1
+                cNew = self.centroid(y)
+                if abs(cNew-c) <= self.shiftTol:
+                    break
+                c = cNew
+        self.times.append(time()-t0)
+        self.frames.append(n)
+        return pos, y
+
+    def stats(self):
+        '''
+        Returns a dict with the number of settles and the mean, median and
+        maximum settle time (s)
+        '''
+        t = np.array(self.times)
+        if len(t) == 0:
+            return {'n':0}
+        return {'n':len(t),'mean':t.mean(),'median':np.median(t),'max':t.max(),
+                'frames':np.mean(self.frames)}
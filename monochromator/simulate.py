@@ -0,0 +1,198 @@
+"""Simulated hardware, so the package can be run, profiled and benchmarked
+without a Thorlabs stage or an Ocean Optics spectrometer
+---Classes---
+SimulatedAPT:
+    Stands in for the APT.dll loaded by APTMotor (pass it as aptdll). The
+    stage follows a trapezoidal velocity profile and the carriage lags the
+    motor by up to a backlash distance when the direction reverses
+
+SimulatedSpectrometer:
+    Stands in for Spectrometer. Each frame is a gaussian line at the
+    wavelength the monochromator passes at the true carriage position, with
+    counts proportional to the integration time, a dark offset, shot and read
+    noise, and saturation at 4095 counts (USB2000)
+"""
+
+#%%
+import threading
+from time import time, sleep
+import numpy as np
+from .fitting import gauss
+#%%
+class SimulatedAPT:
+    '''Simulated APT.dll driving a single stage
+    ---Initialization Parameters---
+        vel: Maximum velocity (mm/s)
+        acc: Acceleration (mm/s^2)
+        backlash: Play between motor and carriage (mm). Approached from below
+                   the carriage sits at the motor position, from above it sits
+                   backlash higher
+        position: Initial position (mm)
+        timescale: Factor applied to every simulated duration, use <1 to run
+                    faster than real time
+    ---Methods---
+    position:
+        Motor position at time t
+    carriage:
+        True carriage position at time t (what the optics see)
+    (and the MOT_*/APT* functions used by APTMotor)
+    '''
+    def __init__(self,vel=2.0,acc=1.5,backlash=0.03,position=0.0,timescale=1.0):
+        self.vel = vel
+        self.acc = acc
+        self.backlash = backlash
+        self.timescale = timescale
+        self.lock = threading.Lock()
+        self.__start(position,position,position)
+
+    def __start(self,p0,p1,carriage0):
+        # begin a monotonic segment from p0 to p1 at the current time
+        self.p0, self.p1, self.c0 = p0, p1, carriage0
+        self.t0 = time()
+        d = abs(p1-p0)
+        dAcc = self.vel**2/self.acc
+        if d >= dAcc:
+            self.tAcc = self.vel/self.acc
+            self.tMove = d/self.vel+self.tAcc
+        else:
+            self.tAcc = np.sqrt(d/self.acc)
+            self.tMove = 2*self.tAcc
+        self.tMove *= self.timescale
+
+    def position(self,t=None):
+        '''
+        Motor position (mm) at time t (default now)
+        '''
+        t = (time() if t is None else t)-self.t0
+        if t >= self.tMove:
+            return self.p1
+        t /= self.timescale
+        tAcc, T = self.tAcc, self.tMove/self.timescale
+        vmax = self.acc*tAcc
+        if t < tAcc:
+            d = 0.5*self.acc*t**2
+        elif t < T-tAcc:
+            d = 0.5*self.acc*tAcc**2+vmax*(t-tAcc)
+        else:
+            d = abs(self.p1-self.p0)-0.5*self.acc*(T-t)**2
+        return self.p0+np.sign(self.p1-self.p0)*d
+
+    def carriage(self,t=None):
+        '''
+        Carriage position (mm) at time t (default now)
+        '''
+        p = self.position(t)
+        return min(max(self.c0,p),p+self.backlash)
+
+    def moving(self):
+        return time()-self.t0 < self.tMove
+
+    def move_to(self,target,wait=True):
+        with self.lock:
+            t = time()
+            p, c = self.position(t), self.carriage(t)
+            self.__start(p,float(target),c)
+            T = self.tMove
+        if wait:
+            sleep(T)
+
+    # APT.dll interface
+    def EnableEventDlg(self,enable):
+        return 0
+
+    def APTInit(self):
+        return 0
+
+    def APTCleanUp(self):
+        return 0
+
+    def GetNumHWUnitsEx(self,hwType,numUnits):
+        numUnits.contents.value = 1
+        return 0
+
+    def InitHWDevice(self,serial):
+        return 0
+
+    def MOT_GetPosition(self,serial,position):
+        position.contents.value = self.position()
+        return 0
+
+    def MOT_MoveAbsoluteEx(self,serial,position,wait):
+        self.move_to(position.value,wait)
+        return 0
+
+    def MOT_MoveRelativeEx(self,serial,distance,wait):
+        with self.lock:
+            target = self.p1+distance.value
+        self.move_to(target,wait)
+        return 0
+
+    def MOT_GetVelParams(self,serial,minVel,acc,maxVel):
+        minVel.contents.value = 0.0
+        acc.contents.value = self.acc
+        maxVel.contents.value = self.vel
+        return 0
+
+    def MOT_SetVelParams(self,serial,minVel,acc,maxVel):
+        self.acc = acc.value
+        self.vel = maxVel.value
+        return 0
+
+    def MOT_GetVelParamLimits(self,serial,maxAcc,maxVel):
+        maxAcc.contents.value = 4.0
+        maxVel.contents.value = 2.6
+        return 0
+
+    def MOT_MoveHome(self,serial,wait=True):
+        self.move_to(0.0,wait)
+        return 0
+
+
+class SimulatedSpectrometer:
+    '''Simulated spectrometer looking at the output of the monochromator
+    ---Initialization Parameters---
+        stage: SimulatedAPT, whose carriage sets the transmitted wavelength
+        to_wave: Callable mapping carriage position (mm) to the transmitted
+                  wavelength (nm), e.g. Calibration(...).to_wave
+        wavelengths: Wavelength axis of the detector (nm)
+        rate: Peak counts per second of integration time
+        fwhm: Bandpass of the monochromator (nm)
+        dark: Dark offset (counts)
+        readNoise: Read noise (counts rms)
+        seed: Seed for the noise generator
+    ---Methods---
+    wavelengths, intensities, integration_time_micros, close:
+        Same interface as Spectrometer
+    '''
+    def __init__(self,stage,to_wave,wavelengths=None,rate=2e5,fwhm=2.0,
+                 dark=90.0,readNoise=6.0,saturation=4095,seed=None):
+        self.stage = stage
+        self.to_wave = to_wave
+        self.__wavelengths = np.linspace(340,1030,2048) if wavelengths is None else np.asarray(wavelengths)
+        self.rate = rate
+        self.fwhm = fwhm
+        self.dark = dark
+        self.readNoise = readNoise
+        self.saturation = saturation
+        self.rng = np.random.default_rng(seed)
+        self.it = 100000
+
+    def wavelengths(self):
+        return self.__wavelengths
+
+    def integration_time_micros(self,it):
+        self.it = int(it)
+
+    def intensities(self):
+        T = self.it*1e-6
+        t0 = time()
+        sleep(T*self.stage.timescale)
+        # line center at the middle of the exposure
+        lam = float(self.to_wave(self.stage.carriage(0.5*(t0+time()))))
+        p = [self.dark,self.rate*T,lam,self.fwhm/(2*np.sqrt(np.log(2)))]
+        y = gauss(self.__wavelengths,p)
+        y += self.rng.normal(0,1,len(y))*np.sqrt(self.readNoise**2+y-self.dark)
+        return np.clip(np.round(y),0,self.saturation)
+
+    def close(self):
+        pass
@@ -0,0 +1,152 @@
+"""Low overhead timing of the phases of an acquisition cycle
+---Classes---
+PhaseTimer:
+    Keeps the most recent durations of named phases (spectrometer readout,
+    stage moves, fits, redraws...) in fixed size rings, and turns them into
+    latency percentiles, histograms and throughput on demand. Recording is a
+    couple of array stores, so the hooks can stay in the hot paths. The
+    statistics can be shown live (summary) or exported as CSV or JSON, to see
+    whether the USB link, the stage or the renderer limits a given rig
+"""
+
+#%%
+import csv
+import json
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+import numpy as np
+#%%
+class PhaseTimer:
+    '''Rolling latency and throughput statistics per phase
+    ---Initialization Parameters---
+        window: Number of most recent durations kept per phase
+        enabled: Set False to make record a no-op
+    ---Methods---
+    record:
+        Add one duration (s) to a phase
+    time:
+        Context manager timing the enclosed block
+    wrap:
+        Returns a callable which times every call of f
+    stats:
+        Count, throughput and latency percentiles of each phase
+    histogram:
+        Latency histogram of one phase
+    summary:
+        One line readout for a status bar
+    to_csv, to_json:
+        Export the statistics
+    '''
+    COLUMNS = ('phase','n','rate','mean','p50','p90','p99','max','total')
+
+    def __init__(self,window=1000,enabled=True):
+        self.window = window
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # name -> [durations, end times, number recorded, total time]
+            self.phases = {}
+
+    def record(self,name,dt,t=None):
+        '''
+        Add a duration dt (s) to phase name, ending at perf_counter() time t (default now)
+        '''
+        if not self.enabled:
+            return
+        t = perf_counter() if t is None else t
+        with self.lock:
+            ph = self.phases.get(name)
+            if ph is None:
+                ph = self.phases[name] = [np.zeros(self.window),np.zeros(self.window),0,0.0]
+            i = ph[2] % self.window
+            ph[0][i] = dt
+            ph[1][i] = t
+            ph[2] += 1
+            ph[3] += dt
+
+    @contextmanager
+    def time(self,name):
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            t1 = perf_counter()
+            self.record(name,t1-t0,t1)
+
+    def wrap(self,name,f):
+        '''
+        Returns a function calling f and recording each call under name
+        '''
+        def timed(*args,**kwargs):
+            t0 = perf_counter()
+            try:
+                return f(*args,**kwargs)
+            finally:
+                t1 = perf_counter()
+                self.record(name,t1-t0,t1)
+        return timed
+
+    def __window(self,name):
+        with self.lock:
+            dt, t, n, total = self.phases[name]
+            k = min(n,self.window)
+            return dt[:k].copy(), t[:k].copy(), n, total
+
+    def stats(self,name=None):
+        '''
+        Returns a dict of phase -> dict of n (calls ever recorded), rate (calls/s
+        over the window), mean, p50, p90, p99, max (s, over the window) and total (s),
+        or just the dict for phase name
+        '''
+        if name is not None:
+            dt, t, n, total = self.__window(name)
+            span = t.max()-t.min()+dt[np.argmin(t)] if len(t) else 0
+            p50, p90, p99 = np.percentile(dt,[50,90,99]) if len(dt) else (np.nan,)*3
+            return {'n':n,'rate':len(dt)/span if span > 0 else np.nan,
+                    'mean':dt.mean() if len(dt) else np.nan,'p50':p50,'p90':p90,'p99':p99,
+                    'max':dt.max() if len(dt) else np.nan,'total':total}
+        with self.lock:
+            names = list(self.phases)
+        return {n:self.stats(n) for n in names}
+
+    def histogram(self,name,bins=20):
+        '''
+        Returns (counts, edges) of the durations (s) of phase name in the window,
+        with logarithmically spaced bins
+        '''
+        dt = self.__window(name)[0]
+        dt = dt[dt > 0]
+        if len(dt) == 0:
+            return np.zeros(bins,dtype=int), np.zeros(bins+1)
+        lo, hi = dt.min(), dt.max()
+        edges = np.geomspace(lo,hi if hi > lo else 2*lo,bins+1)
+        return np.histogram(dt,edges)
+
+    def summary(self):
+        '''
+        Returns e.g. "readout 20.1 ms 49.5/s | move 181 ms | fit 2.3 ms | draw 6.0 ms 30.0/s"
+        '''
+        parts = []
+        for name, s in self.stats().items():
+            parts.append("{0} {1:.3g} ms {2:.3g}/s".format(name,1000*s['p50'],s['rate']))
+        return " | ".join(parts)
+
+    def to_csv(self,path):
+        with open(path,'w',newline='') as f:
+            w = csv.writer(f)
+            w.writerow(self.COLUMNS)
+            for name, s in self.stats().items():
+                w.writerow([name]+[s[c] for c in self.COLUMNS[1:]])
+
+    def to_json(self,path,bins=20):
+        out = {}
+        for name, s in self.stats().items():
+            counts, edges = self.histogram(name,bins)
+            out[name] = dict({k:(None if np.isnan(v) else float(v)) for k,v in s.items()},
+                             histogram={'counts':counts.tolist(),'edges':edges.tolist()})
+        with open(path,'w') as f:
+            json.dump(out,f,indent=1)
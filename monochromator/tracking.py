@@ -0,0 +1,110 @@
+"""Frame to frame tracking of one spectral line
+---Classes---
+PeakTracker:
+    Fits every frame of a live stream, starting each fit from the previous
+    frame's parameters inside a narrow window around the previous center.
+    While the line barely moves a fit converges in a couple of iterations
+    over a few dozen pixels, and other lines outside the window are never
+    picked up. If the fit is lost (the line vanished or jumped away) the
+    tracker searches for it again around the last known center
+"""
+
+#%%
+from time import time
+import numpy as np
+from .fitting import fit_gauss, roi, moment_guess
+#%%
+FWHM = 2*np.sqrt(np.log(2)) # FWHM of gauss in units of its width parameter
+
+class PeakTracker:
+    '''Warm-started gauss fits of a line in successive frames
+    ---Initialization Parameters---
+        x: Wavelength axis of the frames
+        half: Smallest half width (nm) of the tracking window
+        widths: Half width of the tracking window in FWHMs of the line
+        search: Half width (nm) of the window searched when the line is lost
+        maxiter: Iteration limit of each warm-started fit
+        minSNR: Smallest accepted amplitude / amplitude error
+        length: Number of frames kept in the history
+    ---Variables---
+    p, perr:
+        Parameters of the last good fit (None before the line is found)
+    started:
+        time.time() of the last start
+    lost:
+        Number of consecutive frames the fit failed
+    ---Methods---
+    start:
+        (Re)start tracking the line nearest x0 (default the brightest pixel)
+    update:
+        Fit one frame, returns (p, perr) or None if the line was not found
+    history:
+        Times, centers and FWHMs of the tracked frames, oldest first
+    '''
+    def __init__(self,x,half=2,widths=3,search=20,maxiter=10,minSNR=5,length=600):
+        self.x = np.asarray(x,dtype=float)
+        self.half = half
+        self.widths = widths
+        self.search = search
+        self.maxiter = maxiter
+        self.minSNR = minSNR
+        self.length = length
+        self.__t = np.zeros(length)
+        self.__center = np.zeros(length)
+        self.__fwhm = np.zeros(length)
+        self.start()
+
+    def start(self,x0=None):
+        self.p = None
+        self.perr = None
+        self.x0 = x0
+        self.lost = 0
+        self.count = 0
+        self.started = time()
+
+    def window(self):
+        '''
+        Half width (nm) of the current tracking window
+        '''
+        return max(self.half,self.widths*FWHM*self.p[3])
+
+    def update(self,y,t=None):
+        '''
+        Fit frame y (taken at time.time() t, default now), returns (p, perr)
+        or None if the line could not be fitted
+        '''
+        y = np.asarray(y,dtype=float)
+        if self.p is None:
+            # find the line: brightest pixel near the seed, fresh moment guess
+            x0 = self.x0 if self.x0 is not None else self.x[np.argmax(y)]
+            sl = roi(self.x,x0,self.search)
+            x0 = self.x[sl][np.argmax(y[sl])]
+            half = max(self.half,self.widths*FWHM*moment_guess(self.x[sl],y[sl])[3])
+            p, perr = fit_gauss(self.x,y,x0=x0,half=half)
+        else:
+            half = self.window()
+            x0 = self.p[2]
+            p, perr = fit_gauss(self.x,y,p0=self.p,x0=x0,half=half,maxiter=self.maxiter)
+        if not (np.all(np.isfinite(perr)) and p[1] > self.minSNR*perr[1] and abs(p[2]-x0) <= half):
+            self.lost += 1
+            if self.p is not None:
+                # search again around the last center next frame
+                self.x0 = self.p[2]
+                self.p = None
+            return None
+        self.p, self.perr = p, perr
+        self.lost = 0
+        i = self.count % self.length
+        self.__t[i] = time() if t is None else t
+        self.__center[i] = p[2]
+        self.__fwhm[i] = FWHM*p[3]
+        self.count += 1
+        return p, perr
+
+    def history(self):
+        '''
+        Returns (times, centers, fwhms) of the last length tracked frames
+        '''
+        n = min(self.count,self.length)
+        order = (np.arange(n)+self.count-n) % self.length
+        return self.__t[order], self.__center[order], self.__fwhm[order]
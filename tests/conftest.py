@@ -0,0 +1,18 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+from monochromator.benchmark import simulated_setup
+
+@pytest.fixture
+def sim():
+    '''
+    (Monochromator, SimulatedSpectrometer) on an instant simulated stage,
+    calibrated to the true 0.04 mm/nm
+    '''
+    mono, spec = simulated_setup()
+    yield mono, spec
+    mono.shutdown()
@@ -0,0 +1,66 @@
+from time import sleep, time
+import numpy as np
+import pytest
+from monochromator.acquisition import Acquisition
+
+class SlowSpectrometer:
+    def __init__(self,exposure=0.2,fail=None):
+        self.exposure = exposure
+        self.fail = fail
+        self.it = 1000
+        self.reads = 0
+        self.temperatureReads = 0
+
+    def wavelengths(self):
+        return np.arange(8.0)
+
+    def integration_time_micros(self,it):
+        self.it = it
+
+    def tec_get_temperature_C(self):
+        self.temperatureReads += 1
+        return -10.0
+
+    def intensities(self):
+        sleep(self.exposure)
+        self.reads += 1
+        if self.fail is not None and self.reads > self.fail:
+            raise OSError("USB read failed")
+        return np.full(8,float(self.it))
+
+@pytest.fixture
+def acq():
+    acqs = []
+    def make(spec):
+        acqs.append(Acquisition(spec))
+        return acqs[-1]
+    yield make
+    for a in acqs:
+        a.close()
+
+def test_worker_error_reaches_next_frame(acq):
+    a = acq(SlowSpectrometer(0.01,fail=3))
+    a.start()
+    with pytest.raises(OSError):
+        for _ in range(10):
+            a.next_frame() # no timeout: must not hang
+    assert not a.running
+    with pytest.raises(OSError):
+        a.latest()
+
+def test_settings_do_not_wait_for_the_readout(acq):
+    spec = SlowSpectrometer(0.3)
+    a = acq(spec)
+    a.start()
+    a.next_frame(timeout=2)
+    t0 = time()
+    a.integration_time_micros(5000)
+    assert a.temperature() == -10.0
+    assert time()-t0 < 0.05
+    assert np.all(a.next_frame(timeout=2) == 5000)
+    assert spec.temperatureReads == 1
+
+def test_paused_reads_apply_settings(acq):
+    a = acq(SlowSpectrometer(0.01))
+    a.integration_time_micros(7000)
+    assert np.all(a.next_frame() == 7000)
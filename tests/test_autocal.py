@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from monochromator.autocal import AutoCalibration
+from monochromator.processing import SpectrumProcessor
+
+POSITIONS = np.linspace(16,30,8)
+
+def test_run_recovers_calibration(sim):
+    mono, spec = sim
+    proc = SpectrumProcessor(len(spec.wavelengths()),'mean',n=2,dark=spec.dark)
+    autocal = AutoCalibration(mono,spec.intensities,spec.wavelengths(),process=proc.fill)
+    points = list(autocal.run(POSITIONS[::-1]))
+    assert np.allclose([pos for pos,p,perr,reason,y in points],POSITIONS,atol=2*mono.mot.tol)
+    assert [reason for pos,p,perr,reason,y in points] == [None]*len(POSITIONS)
+    assert autocal.finish() == len(POSITIONS)
+    assert mono.calibration.b == pytest.approx(-0.04,rel=1e-3)
+    assert mono.get_wave(23.0) == pytest.approx(600,abs=0.1)
+
+def test_saturation_is_judged_on_raw_frames(sim):
+    mono, spec = sim
+    spec.rate = 1e6 # the peak clips in every raw frame
+    proc = SpectrumProcessor(len(spec.wavelengths()),'mean',n=2,dark=spec.dark)
+    autocal = AutoCalibration(mono,spec.intensities,spec.wavelengths(),process=proc.fill)
+    points = list(autocal.run(POSITIONS[:3]))
+    assert all(np.max(y) < spec.saturation for pos,p,perr,reason,y in points)
+    assert [reason for pos,p,perr,reason,y in points] == ["saturated"]*3
+    with pytest.raises(RuntimeError):
+        autocal.finish()
+
+def test_finish_rejects_outliers(sim):
+    mono, spec = sim
+    autocal = AutoCalibration(mono,spec.intensities,spec.wavelengths())
+    list(autocal.run(POSITIONS))
+    pos, p, perr, reason = autocal.points[3]
+    p = p.copy()
+    p[2] += 5
+    autocal.points[3] = (pos,p,perr,reason)
+    assert autocal.finish() == len(POSITIONS)-1
+    assert autocal.points[3][3] == "outlier"
+
+def test_stop_ends_run(sim):
+    mono, spec = sim
+    autocal = AutoCalibration(mono,spec.intensities,spec.wavelengths())
+    points = []
+    for point in autocal.run(np.linspace(16,30,40)):
+        points.append(point)
+        if len(points) == 3:
+            autocal.stop()
+    assert len(points) == 3
+    assert len(autocal.points) == 3
+
+def test_exposure_is_adjusted_per_point(sim):
+    from monochromator.exposure import AutoExposure
+    mono, spec = sim
+    spec.integration_time_micros(100000) # saturates every line
+    proc = SpectrumProcessor(len(spec.wavelengths()),'mean',n=2,dark=spec.dark)
+    autocal = AutoCalibration(mono,spec.intensities,spec.wavelengths(),process=proc.fill,
+                              exposure=AutoExposure(),set_it=spec.integration_time_micros,it=spec.it)
+    points = list(autocal.run(POSITIONS[:3]))
+    assert [reason for pos,p,perr,reason,y in points] == [None]*3
+    assert autocal.it == spec.it < 100000
+    assert all(0.5*spec.saturation < np.max(y) < spec.saturation for pos,p,perr,reason,y in points)
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from monochromator.calibration import Calibration, CalibrationAccumulator
+
+WAVE = np.linspace(420,780,9)
+POS = 47-0.04*WAVE+1e-5*(WAVE-600)**2
+
+@pytest.mark.parametrize("model,deg",[('linear',None),('poly',2),('poly',3)])
+def test_to_wave_inverts_to_pos(model,deg):
+    cal = Calibration(WAVE,POS,model,deg)
+    lam = np.linspace(430,770,101)
+    assert np.allclose(cal.to_wave(cal.to_pos(lam)),lam,atol=1e-3)
+    assert cal.to_pos(600.0).shape == ()
+
+def test_spline_inverts_to_pos():
+    pytest.importorskip("scipy")
+    cal = Calibration(WAVE,POS,'spline')
+    lam = np.linspace(430,770,101)
+    assert np.allclose(cal.to_wave(cal.to_pos(lam)),lam,atol=1e-3)
+
+def test_poly_fits_curvature():
+    assert np.allclose(Calibration(WAVE,POS,'poly',2).residuals(),0,atol=1e-9)
+    assert np.max(np.abs(Calibration(WAVE,POS).residuals())) > 1e-3
+
+def test_nonlinear_to_wave_is_nan_outside_table():
+    cal = Calibration(WAVE,POS,'poly',2)
+    assert np.isnan(cal.to_wave(0.0))
+
+def test_weights_exclude_points():
+    pos = POS.copy()
+    pos[0] += 1 # an outlier
+    cal = Calibration(WAVE,pos,'poly',2,weights=np.r_[0,np.ones(len(WAVE)-1)])
+    assert np.allclose(cal.residuals()[1:],0,atol=1e-9)
+
+def test_needs_two_points():
+    with pytest.raises(ValueError):
+        Calibration(WAVE[:2],POS[:2],weights=[1,0])
+    with pytest.raises(ValueError):
+        Calibration(WAVE,POS,'cubic')
+
+def test_accumulator_matches_polyfit():
+    rng = np.random.default_rng(0)
+    pos = 47-0.04*WAVE+rng.normal(0,1e-3,len(WAVE))
+    weights = rng.uniform(0.5,2,len(WAVE))
+    acc = CalibrationAccumulator(WAVE,pos,weights)
+    (b, a), cov = np.polyfit(WAVE,pos,1,w=np.sqrt(weights),cov='unscaled')
+    r = pos-(a+b*WAVE)
+    sigma2 = np.sum(weights*r**2)/(len(WAVE)-2)
+    assert (acc.a, acc.b) == (pytest.approx(a), pytest.approx(b))
+    assert acc.sigma**2 == pytest.approx(sigma2)
+    assert np.allclose(acc.covariance,sigma2*cov[::-1,::-1])
+
+def test_accumulator_remove_and_reweight():
+    pos = POS.copy()
+    pos[2] += 0.5
+    acc = CalibrationAccumulator(WAVE,pos)
+    acc.reweight(2,0)
+    assert acc.n == len(WAVE)-1
+    b, a = np.polyfit(np.delete(WAVE,2),np.delete(pos,2),1)
+    assert (acc.a, acc.b) == (pytest.approx(a), pytest.approx(b))
+    acc.remove(0)
+    with pytest.raises(KeyError):
+        acc.remove(0)
+    acc.reweight(2,1)
+    b, a = np.polyfit(WAVE[1:],pos[1:],1)
+    assert (acc.a, acc.b) == (pytest.approx(a), pytest.approx(b))
+
+def test_fold_point_keeps_calibration_consistent(sim):
+    mono, spec = sim
+    shift = mono.fold_point(mono.get_pos(700)+0.01,700,1.7)
+    assert 0 < shift < 0.01
+    cal = mono.calibration
+    assert len(cal.wave) == 6
+    assert np.allclose(cal.residuals(),cal.pos-(cal.a+cal.b*cal.wave))
+    assert np.allclose(cal.wave,np.polyval(np.polyfit(cal.pos,cal.wave,1),cal.pos),atol=1)
+
+def test_weights_survive_cal_round_trip(tmp_path,sim):
+    mono, spec = sim
+    mono.fold_point(mono.get_pos(700)+0.01,700,1.7,weight=4.0)
+    mono.remove_point(0)
+    before = mono.get_pos([450,550,650])
+    fname = mono.save_calibration_points(str(tmp_path),fmt='cal')
+    mono.reset_calibration()
+    assert mono.load_calibration_points(fname)
+    assert np.allclose(mono.calibration.weights,[1,1,1,1,4])
+    assert np.allclose(mono.get_pos([450,550,650]),before)
+
+def test_reweighting_updates_points_lazily(sim):
+    mono, spec = sim
+    mono.weight_point(1,3.0)
+    assert np.allclose(mono.calibration.weights,[1,3,1,1,1])
+    mono.weight_point(1,1.0)
+    assert mono.accumulator.unweighted
+    assert mono.calibration.weights is None
+    assert len(mono.calibration.residuals()) == 5
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from monochromator.drift import DriftCheck
+
+def drift(spec,offset,scale=1.0):
+    truth = spec.to_wave
+    spec.to_wave = lambda mm: offset+scale*truth(mm)
+
+def test_no_drift_is_left_alone(sim):
+    mono, spec = sim
+    before = mono.get_pos([450,650])
+    result = DriftCheck(mono,spec.intensities,spec.wavelengths()).run()
+    assert not result['applied']
+    assert np.allclose(mono.get_pos([450,650]),before)
+
+def test_offset_and_scale_are_corrected_once(sim):
+    mono, spec = sim
+    drift(spec,-0.6,1.002)
+    check = DriftCheck(mono,spec.intensities,spec.wavelengths())
+    result = check.run()
+    assert result['applied']
+    assert result['scale'] == pytest.approx(1.002,abs=5*result['scale_error']+1e-4)
+    # the corrected calibration now points at the drifted lines
+    assert np.all(np.abs(check.run(apply=False)['shift']) < check.minShift)
+    assert not any(check.run()['applied'] for _ in range(3))
+
+def test_single_line_corrects_offset(sim):
+    mono, spec = sim
+    drift(spec,0.3)
+    check = DriftCheck(mono,spec.intensities,spec.wavelengths(),waves=[600])
+    result = check.run()
+    assert result['applied'] and result['scale'] == 1.0
+    assert result['offset'] == pytest.approx(0.3,abs=0.05)
+    assert not check.run()['applied']
+
+def test_large_drift_needs_recalibration(sim):
+    mono, spec = sim
+    drift(spec,3.0)
+    before = mono.get_pos([450,650])
+    result = DriftCheck(mono,spec.intensities,spec.wavelengths()).run()
+    assert not result['within_tolerance'] and not result['applied']
+    assert np.allclose(mono.get_pos([450,650]),before)
+
+def test_needs_a_line(sim):
+    mono, spec = sim
+    spec.rate = 0
+    with pytest.raises(RuntimeError):
+        DriftCheck(mono,spec.intensities,spec.wavelengths()).measure()
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from monochromator.fitting import gauss, fit_gauss, fit_gauss_batch
+
+X = np.linspace(400,700,1024)
+
+def noisy(p,seed=0,x=X):
+    rng = np.random.default_rng(seed)
+    y = gauss(x,p)
+    return y+rng.normal(0,1,len(x))*np.sqrt(25+y)
+
+def test_fit_gauss_recovers_line():
+    p = [100,5000,552.3,1.2]
+    fit, perr = fit_gauss(X,noisy(p),x0=550,half=20)
+    assert np.all(np.isfinite(perr))
+    assert abs(fit[2]-p[2]) < 5*perr[2]
+    assert abs(fit[3]-p[3]) < 5*perr[3]
+    assert abs(fit[1]-p[1]) < 5*perr[1]
+
+def test_fit_gauss_ignores_lines_outside_window():
+    y = noisy([100,5000,552.3,1.2])+gauss(X,[0,20000,600,1.2])
+    fit, perr = fit_gauss(X,y,x0=552,half=20)
+    assert abs(fit[2]-552.3) < 0.05
+
+def test_fit_gauss_from_guess():
+    p = [100,5000,552.3,1.2]
+    y = noisy(p)
+    fit, perr = fit_gauss(X,y,p0=[0,4000,551,2],x0=552,half=20)
+    assert np.allclose(fit,fit_gauss(X,y,x0=552,half=20)[0],rtol=1e-4)
+
+def test_fit_gauss_errors_match_scatter():
+    p = [100,5000,552.3,1.2]
+    fits = np.array([fit_gauss(X,noisy(p,seed),x0=552,half=20) for seed in range(40)])
+    centers, errs = fits[:,0,2], fits[:,1,2]
+    assert 0.5 < np.std(centers)/np.mean(errs) < 2
+
+def test_fit_gauss_flat_spectrum_is_degenerate():
+    fit, perr = fit_gauss(X[:4],np.ones(4))
+    assert np.all(np.isnan(perr))
+
+def stack(m,seed=1):
+    rng = np.random.default_rng(seed)
+    y = gauss(X,[100,5000,552.3,1.2])+gauss(X,[0,3000,560,1.0])
+    y = np.repeat(y[None],m,axis=0)
+    return y+rng.normal(size=y.shape)*np.sqrt(25+y)
+
+def test_batch_fits_both_peaks():
+    res = fit_gauss_batch(X,stack(100),[552,560],half=10)
+    assert np.all(res['converged'])
+    assert np.allclose(np.mean(res['center'],axis=0),[552.3,560],atol=0.01)
+    assert np.allclose(np.mean(res['amplitude'],axis=0),[5000,3000],rtol=0.01)
+    # the errors match the scatter of the fits
+    assert np.all(np.abs(np.std(res['center'],axis=0)/np.mean(res['center_err'],axis=0)-1) < 0.3)
+
+def test_batch_matches_single_fits():
+    y = stack(3)
+    res = fit_gauss_batch(X,y,[552.3],half=3)
+    for i in range(3):
+        p, perr = fit_gauss(X,y[i],x0=552.3,half=3)
+        assert res['center'][i,0] == pytest.approx(p[2],abs=1e-4)
+        assert res['center_err'][i,0] == pytest.approx(perr[2],rel=1e-2)
+
+def test_batch_per_spectrum_seeds_and_workers():
+    y = stack(40)
+    seeds = np.tile([551.5,560.5],(40,1))
+    serial = fit_gauss_batch(X,y,seeds,half=10,chunk=16)
+    pooled = fit_gauss_batch(X,y,seeds,half=10,chunk=16,workers=2)
+    assert np.all(serial['converged'])
+    assert np.allclose(serial['p'],pooled['p'])
@@ -0,0 +1,108 @@
+from time import sleep, time
+import numpy as np
+import pytest
+
+def test_scan_visits_wavelengths_in_order(sim):
+    mono, spec = sim
+    x = spec.wavelengths()
+    waves = [450,500,550,600,650]
+    results = list(mono.scan(waves,spec.intensities,lambda lam, y: x[np.argmax(y)]))
+    assert [lam for lam,pos,peak in results] == waves
+    assert np.allclose([pos for lam,pos,peak in results],mono.get_pos(waves),atol=2*mono.mot.tol)
+    assert np.allclose([peak for lam,pos,peak in results],waves,atol=1)
+
+def test_scan_plan_reorders(sim):
+    mono, spec = sim
+    waves = [600,450,650,500]
+    results = list(mono.scan(waves,spec.intensities,plan='sorted'))
+    assert sorted(lam for lam,pos,y in results) == sorted(waves)
+    assert len(results) == 4
+
+def test_scan_in_mm(sim):
+    mono, spec = sim
+    results = list(mono.scan([20.0,25.0],spec.intensities,units='mm'))
+    assert np.allclose([pos for lam,pos,y in results],[20.0,25.0],atol=2*mono.mot.tol)
+
+def test_scan_reraises_process_errors(sim):
+    mono, spec = sim
+    def process(lam,y):
+        raise ValueError("bad frame")
+    with pytest.raises(ValueError):
+        list(mono.scan([450,500],spec.intensities,process))
+
+def test_async_moves_run_in_order(sim):
+    mono, spec = sim
+    futures = [mono.mot.mAbsAsync(p) for p in (20.0,25.0,22.0)]
+    futures.append(mono.move_async(21.0))
+    assert np.allclose([f.result(timeout=10) for f in futures],[20.0,25.0,22.0,21.0],atol=mono.mot.tol)
+    assert mono.mot.mRelAsync(1.0).result(timeout=10) == pytest.approx(22.0,abs=mono.mot.tol)
+
+def test_async_move_times_out(sim,monkeypatch):
+    mono, spec = sim
+    getPos = mono.mot.getPos
+    monkeypatch.setattr(mono.mot,'getPos',lambda: getPos()+0.002) # never within tol
+    mono.mot.moveTimeout = 0.05
+    with pytest.raises(TimeoutError):
+        mono.move_async(20.0).result(timeout=10)
+
+def test_fly_scan_assigns_wavelengths():
+    from monochromator.benchmark import simulated_setup
+    mono, spec = simulated_setup(timescale=0.05)
+    try:
+        x = spec.wavelengths()
+        waves, spectra, positions, times = mono.fly_scan(500,600,spec.intensities)
+        assert len(waves) > 10
+        assert np.all((waves >= 500-1e-6) & (waves <= 600+1e-6))
+        assert np.all(np.diff(times) > 0)
+        # each frame sees the line the calibration puts at its wavelength,
+        # within the bandpass swept during one exposure
+        assert np.allclose(x[np.argmax(spectra,axis=1)],waves,atol=3)
+        assert mono.mot.getVelocityParameters()[2] == pytest.approx(2.0)
+    finally:
+        mono.shutdown()
+
+def test_fly_scan_reraises_sampler_errors(monkeypatch):
+    from monochromator.benchmark import simulated_setup
+    mono, spec = simulated_setup(timescale=0.05)
+    try:
+        getPos = mono.mot.getPos
+        calls = []
+        def failing():
+            calls.append(1)
+            if len(calls) > 5:
+                raise OSError("USB read failed")
+            return getPos()
+        mono.move(mono.get_pos(500)-1)
+        monkeypatch.setattr(mono.mot,'getPos',failing)
+        with pytest.raises(OSError):
+            mono.fly_scan(500,600,spec.intensities)
+        assert mono.mot.getVelocityParameters()[2] == pytest.approx(2.0)
+    finally:
+        mono.shutdown()
+
+def test_known_pos_during_async_move():
+    from monochromator.benchmark import simulated_setup
+    mono, spec = simulated_setup(timescale=0.05)
+    try:
+        mono.move(20.0)
+        future = mono.mot.mAbsAsync(25.0)
+        deadline = time()+5
+        while mono.mot.commandedPos != 25.0:
+            assert time() < deadline, "the move was never commanded"
+            sleep(0.001)
+        mid = mono.mot.knownPos()
+        assert future.result(timeout=10) == pytest.approx(25.0,abs=mono.mot.tol)
+        assert 20.0-mono.mot.tol <= mid < 25.0
+        assert mono.mot.commandedPos == 25.0 # the reading in flight was not cached
+    finally:
+        mono.shutdown()
+
+def test_known_pos_skips_dll_reads(sim,monkeypatch):
+    mono, spec = sim
+    mono.move(20.0)
+    reads = []
+    getPos = mono.mot.getPos
+    monkeypatch.setattr(mono.mot,'getPos',lambda: reads.append(1) or getPos())
+    mono.mot.movesSinceRead = 0
+    assert mono.mot.knownPos() == 20.0
+    assert reads == []
@@ -0,0 +1,82 @@
+import signal
+import subprocess
+import sys
+import numpy as np
+import pytest
+from conftest import ROOT
+from monochromator.session import ScanWriter, load_scan, load_session
+
+CRASH = '''
+import os, signal, sys
+import numpy as np
+from monochromator.benchmark import simulated_setup
+from monochromator.session import ScanWriter
+mono, spec = simulated_setup()
+writer = ScanWriter(sys.argv[1],spec.wavelengths(),chunk=16,flushEvery=8)
+def process(lam,y):
+    if lam >= 550:
+        os.kill(os.getpid(),signal.SIGKILL)
+    return y
+for _ in mono.scan(np.arange(450,650,2.0),spec.intensities,process,writer=writer,it=spec.it):
+    pass
+'''
+
+def test_scan_survives_kill(tmp_path):
+    path = str(tmp_path/"run.scan")
+    proc = subprocess.run([sys.executable,"-c",CRASH,path],cwd=ROOT,timeout=60)
+    assert proc.returncode == -signal.SIGKILL
+    scan = load_scan(path)
+    assert scan.incomplete
+    # everything up to the last flush survives, and nothing past the kill
+    assert 48 <= len(scan) < 100
+    assert np.all(scan.meta['it'] == 10000)
+    assert np.all(np.diff(scan.meta['wavelength']) == 2)
+    assert np.all(scan.meta['start'] <= scan.meta['stop'])
+    assert np.all(scan.meta['stop'] > 0)
+    assert scan[len(scan)-1].shape == scan.axis.shape
+    assert np.max(scan[-1]) > 1000
+
+def test_closed_scan_is_complete(tmp_path,sim):
+    mono, spec = sim
+    path = str(tmp_path/"run.scan")
+    with ScanWriter(path,spec.wavelengths(),chunk=4,sample="test") as writer:
+        results = list(mono.scan([450,500,550,600,650],spec.intensities,writer=writer,it=spec.it))
+    scan = load_scan(path)
+    assert not scan.incomplete
+    assert len(scan) == 5
+    assert scan.attrs == {"sample":"test"}
+    assert np.allclose(scan.meta['wavelength'],[450,500,550,600,650])
+    assert np.allclose(scan[:],[y for lam,pos,y in results])
+
+def test_scan_needs_integration_time(tmp_path,sim):
+    mono, spec = sim
+    with ScanWriter(str(tmp_path/"run.scan"),spec.wavelengths()) as writer:
+        with pytest.raises(ValueError):
+            list(mono.scan([450,500],spec.intensities,writer=writer))
+
+def test_session_round_trip(tmp_path,sim):
+    mono, spec = sim
+    mono.create_calibration('poly',2)
+    spectra = np.array([spec.intensities() for _ in range(3)])
+    fname = mono.save_calibration_points(str(tmp_path),spectra=spectra,positions=[20.0,21.0,22.0],
+                                         wavelengths=spec.wavelengths())
+    session = load_session(fname)
+    assert (session.model, session.deg) == ('poly',2)
+    assert isinstance(session.spectra,np.memmap)
+    assert np.array_equal(session.spectra,spectra)
+    assert np.array_equal(session.wavelengths,spec.wavelengths())
+    before = mono.get_pos([450,550,650])
+    mono.reset_calibration()
+    assert mono.load_calibration_points(fname)
+    assert mono.calibration.model == 'poly'
+    assert np.allclose(mono.get_pos([450,550,650]),before)
+
+def test_legacy_cal_round_trip(tmp_path,sim):
+    mono, spec = sim
+    fname = mono.save_calibration_points(str(tmp_path),fmt='cal')
+    with open(fname) as f:
+        assert len(f.readlines()) == 4 # positions, wavelengths, fwhm, coefficients
+    before = mono.get_pos([450,550,650])
+    mono.reset_calibration()
+    assert mono.load_calibration_points(fname)
+    assert np.allclose(mono.get_pos([450,550,650]),before)